@@ -0,0 +1,187 @@
+# --------------------------------------------------------
+# Benchmark of the NumPy viewshed pipeline on synthetic urban surfaces
+# Times viewshed generation, cumulative summation, observer selection and visibility lookup at several scales,
+# writes a JSON report and compares it against a saved baseline
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import CumulativeCount
+import ObserverSolver
+import SyntheticUrban
+import VisibilityLookup
+import VisibilityStore
+
+# Benchmark scales: surface size (cells), cell size (meters), buildings and trees, flight altitude above the highest
+# surface cell, flight line spacing and waypoint interval (meters). Flight settings can be overridden for all scales.
+SCALES = {
+    'small': {'nrows': 100, 'ncols': 100, 'cellsize': 2.0, 'nbldgs': 40, 'ntrees': 60,
+              'altitude': 5.0, 'spacing': 40.0, 'interval': 30.0},
+    'medium': {'nrows': 200, 'ncols': 200, 'cellsize': 2.0, 'nbldgs': 150, 'ntrees': 250,
+               'altitude': 5.0, 'spacing': 40.0, 'interval': 30.0},
+    'large': {'nrows': 300, 'ncols': 300, 'cellsize': 2.0, 'nbldgs': 350, 'ntrees': 550,
+              'altitude': 5.0, 'spacing': 60.0, 'interval': 45.0},
+}
+# Number of random observer locations looked up
+LOOKUPS = 10000
+# Relative slowdown (or memory growth) reported as a regression, wide enough for run to run timing noise
+TOLERANCE = 0.5
+# Timings below this are too noisy to compare (seconds)
+MINSECONDS = 0.05
+
+
+class Stage(object):
+    """
+    Context manager timing a benchmark stage and tracking its peak traced memory (NumPy allocations included).
+    :param results: Dict the stage results are added to
+    :param name: Stage name
+    """
+    def __init__(self, results, name):
+        self.results = results
+        self.name = name
+
+    def __enter__(self):
+        tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.results[self.name] = {'seconds': seconds, 'peak_mb': peak / 1024.0 ** 2}
+        print('  {}: {:.3f}s, peak {:.1f} MB'.format(self.name, seconds, peak / 1024.0 ** 2))
+
+
+def runscale(name, nrows, ncols, cellsize, nbldgs, ntrees, altitude, spacing, interval, seed=0, mode='greedy'):
+    """
+    Runs every pipeline stage on one synthetic surface and flight path.
+    :param name: Scale name
+    :param seed: Random seed of the surface and lookup locations
+    :param mode: ObserverSolver mode
+    :return: Dict of input sizes and stage results
+    """
+    print('Scale {} ({} x {} cells)...'.format(name, nrows, ncols))
+    surface = SyntheticUrban.urbansurface(nrows, ncols, cellsize, nbldgs, seed, ntrees)
+    mask = SyntheticUrban.groundmask(surface)
+    xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude, spacing, interval)
+    stages = {}
+    workdir = tempfile.mkdtemp()
+    try:
+        with Stage(stages, 'viewshed'):
+            store = VisibilityStore.createstore(os.path.join(workdir, 'vis'), surface, mask,
+                                                np.arange(1, len(xs) + 1))
+            VisibilityStore.fillstore(store, surface, xs, ys, zs)
+        with Stage(stages, 'cumulative'):
+            counts = CumulativeCount.CumulativeCount(store).counts
+        with Stage(stages, 'selection'):
+            selected = ObserverSolver.solve(store, mode)
+        rng = np.random.RandomState(seed)
+        width = ncols * cellsize
+        height = nrows * cellsize
+        lx = surface.xmin + rng.uniform(0, width, LOOKUPS)
+        ly = surface.ymax - rng.uniform(0, height, LOOKUPS)
+        with Stage(stages, 'lookup'):
+            seen = VisibilityLookup.visibilitymatrix(store, lx, ly).sum()
+        del store
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'cells': nrows * ncols, 'candidate_cells': int(mask.sum()), 'flight_points': len(xs),
+            'altitude': altitude, 'spacing': spacing, 'interval': interval,
+            'max_count': int(counts.max()) if len(counts) else 0, 'observers': len(selected),
+            'lookups': LOOKUPS, 'lookup_hits': int(seen), 'stages': stages}
+
+
+def benchmark(scales=None, mode='greedy', **flight):
+    """
+    Runs the benchmark at several scales.
+    :param scales: List of SCALES names, all scales if None
+    :param mode: ObserverSolver mode
+    :param flight: Flight path settings (altitude, spacing, interval) overriding those of every scale
+    :return: Report dict
+    """
+    report = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+              'processor': platform.processor(), 'mode': mode, 'scales': {}}
+    start = time.perf_counter()
+    for name in scales or sorted(SCALES, key=lambda s: SCALES[s]['nrows'] * SCALES[s]['ncols']):
+        settings = dict(SCALES[name], **{k: v for k, v in flight.items() if v is not None})
+        report['scales'][name] = runscale(name, mode=mode, **settings)
+    report['seconds'] = time.perf_counter() - start
+    try:
+        import resource
+        # ru_maxrss is reported in kilobytes on Linux
+        report['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    except ImportError:
+        pass
+    return report
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """
+    Compares a report against a baseline report. Results change when the observers found, input sizes or flight
+    settings differ; stages regress when they are slower or use more peak memory than the baseline by more than the
+    tolerance.
+    :param report: Report dict from benchmark()
+    :param baseline: Baseline report dict
+    :param tolerance: Relative change reported as a regression
+    :return: List of regression messages, empty if none
+    """
+    regressions = []
+    for name, scale in sorted(report['scales'].items()):
+        base = baseline['scales'].get(name)
+        if base is None:
+            continue
+        for key in ['cells', 'candidate_cells', 'altitude', 'spacing', 'interval', 'flight_points', 'observers',
+                    'lookup_hits']:
+            # Baselines written before flight settings were reported do not have them
+            if key not in base:
+                continue
+            if scale[key] != base[key]:
+                regressions.append('{} {}: {} (baseline {})'.format(name, key, scale[key], base[key]))
+        for stage, result in sorted(scale['stages'].items()):
+            was = base['stages'].get(stage)
+            if was is None:
+                continue
+            if result['seconds'] > max(was['seconds'], MINSECONDS) * (1 + tolerance):
+                regressions.append('{} {}: {:.3f}s (baseline {:.3f}s, {:+.0f}%)'.format(
+                    name, stage, result['seconds'], was['seconds'],
+                    (result['seconds'] / max(was['seconds'], 1e-9) - 1) * 100))
+            if result['peak_mb'] > max(was['peak_mb'], 1.0) * (1 + tolerance):
+                regressions.append('{} {}: peak {:.1f} MB (baseline {:.1f} MB)'.format(
+                    name, stage, result['peak_mb'], was['peak_mb']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the NumPy viewshed pipeline on synthetic surfaces.')
+    parser.add_argument('--scales', nargs='+', choices=sorted(SCALES), help='Scales to run (default: all)')
+    parser.add_argument('--mode', default='greedy', choices=sorted(ObserverSolver.SOLVERS), help='Observer solver')
+    parser.add_argument('--altitude', type=float,
+                        help='Flight altitude above the highest surface cell (meters, default: per scale)')
+    parser.add_argument('--spacing', type=float, help='Flight line spacing (meters, default: per scale)')
+    parser.add_argument('--interval', type=float,
+                        help='Waypoint interval along a flight line (meters, default: per scale)')
+    parser.add_argument('--output', default='benchmark.json', help='JSON report path')
+    parser.add_argument('--baseline', help='Baseline JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Relative change reported as regression')
+    args = parser.parse_args()
+
+    report = benchmark(args.scales, args.mode, altitude=args.altitude, spacing=args.spacing, interval=args.interval)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('Benchmark report written to {}'.format(args.output))
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for r in regressions:
+            print('REGRESSION {}'.format(r))
+        print('{} regressions against {}'.format(len(regressions), args.baseline))
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,93 @@
+# --------------------------------------------------------
+# Best observer selection on cumulative viewshed counts
+# Masked argmax with a mean center distance tie-break, written to a preallocated best observers table
+# --------------------------------------------------------
+
+import csv
+import numpy as np
+
+# Columns of the best observers table, as written by FindBestObservers.py
+BEST_COLUMNS = ['POINT_X', 'POINT_Y', 'PASS_VIS', 'PASS_CVRG', 'OBSRVR_VIS', 'OBSRVR_CVRG', 'CUMULATIVE_CVRG']
+BEST_DTYPE = np.dtype([('POINT_X', np.float64), ('POINT_Y', np.float64), ('PASS_VIS', np.int64),
+                       ('PASS_CVRG', np.float64), ('OBSRVR_VIS', np.int64), ('OBSRVR_CVRG', np.float64),
+                       ('CUMULATIVE_CVRG', np.float64)])
+
+
+def besttable(npasses):
+    """
+    Preallocates the best observers table.
+    :param npasses: Maximum number of passes
+    :return: Structured array with BEST_DTYPE fields
+    """
+    return np.zeros(npasses, dtype=BEST_DTYPE)
+
+
+def nearestcenter(ties, xs, ys, valid):
+    """
+    Picks among equally good cells the one closest to the mean center of all valid cells (the MeanCenter and
+    PointDistance tie-break of the original workflow).
+    :param ties: Sorted array of flat indices of the tied cells
+    :param xs, ys: Arrays of cell X and Y coordinates
+    :param valid: Boolean array of cells in the cumulative viewshed (non-null)
+    :return: Flat index of the chosen cell
+    """
+    if len(ties) == 1:
+        return int(ties[0])
+    xs = np.ravel(xs)
+    ys = np.ravel(ys)
+    valid = np.ravel(valid)
+    mx = xs[valid].mean()
+    my = ys[valid].mean()
+    return int(ties[np.argmin(np.hypot(xs[ties] - mx, ys[ties] - my))])
+
+
+def selectbest(counts, xs, ys):
+    """
+    Finds the best observer cell: highest count, ties broken by distance to the mean center.
+    Cells that are null, NaN or zero are not observers.
+    :param counts: Array of cumulative viewshed counts
+    :param xs, ys: Arrays of cell X and Y coordinates, shaped like counts
+    :return: Flat index of the best cell, -1 if no cell sees any flight point
+    """
+    counts = np.ravel(counts)
+    with np.errstate(invalid='ignore'):
+        valid = counts > 0
+    if not valid.any():
+        return -1
+    best = counts[valid].max()
+    return nearestcenter(np.flatnonzero(valid & (counts == best)), xs, ys, valid)
+
+
+def fillcoverage(best, passleft, npoints):
+    """
+    Computes the coverage columns of the best observers table from PASS_VIS and OBSRVR_VIS.
+    :param best: Structured array with BEST_DTYPE fields, one row per pass
+    :param passleft: Array of unseen flight points at the start of each pass
+    :param npoints: Total number of flight points
+    """
+    best['PASS_CVRG'] = best['PASS_VIS'] / np.maximum(np.asarray(passleft, dtype=np.float64), 1) * 100
+    best['OBSRVR_CVRG'] = best['OBSRVR_VIS'] / float(npoints) * 100
+    best['CUMULATIVE_CVRG'] = np.cumsum(best['PASS_VIS']) / float(npoints) * 100
+
+
+def writetable(table, path, index=False):
+    """
+    Writes a structured array (e.g. a best observers, responsibility segments or timing table) to CSV in one pass.
+    :param table: Structured array, one CSV column per field
+    :param path: Output CSV path
+    :param index: True for a leading row index column like DataFrame.to_csv
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([''] + list(table.dtype.names) if index else list(table.dtype.names))
+        for i, row in enumerate(table.tolist()):
+            writer.writerow([i] + list(row) if index else list(row))
+
+
+def writebest(best, path):
+    """
+    Writes the best observers table to CSV, with a leading row index like DataFrame.to_csv.
+    :param best: Structured array with BEST_DTYPE fields
+    :param path: Output CSV path
+    """
+    writetable(best, path, index=True)
@@ -0,0 +1,267 @@
+# --------------------------------------------------------
+# Concurrent observer planning for all study area quads of the campus
+# Quads listed in a manifest run in parallel on one tiled campus surface and a shared viewshed cache, so flight
+# points whose 500 m radius crosses a quad border reuse the same tiles and viewsheds
+# --------------------------------------------------------
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import BestSelect
+import FlightPoints
+import ObserverSolver
+import VisibilityStore
+from TiledSurface import TiledSurface
+from ViewshedCache import ViewshedCache, cachedviewshed
+
+# Best observers of all quads: quad name, pass number within the quad, then the BestSelect columns
+CAMPUS_DTYPE = np.dtype([('QUAD', 'U32'), ('PASS', np.int64)] + BestSelect.BEST_DTYPE.descr)
+# Per-quad timing summary
+TIMING_DTYPE = np.dtype([('QUAD', 'U32'), ('FLIGHT_PTS', np.int64), ('CANDIDATE_CELLS', np.int64),
+                         ('OBSERVERS', np.int64), ('CACHE_HITS', np.int64), ('CACHE_MISSES', np.int64),
+                         ('LOAD_SECS', np.float64), ('VIEWSHED_SECS', np.float64), ('SELECT_SECS', np.float64),
+                         ('TOTAL_SECS', np.float64), ('WORKER', np.int64)])
+
+
+def readmanifest(path):
+    """
+    Reads a campus manifest. Paths are relative to the manifest's directory.
+    {"surface": campus tile directory, "cache": viewshed cache directory, "output": output directory,
+     "mode": ObserverSolver mode, "quads": [{"name": "SE", "flightpts": flight point file, "mask": .npy observer
+     mask shaped like the surface, "surface": optional tile directory of this quad,
+     "extent": optional [xmin, ymin, xmax, ymax] of candidate observer cells, "climb": optional altitude added to
+     every flight point of this quad (meters), "stride": optional n to keep every n-th flight point}, ...]}
+    :param path: Path to manifest JSON file
+    :return: Manifest dict with absolute paths
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    root = os.path.dirname(os.path.abspath(path))
+    for key in ['surface', 'cache', 'output']:
+        if manifest.get(key):
+            manifest[key] = os.path.join(root, manifest[key])
+    manifest.setdefault('output', os.path.join(root, 'campus'))
+    names = [quad['name'] for quad in manifest['quads']]
+    if len(set(names)) != len(names):
+        raise ValueError('Duplicate quad names in {}'.format(path))
+    for quad in manifest['quads']:
+        for key in ['flightpts', 'mask', 'surface']:
+            if quad.get(key):
+                quad[key] = os.path.join(root, quad[key])
+        quad.setdefault('surface', manifest.get('surface'))
+        if not quad['surface']:
+            raise ValueError('No surface for quad {}'.format(quad['name']))
+    return manifest
+
+
+def extentwindow(surface, extent):
+    """
+    Finds the window of cells whose centers fall within an extent, like clipping to the StudyArea polygon extent.
+    :param surface: NumpyViewshed.Surface or TiledSurface object
+    :param extent: [xmin, ymin, xmax, ymax]
+    :return: Tuple (r0, r1, c0, c1) of window bounds, end exclusive (empty when no center falls within the extent)
+    """
+    xs = surface.cellxy(0, np.arange(surface.shape[1]))[0]
+    ys = surface.cellxy(np.arange(surface.shape[0]), 0)[1]
+    cols = np.flatnonzero((xs >= extent[0]) & (xs <= extent[2]))
+    rows = np.flatnonzero((ys >= extent[1]) & (ys <= extent[3]))
+    if not len(rows) or not len(cols):
+        return 0, 0, 0, 0
+    return int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+
+
+class WindowMask(object):
+    """
+    Observer mask limited to a window, sliced like a surface-shaped array (two slices) without building one. Only
+    the part of the mask inside the window is read, so a memory-mapped campus mask is never loaded whole.
+    :param mask: Array shaped like the surface, True where a ground observer may stand
+    :param window: Tuple (r0, r1, c0, c1) of window bounds, end exclusive
+    """
+    def __init__(self, mask, window):
+        self.mask = mask
+        self.window = window
+        self.shape = mask.shape
+
+    def __getitem__(self, key):
+        rows, cols = key
+        r0, r1 = rows.indices(self.shape[0])[:2]
+        c0, c1 = cols.indices(self.shape[1])[:2]
+        out = np.zeros((max(r1 - r0, 0), max(c1 - c0, 0)), dtype=bool)
+        a0, a1 = max(r0, self.window[0]), min(r1, self.window[1])
+        b0, b1 = max(c0, self.window[2]), min(c1, self.window[3])
+        if a0 < a1 and b0 < b1:
+            out[a0 - r0:a1 - r0, b0 - c0:b1 - c0] = self.mask[a0:a1, b0:b1]
+        return out
+
+
+def runquad(quad, cachepath, output, mode='greedy', params=None):
+    """
+    Runs viewsheds and observer selection for one quad.
+    :param quad: Quad dict from the manifest
+    :param cachepath: Shared ViewshedCache directory, no caching if None
+    :param output: Output directory, the quad's store goes to <output>/<name>
+    :param mode: ObserverSolver mode
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: Tuple of (best observers array, dict of pass number to visible OBJECTIDs, timing tuple)
+    """
+    params = params or {}
+    start = time.time()
+    surface = TiledSurface(quad['surface'])
+    pts = FlightPoints.readflightpoints(quad['flightpts'])[::quad.get('stride', 1)]
+    pts['Z'] += quad.get('climb', 0.0)
+    window = (0, surface.shape[0], 0, surface.shape[1])
+    if quad.get('extent'):
+        window = extentwindow(surface, quad['extent'])
+    mask = WindowMask(np.load(quad['mask'], mmap_mode='r'), window)
+    store = VisibilityStore.createstore(os.path.join(output, quad['name']), surface, mask, pts['OID'])
+    tload = time.time() - start
+
+    t = time.time()
+    hits = misses = 0
+    if cachepath is None:
+        VisibilityStore.fillstore(store, surface, pts['X'], pts['Y'], pts['Z'], direction='forward', **params)
+    else:
+        hits, misses = cachedviewshed(surface, pts['X'], pts['Y'], pts['Z'], store, ViewshedCache(cachepath),
+                                      **params)
+    tview = time.time() - t
+
+    t = time.time()
+    selected = ObserverSolver.solve(store, mode)
+    best, obsvis = ObserverSolver.besttable(store, selected)
+    tselect = time.time() - t
+    timing = (quad['name'], store.npoints, store.ncells, len(selected), hits, misses, tload, tview, tselect,
+              time.time() - start, os.getpid())
+    print('Quad {}: {} observers in {:.1f}s'.format(quad['name'], len(selected), time.time() - start))
+    return best, obsvis, timing
+
+
+def _runquad(args):
+    return runquad(*args)
+
+
+def schedule(manifest, processes=None, **params):
+    """
+    Runs all quads of a manifest concurrently, largest first, and writes the combined outputs:
+    bestobservers.csv (best observers of every quad), quad_timing.csv and observer_visibility.json.
+    :param manifest: Manifest dict from readmanifest()
+    :param processes: Number of worker processes, one per quad up to all cores if None
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: Tuple of (combined best observers array, timing summary array)
+    """
+    quads = manifest['quads']
+    output = manifest['output']
+    cachepath = manifest.get('cache')
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    # Quads with the most flight points start first so the slowest quad does not run alone at the end
+    sizes = [os.path.getsize(quad['flightpts']) for quad in quads]
+    order = sorted(range(len(quads)), key=lambda k: -sizes[k])
+    if processes is None:
+        processes = min(len(quads), mp.cpu_count())
+    tasks = [(quads[k], cachepath, output, manifest.get('mode', 'greedy'), params) for k in order]
+    print('Running {} quads on {} processes...'.format(len(quads), processes))
+    start = time.time()
+    if processes == 1:
+        results = [runquad(*task) for task in tasks]
+    else:
+        pool = mp.Pool(processes)
+        try:
+            results = pool.map(_runquad, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    # Back to manifest order
+    results = [results[order.index(k)] for k in range(len(quads))]
+
+    campus = np.zeros(sum(len(best) for best, obsvis, timing in results), dtype=CAMPUS_DTYPE)
+    timings = np.zeros(len(results), dtype=TIMING_DTYPE)
+    visibility = {}
+    row = 0
+    for k, (best, obsvis, timing) in enumerate(results):
+        name = timing[0]
+        block = campus[row:row + len(best)]
+        block['QUAD'] = name
+        block['PASS'] = np.arange(len(best))
+        for field in BestSelect.BEST_DTYPE.names:
+            block[field] = best[field]
+        row += len(best)
+        timings[k] = timing
+        visibility[name] = {str(ct): oids for ct, oids in obsvis.items()}
+    BestSelect.writebest(campus, os.path.join(output, 'bestobservers.csv'))
+    BestSelect.writetable(timings, os.path.join(output, 'quad_timing.csv'))
+    with open(os.path.join(output, 'observer_visibility.json'), 'w') as f:
+        json.dump(visibility, f)
+    print('{} quads complete in {:.1f}s, {} observers in total.'.format(len(quads), time.time() - start, len(campus)))
+    for t in timings:
+        print('{}: {} flight points, {} observers, viewsheds {:.1f}s ({} cached), selection {:.1f}s, '
+              'total {:.1f}s'.format(t['QUAD'], t['FLIGHT_PTS'], t['OBSERVERS'], t['VIEWSHED_SECS'],
+                                     t['CACHE_HITS'], t['SELECT_SECS'], t['TOTAL_SECS']))
+    return campus, timings
+
+
+def syntheticmanifest(path, nrows=200, ncols=200, cellsize=2.0, nbldgs=150, seed=0, altitude=5.0, spacing=40.0,
+                      interval=30.0, quadspecs=None):
+    """
+    Writes a synthetic campus split into four quads (NE, NW, SE, SW) with overlapping flight paths at the borders.
+    :param path: Directory for the surface tiles, masks, flight points and manifest
+    :param altitude: Flight altitude above the highest surface cell (meters)
+    :param spacing: Distance between flight lines (meters)
+    :param interval: Distance between waypoints along a flight line (meters)
+    :param quadspecs: Dict of quad name to extra quad spec keys (e.g. climb, stride), none if None
+    :return: Path to manifest JSON file
+    """
+    import SyntheticUrban
+    import TiledSurface as Tiles
+    surface = SyntheticUrban.urbansurface(nrows, ncols, cellsize, nbldgs, seed, ntrees=nbldgs)
+    Tiles.writetiles(surface, os.path.join(path, 'surface'), tilesize=64)
+    np.save(os.path.join(path, 'mask.npy'), SyntheticUrban.groundmask(surface))
+    xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude, spacing, interval)
+    width = ncols * cellsize
+    height = nrows * cellsize
+    xmid = surface.xmin + width / 2.0
+    ymid = surface.ymax - height / 2.0
+    # Flight paths extend one flight line past the quad border, as adjacent survey areas do
+    pad = spacing
+    quads = []
+    oids = np.arange(1, len(xs) + 1)
+    for name, (qx, qy) in [('NW', (0, 1)), ('NE', (1, 1)), ('SW', (0, 0)), ('SE', (1, 0))]:
+        xmin = surface.xmin if qx == 0 else xmid
+        xmax = xmid if qx == 0 else surface.xmin + width
+        ymin = ymid if qy == 1 else surface.ymax - height
+        ymax = surface.ymax if qy == 1 else ymid
+        inside = (xs >= xmin - pad) & (xs <= xmax + pad) & (ys >= ymin - pad) & (ys <= ymax + pad)
+        fltpts = 'FlightPts_{}.csv'.format(name)
+        with open(os.path.join(path, fltpts), 'w') as f:
+            f.write('{},{},{},{}\n'.format(FlightPoints.OID_FIELD, FlightPoints.X_FIELD, FlightPoints.Y_FIELD,
+                                          FlightPoints.Z_FIELD))
+            for row in zip(oids[inside].tolist(), xs[inside].tolist(), ys[inside].tolist(), zs[inside].tolist()):
+                f.write('{},{!r},{!r},{!r}\n'.format(*row))
+        quads.append(dict({'name': name, 'flightpts': fltpts, 'mask': 'mask.npy', 'extent': [xmin, ymin, xmax, ymax]},
+                          **(quadspecs or {}).get(name, {})))
+    manifest = os.path.join(path, 'campus.json')
+    with open(manifest, 'w') as f:
+        json.dump({'surface': 'surface', 'cache': 'ViewshedCache', 'output': 'campus', 'mode': 'greedy',
+                   'quads': quads}, f, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run observer planning for all quads of a campus manifest.')
+    parser.add_argument('manifest', nargs='?', help='Manifest JSON file (default: a synthetic four-quad campus)')
+    parser.add_argument('--processes', type=int, help='Number of worker processes')
+    parser.add_argument('--altitude', type=float, default=5.0,
+                        help='Synthetic campus flight altitude above the highest surface cell (meters)')
+    parser.add_argument('--spacing', type=float, default=40.0, help='Synthetic campus flight line spacing (meters)')
+    parser.add_argument('--interval', type=float, default=30.0,
+                        help='Synthetic campus waypoint interval along a flight line (meters)')
+    args = parser.parse_args()
+
+    manifest = args.manifest
+    if manifest is None:
+        import tempfile
+        manifest = syntheticmanifest(tempfile.mkdtemp(), altitude=args.altitude, spacing=args.spacing,
+                                     interval=args.interval)
+    schedule(readmanifest(manifest), args.processes)
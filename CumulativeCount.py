@@ -0,0 +1,76 @@
+# --------------------------------------------------------
+# Cumulative viewshed count kept in memory between passes
+# Updated by subtracting the viewsheds of newly observed flight points instead of re-summing every pass
+# --------------------------------------------------------
+
+import numpy as np
+
+
+class CumulativeCount(object):
+    """
+    Number of remaining unseen flight points visible from each candidate observer cell.
+    :param store: VisibilityStore object
+    :param unseen: Boolean mask of unseen flight points (rows), all flight points if None
+    :param counts: Counts over candidate cells already summed for the unseen flight points (e.g. while streaming
+                   viewsheds), summed from the store if None
+    :param weights: Array of flight point (row) weights (e.g. merged flight point groups), 1 each if None
+    """
+    def __init__(self, store, unseen=None, counts=None, weights=None):
+        self.store = store
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.int64)
+        if unseen is None:
+            self.unseen = np.ones(store.npoints, dtype=bool)
+        else:
+            self.unseen = np.array(unseen, dtype=bool)
+        if counts is None:
+            self.counts = store.popcount(self.unseen, self.weights)
+        else:
+            self.counts = np.asarray(counts, dtype=np.int64)
+
+    def remove(self, points):
+        """
+        Removes newly observed flight points from the count. Points already removed are ignored.
+        :param points: Array of row indices or Boolean row mask of observed flight points
+        :return: Number of flight points removed
+        """
+        points = np.asarray(points)
+        if points.dtype != bool:
+            mask = np.zeros(self.store.npoints, dtype=bool)
+            mask[points] = True
+            points = mask
+        removed = points & self.unseen
+        if removed.any():
+            self.counts -= self.store.popcount(removed, self.weights)
+            self.unseen &= ~removed
+        return int(removed.sum())
+
+    def recompute(self):
+        """
+        Recomputes the count from scratch over the remaining unseen flight points.
+        :return: Array of counts over candidate cells
+        """
+        return self.store.popcount(self.unseen, self.weights)
+
+    def raster(self):
+        """
+        Masked cumulative viewshed for the current pass, equivalent to the vs_pass_<N> raster (0 for NoData).
+        :return: Array shaped like the surface
+        """
+        return self.store.countraster(self.counts)
+
+
+if __name__ == '__main__':
+    # Check incremental updates against a full recompute over greedy passes on a synthetic DSM
+    import tempfile
+    import os
+    import SyntheticUrban
+    surface, xs, ys, zs, store = SyntheticUrban.syntheticstore(os.path.join(tempfile.mkdtemp(), 'vis'))
+    cumulative = CumulativeCount(store)
+    ct = 0
+    while cumulative.unseen.any() and cumulative.counts.max() > 0:
+        best = int(np.argmax(cumulative.counts))
+        removed = cumulative.remove(store.column(best))
+        assert np.array_equal(cumulative.counts, cumulative.recompute()), 'Incremental count diverges'
+        print('Pass {}: {} flight points observed, {} remaining'.format(ct, removed, int(cumulative.unseen.sum())))
+        ct += 1
+    print('Incremental counts match full recompute.')
@@ -4,40 +4,50 @@
 # Written by Samuel Levin
 # --------------------------------------------------------
 
-import arcpy
-import pandas as pd
-import CumulativeVS
-import BestObservers
+import BestSelect
+import VisibilityLookup
+import VisibilityStore
+from CumulativeCount import CumulativeCount
 
 
-surface = "C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\UTD_Viewshed_SEV1.gdb\\Surface_SE_2m"
-mask = "C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\UTD_Viewshed_SEV1.gdb\\BldgVegMask_V2_bin"
-path = "C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\UTD_Viewshed_SEV1.gdb\\"
+# Visibility store written by RunViewshedParallel.py, limited to the cells of BldgVegMask_V2_bin
+storepath = "C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\VisStore_SE"
 
-flightpts = 'C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\UTD_Viewshed_SEV1.gdb\\FlightPts_SE'
-n = int(arcpy.GetCount_management(flightpts).getOutput(0))
-unseen_fltpts = list(range(1,n+1))
+store = VisibilityStore.openstore(storepath)
+# Cumulative viewshed count of the unseen flight points, summed once and kept up to date pass by pass
+cumulative = CumulativeCount(store)
+cellxs, cellys = store.cellxy()
 
 count = 0
-best = pd.DataFrame()
+maxpasses = 10
+best = BestSelect.besttable(maxpasses)
 
 passvis = {}
 
-while len(unseen_fltpts) > 0 and count < 10:
+while cumulative.unseen.any() and count < maxpasses:
     count += 1
     print('\n')
     print('PASS {}'.format(count))
-    CumulativeVS.calcVS(unseen_fltpts,mask,count,path)
-    best = BestObservers.findbestobs(count,path,best)
-    best_x= best.iloc[count-1]['POINT_X']
-    best_y= best.iloc[count-1]['POINT_Y']
-    passviewed = BestObservers.findvisible(path,unseen_fltpts,best_x,best_y)
+    i = BestSelect.selectbest(cumulative.counts,cellxs,cellys)
+    if i < 0:
+        print('No observer sees any unseen flight point in pass {}'.format(count))
+        count -= 1
+        break
+    best['POINT_X'][count-1] = cellxs[i]
+    best['POINT_Y'][count-1] = cellys[i]
+    best['PASS_VIS'][count-1] = cumulative.counts[i]
+    best_x= best['POINT_X'][count-1]
+    best_y= best['POINT_Y'][count-1]
+    unseen_fltpts = store.oids[cumulative.unseen].tolist()
+    passviewed = VisibilityLookup.findvisible(store,unseen_fltpts,best_x,best_y)
     passvis[count] = passviewed
-    unseen_fltpts = [us for us in unseen_fltpts if us not in passviewed]
-    print('REMAINING UNSEEN: {}'.format(len(unseen_fltpts)))
+    # Subtract the viewsheds of the newly observed flight points instead of re-summing the remaining ones
+    cumulative.remove(store.rowindex(passviewed))
+    print('REMAINING UNSEEN: {}'.format(int(cumulative.unseen.sum())))
 
 savebest = "C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\OutTables\\bestobservers.csv"
-best.to_csv(savebest)
+best = best[:count][['POINT_X','POINT_Y','PASS_VIS']]
+BestSelect.writebest(best,savebest)
 print('Best observers CSV exported to: {}'.format(savebest))
 print('\n')
 print('PROCESS COMPLETE.')
@@ -0,0 +1,327 @@
+# --------------------------------------------------------
+# Bulk flight point ingest into a columnar (OID, X, Y, Z) array
+# Reads CSV, GeoJSON or GeoPackage flight points in one pass, replacing the per-point fltpt_<N> feature classes
+# of SplitFlightPts.py
+# --------------------------------------------------------
+
+import csv
+import json
+import os
+import sqlite3
+import struct
+import numpy as np
+
+# Columnar flight point array: original OBJECTID, location and observer elevation (Altitude field)
+FLIGHT_DTYPE = np.dtype([('OID', np.int64), ('X', np.float64), ('Y', np.float64), ('Z', np.float64)])
+
+# Default field names, as in the flight point feature classes and their table exports
+OID_FIELD = 'OBJECTID'
+X_FIELD = 'POINT_X'
+Y_FIELD = 'POINT_Y'
+Z_FIELD = 'Altitude'
+
+# GeoPackage geometry header envelope size (bytes) by envelope indicator
+ENVELOPE = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+
+def flightpoints(oids, xs, ys, zs):
+    """
+    Builds a columnar flight point array.
+    :param oids: Original flight point OBJECTIDs, 1..N if None
+    :param xs, ys, zs: Flight point coordinates and altitudes
+    :return: Structured array with FLIGHT_DTYPE fields
+    """
+    pts = np.zeros(len(xs), dtype=FLIGHT_DTYPE)
+    pts['OID'] = np.arange(1, len(xs) + 1) if oids is None else oids
+    pts['X'] = xs
+    pts['Y'] = ys
+    pts['Z'] = zs
+    return pts
+
+
+def _field(names, name):
+    """
+    Finds a field by name, ignoring case.
+    :return: Index of the field, None if missing
+    """
+    lower = [n.strip().lower() for n in names]
+    return lower.index(name.lower()) if name.lower() in lower else None
+
+
+def readcsv(path, oidfield=OID_FIELD, xfield=X_FIELD, yfield=Y_FIELD, zfield=Z_FIELD):
+    """
+    Reads flight points from a CSV table with a header row.
+    :param path: Path to CSV file
+    :param oidfield: OBJECTID field, flight points are numbered 1..N if missing
+    :param xfield, yfield, zfield: Coordinate and altitude fields
+    :return: Structured array with FLIGHT_DTYPE fields
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        cols = [_field(header, name) for name in (oidfield, xfield, yfield, zfield)]
+        for name, col in zip((xfield, yfield, zfield), cols[1:]):
+            if col is None:
+                raise KeyError('Field {} not in {}'.format(name, path))
+        use = [c for c in cols if c is not None]
+        values = np.array([[row[c] for c in use] for row in reader if row], dtype=np.float64).reshape(-1, len(use))
+    oids = values[:, 0].astype(np.int64) if cols[0] is not None else None
+    return flightpoints(oids, values[:, -3], values[:, -2], values[:, -1])
+
+
+def _oid(value):
+    """
+    Converts an OBJECTID value to an integer.
+    :param value: Integer, integral float or string of digits
+    :return: Integer, None if the value is not an OBJECTID (e.g. a string feature id such as "fltpts.17")
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    if isinstance(value, str) and value.strip().lstrip('+-').isdigit():
+        return int(value)
+    return None
+
+
+def readgeojson(path, oidfield=OID_FIELD, zfield=Z_FIELD):
+    """
+    Reads flight points from a GeoJSON FeatureCollection of Point features.
+    :param path: Path to GeoJSON file
+    :param oidfield: OBJECTID property, the feature id or 1..N if missing. Feature ids are only used when every
+                     feature has an integer id; string ids (GeoJSON allows them) number the features 1..N instead.
+    :param zfield: Altitude property, the Z coordinate if missing
+    :return: Structured array with FLIGHT_DTYPE fields
+    """
+    with open(path) as f:
+        features = json.load(f)['features']
+    ids = [_oid(feature.get('id')) for feature in features]
+    useids = all(oid is not None for oid in ids)
+    if not useids and any(feature.get('id') is not None for feature in features):
+        print('Feature ids in {} are not all integers, flight points without an {} property are numbered by '
+              'position'.format(path, oidfield))
+    pts = np.zeros(len(features), dtype=FLIGHT_DTYPE)
+    for i, feature in enumerate(features):
+        geometry = feature['geometry']
+        if geometry['type'] != 'Point':
+            raise ValueError('Flight point {} is a {}, not a Point'.format(i + 1, geometry['type']))
+        props = feature.get('properties') or {}
+        coords = geometry['coordinates']
+        z = props.get(zfield, coords[2] if len(coords) > 2 else None)
+        if z is None:
+            raise KeyError('Flight point {} has no {} or Z coordinate'.format(i + 1, zfield))
+        if oidfield in props:
+            oid = _oid(props[oidfield])
+            if oid is None:
+                raise ValueError('Flight point {}: {} property {!r} is not an integer'.format(
+                    i + 1, oidfield, props[oidfield]))
+        else:
+            oid = ids[i] if useids else i + 1
+        pts[i] = (oid, coords[0], coords[1], z)
+    return pts
+
+
+def _gpkgpoint(blob):
+    """
+    Decodes a GeoPackage Point geometry (header and WKB).
+    :param blob: Geometry blob
+    :return: Tuple of X, Y and Z (None for 2D points), None for NULL or empty geometries
+    """
+    if not blob:
+        return None
+    flags = bytearray(blob[3:4])[0]
+    if flags >> 4 & 1:
+        return None
+    wkb = 8 + ENVELOPE[flags >> 1 & 7]
+    order = '<' if bytearray(blob[wkb:wkb + 1])[0] else '>'
+    gtype = struct.unpack(order + 'I', blob[wkb + 1:wkb + 5])[0]
+    # ISO WKB codes Z/M as 1000s (1001, 2001, 3001), extended WKB as high flag bits
+    base = gtype & 0x0fffffff
+    if base % 1000 != 1:
+        raise ValueError('Flight point geometry type {} is not a Point'.format(gtype))
+    hasz = base // 1000 in (1, 3) or bool(gtype & 0x80000000)
+    hasm = base // 1000 in (2, 3) or bool(gtype & 0x40000000)
+    ndims = 2 + hasz + hasm
+    coords = struct.unpack(order + '{}d'.format(ndims), blob[wkb + 5:wkb + 5 + 8 * ndims])
+    # Empty points are also written as NaN coordinates without the header flag
+    if np.isnan(coords[0]) or np.isnan(coords[1]):
+        return None
+    return coords[0], coords[1], coords[2] if hasz else None
+
+
+def readgeopackage(path, layer=None, zfield=Z_FIELD):
+    """
+    Reads flight points from a GeoPackage feature table with the standard library SQLite reader.
+    :param path: Path to GeoPackage file
+    :param layer: Feature table name, the first feature table if None
+    :param zfield: Altitude field, the Z coordinate if missing
+    :return: Structured array with FLIGHT_DTYPE fields; OBJECTIDs are the table's feature ids. Features with NULL or
+             empty geometries are skipped and reported.
+    """
+    con = sqlite3.connect(path)
+    try:
+        if layer is None:
+            layer = con.execute("SELECT table_name FROM gpkg_contents WHERE data_type = 'features' "
+                                "ORDER BY table_name").fetchone()[0]
+        geomcol = con.execute('SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?',
+                              (layer,)).fetchone()[0]
+        info = con.execute('PRAGMA table_info("{}")'.format(layer)).fetchall()
+        fid = [c[1] for c in info if c[5]][0]
+        fields = [c[1] for c in info]
+        zcol = fields[_field(fields, zfield)] if _field(fields, zfield) is not None else None
+        zsql = ', "{}"'.format(zcol) if zcol else ''
+        sql = 'SELECT "{}", "{}"{} FROM "{}" ORDER BY "{}"'.format(fid, geomcol, zsql, layer, fid)
+        rows = con.execute(sql).fetchall()
+    finally:
+        con.close()
+    pts = np.zeros(len(rows), dtype=FLIGHT_DTYPE)
+    empty = []
+    n = 0
+    for row in rows:
+        point = _gpkgpoint(row[1])
+        if point is None:
+            empty.append(row[0])
+            continue
+        x, y, z = point
+        if zcol:
+            z = row[2]
+        if z is None:
+            raise KeyError('Flight point {} has no {} or Z coordinate'.format(row[0], zfield))
+        pts[n] = (row[0], x, y, z)
+        n += 1
+    if empty:
+        print('Skipped {} flight points with NULL or empty geometry in {}: {}{}'.format(
+            len(empty), layer, ', '.join(str(e) for e in empty[:10]), ', ...' if len(empty) > 10 else ''))
+    return pts[:n]
+
+
+def fromfeatureclass(flightpts, zfield=Z_FIELD):
+    """
+    Reads flight points from a feature class (e.g. FlightPts_SE) in one cursor pass. Requires arcpy.
+    :param flightpts: Path to flight point feature class
+    :param zfield: Altitude field
+    :return: Structured array with FLIGHT_DTYPE fields
+    """
+    import arcpy
+    arr = arcpy.da.FeatureClassToNumPyArray(flightpts, ['OID@', 'SHAPE@X', 'SHAPE@Y', zfield])
+    return flightpoints(arr['OID@'], arr['SHAPE@X'], arr['SHAPE@Y'], arr[zfield])
+
+
+READERS = {'.csv': readcsv, '.txt': readcsv, '.geojson': readgeojson, '.json': readgeojson,
+           '.gpkg': readgeopackage}
+
+
+def readflightpoints(path, **kwargs):
+    """
+    Reads flight points with the reader for the file extension (CSV, GeoJSON or GeoPackage).
+    :param path: Path to flight point file
+    :param kwargs: Field options passed to the reader
+    :return: Structured array with FLIGHT_DTYPE fields
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError('No flight point reader for {} files'.format(ext))
+    pts = READERS[ext](path, **kwargs)
+    if len(np.unique(pts['OID'])) != len(pts):
+        raise ValueError('Duplicate flight point OBJECTIDs in {}'.format(path))
+    print('{} flight points read from {}'.format(len(pts), path))
+    return pts
+
+
+def oidrows(pts):
+    """
+    Maps original flight point OBJECTIDs to rows of the flight point array (and of visibility stores built from it).
+    :param pts: Structured array with FLIGHT_DTYPE fields
+    :return: Dict of OBJECTID to row index
+    """
+    return dict(zip(pts['OID'].tolist(), range(len(pts))))
+
+
+def viewshedstore(pts, surface, mask, path, processes=None, cachepath=None, **params):
+    """
+    Runs the viewsheds of all flight points in a columnar array into a new visibility store.
+    :param pts: Structured array with FLIGHT_DTYPE fields
+    :param surface: NumpyViewshed.Surface object
+    :param mask: Boolean observer mask shaped like the surface
+    :param path: Store directory
+    :param processes: Number of worker processes, serial if 1
+    :param cachepath: ViewshedCache directory, no cache if None
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: VisibilityStore object with one row per flight point, keyed by original OBJECTID
+    """
+    import ParallelViewshed
+    import VisibilityStore
+    store = VisibilityStore.createstore(path, surface, mask, pts['OID'])
+    if processes == 1 and cachepath is None:
+        VisibilityStore.fillstore(store, surface, pts['X'], pts['Y'], pts['Z'], **params)
+    else:
+        ParallelViewshed.parallelviewshed(surface, pts['X'], pts['Y'], pts['Z'], store, processes=processes,
+                                          cachepath=cachepath, **params)
+    return store
+
+
+if __name__ == '__main__':
+    # Round trip synthetic flight points through every format and check that ingest time scales linearly
+    import tempfile
+    import time
+    workdir = tempfile.mkdtemp()
+    for n in [10000, 100000]:
+        rng = np.random.RandomState(0)
+        pts = flightpoints(np.arange(101, n + 101), rng.uniform(0, 1000, n), rng.uniform(0, 1000, n),
+                           rng.uniform(200, 260, n))
+        csvpath = os.path.join(workdir, 'fltpts_{}.csv'.format(n))
+        with open(csvpath, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([OID_FIELD, X_FIELD, Y_FIELD, Z_FIELD])
+            writer.writerows(pts.tolist())
+        jsonpath = os.path.join(workdir, 'fltpts_{}.geojson'.format(n))
+        with open(jsonpath, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'id': int(p[0]), 'geometry': {'type': 'Point', 'coordinates': [p[1], p[2], p[3]]},
+                 'properties': {}} for p in pts.tolist()]}, f)
+        gpkgpath = os.path.join(workdir, 'fltpts_{}.gpkg'.format(n))
+        con = sqlite3.connect(gpkgpath)
+        con.execute('CREATE TABLE gpkg_contents (table_name TEXT, data_type TEXT)')
+        con.execute('CREATE TABLE gpkg_geometry_columns (table_name TEXT, column_name TEXT)')
+        con.execute("INSERT INTO gpkg_contents VALUES ('fltpts', 'features')")
+        con.execute("INSERT INTO gpkg_geometry_columns VALUES ('fltpts', 'geom')")
+        con.execute('CREATE TABLE fltpts (fid INTEGER PRIMARY KEY, geom BLOB, Altitude REAL)')
+        con.executemany('INSERT INTO fltpts VALUES (?, ?, ?)', [
+            (p[0], b'GP\x00\x01' + struct.pack('<i', 0) + struct.pack('<BI2d', 1, 1, p[1], p[2]), p[3])
+            for p in pts.tolist()])
+        con.commit()
+        con.close()
+        for path in [csvpath, jsonpath, gpkgpath]:
+            t = time.time()
+            read = readflightpoints(path)
+            print('{:.3f}s, {:.2f} us per point'.format(time.time() - t, (time.time() - t) / n * 1e6))
+            assert np.array_equal(read, pts), 'Flight points differ after reading {}'.format(path)
+
+    # NULL, flagged empty and NaN point geometries are skipped
+    con = sqlite3.connect(gpkgpath)
+    con.executemany('INSERT INTO fltpts VALUES (?, ?, ?)', [
+        (n + 101, None, 250.0), (n + 102, b'GP\x00\x11' + struct.pack('<i', 0), 250.0),
+        (n + 103, b'GP\x00\x01' + struct.pack('<i', 0) + struct.pack('<BI2d', 1, 1, np.nan, np.nan), 250.0)])
+    con.commit()
+    con.close()
+    assert np.array_equal(readflightpoints(gpkgpath), pts), 'Empty geometries were not skipped'
+
+    # String feature ids fall back to the OBJECTID property, then to the position
+    features = [{'type': 'Feature', 'id': 'fltpts.{}'.format(k), 'geometry': {'type': 'Point', 'coordinates': [
+        1.0, 2.0, 250.0]}, 'properties': {}} for k in range(3)]
+    features[1]['properties'][OID_FIELD] = 17
+    with open(jsonpath, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    assert readgeojson(jsonpath)['OID'].tolist() == [1, 17, 3], 'String feature ids not numbered by position'
+    features[2]['properties'][OID_FIELD] = 'fltpts.2'
+    with open(jsonpath, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    try:
+        readgeojson(jsonpath)
+    except ValueError as e:
+        print(e)
+    else:
+        raise AssertionError('Non-integer OBJECTID property was accepted')
+
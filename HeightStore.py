@@ -0,0 +1,378 @@
+# --------------------------------------------------------
+# Altitude-parametric visibility of flight points x candidate observer cells
+# Stores, per flight point and cell, the minimum flight altitude at which the cell (plus the surface offset) is
+# visible, so binary visibility stores for any flight altitude are derived by thresholding instead of re-running
+# every viewshed
+# --------------------------------------------------------
+
+import os
+import shutil
+import time
+import numpy as np
+import NumpyViewshed
+import ObserverSolver
+import VisibilityStore
+
+# Number of matrix elements (flight points x cells) thresholded at once, bounds temporary memory
+CELLS = 1 << 22
+
+# Sweep results: altitude change of the whole flight path, surface offset, flight points seen by any candidate
+# cell and observers selected
+SWEEP_DTYPE = np.dtype([('CLIMB', np.float64), ('OFFSET', np.float64), ('COVERED_PTS', np.int64),
+                        ('OBSERVERS', np.int64), ('SECONDS', np.float64)])
+
+
+class HeightStore(VisibilityStore.CellStore):
+    """
+    Minimum visible flight altitudes stored in a directory, one float32 per surface offset, flight point (row) and
+    candidate observer cell (column); +inf where the cell is out of reach. Values are rounded up, so thresholding
+    never reports a hidden cell as visible. Open with createheightstore() or openheightstore().
+    :param path: Store directory
+    :param mode: 'r' for read only, 'r+' for read/write
+    """
+    def __init__(self, path, mode='r'):
+        super(HeightStore, self).__init__(path)
+        self.offsets = self.header['offsets']
+        self.radius = self.header['radius']
+        self.refraction = self.header['refraction']
+        self.step = self.header['step']
+        # Flight point X, Y, Z and candidate cell elevations, needed to apply the radius and vertical angles
+        self.points = np.load(os.path.join(path, 'points.npy'))
+        self.elev = np.load(os.path.join(path, 'elev.npy'))
+        self.heights = np.memmap(os.path.join(path, 'heights.dat'), dtype=np.float32, mode=mode,
+                                 shape=(len(self.offsets), self.npoints, max(self.ncells, 1)))
+
+    def flush(self):
+        """
+        Writes pending changes to disk.
+        """
+        self.heights.flush()
+
+    def setwindow(self, i, r0, c0, win):
+        """
+        Stores the minimum visible altitudes of a flight point given as a window, as returned by heightwindow().
+        :param i: Row (flight point) index
+        :param r0, c0: Row and column of the window origin
+        :param win: Array of shape (offsets, rows, cols)
+        """
+        cols = self.colindex[r0:r0 + win.shape[1], c0:c0 + win.shape[2]]
+        keep = cols >= 0
+        row = np.full((len(self.offsets), self.ncells), np.inf, dtype=np.float32)
+        row[:, cols[keep]] = roundup(win[:, keep])
+        self.heights[:, i, :self.ncells] = row
+
+    def offsetlayers(self, offset):
+        """
+        Finds the stored surface offsets bracketing a value. Each sightline sample bounds the minimum visible altitude
+        by a linear function of the offset, so the minimum is convex in it and interpolating between two stored
+        offsets never falls below it: thresholds between stored offsets stay conservative, but may miss cells
+        visible only just above the interpolated altitude. Offsets outside the stored range cannot be derived.
+        :param offset: Surface offset (meters), within the stored offsets
+        :return: Tuple (k0, k1, w) of indices into offsets and interpolation weight of k1 (k0 == k1 when stored)
+        """
+        offsets = np.asarray(self.offsets, dtype=np.float64)
+        stored = np.flatnonzero(np.isclose(offsets, offset))
+        if len(stored):
+            return int(stored[0]), int(stored[0]), 0.0
+        below = np.flatnonzero(offsets < offset)
+        above = np.flatnonzero(offsets > offset)
+        if not len(below) or not len(above):
+            raise ValueError('Surface offset {} is outside the height store offsets {}'.format(
+                offset, sorted(self.offsets)))
+        k0 = int(below[np.argmax(offsets[below])])
+        k1 = int(above[np.argmin(offsets[above])])
+        return k0, k1, (offset - offsets[k0]) / (offsets[k1] - offsets[k0])
+
+    def minheights(self, rows, offset=NumpyViewshed.SURFACE_OFFSET):
+        """
+        Fetches the minimum visible altitudes of some flight points at a surface offset, interpolated between stored
+        offsets (see offsetlayers()).
+        :param rows: Array of row (flight point) indices
+        :param offset: Surface offset (meters), within the stored offsets
+        :return: Array of shape (len(rows), candidate cells)
+        """
+        k0, k1, w = self.offsetlayers(offset)
+        low = self.heights[k0, rows, :self.ncells]
+        if k0 == k1:
+            return low
+        low = low.astype(np.float64)
+        high = self.heights[k1, rows, :self.ncells].astype(np.float64)
+        # Out of reach (+inf) and unobstructed (-inf) cells do not depend on the offset
+        with np.errstate(invalid='ignore'):
+            return np.where(low == high, low, low + w * (high - low))
+
+    def visibility(self, rows, climb=0.0, offset=NumpyViewshed.SURFACE_OFFSET, upper=NumpyViewshed.VERTICAL_UPPER,
+                   lower=NumpyViewshed.VERTICAL_LOWER, radius=None):
+        """
+        Thresholds the visibility of some flight points with the whole flight path raised by climb meters.
+        :param rows: Array of row (flight point) indices
+        :param climb: Altitude added to every flight point (meters), negative to descend
+        :param offset: Surface offset (meters), within the stored offsets
+        :param upper: Upper vertical angle (degrees)
+        :param lower: Lower vertical angle (degrees)
+        :param radius: Outer radius measured as 3D distance (meters), at most the stored radius; stored radius if None
+        :return: Boolean array of shape (len(rows), candidate cells)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        radius = self.radius if radius is None else min(radius, self.radius)
+        heights = self.minheights(rows, offset)
+        x, y, z = self.points[rows].T
+        z = z + climb
+        cx, cy = self.cellxy()
+        d = np.hypot(cx[np.newaxis, :] - x[:, np.newaxis], cy[np.newaxis, :] - y[:, np.newaxis])
+        vis = z[:, np.newaxis] > heights
+        vis &= NumpyViewshed.visible(-np.inf, d, z[:, np.newaxis], self.elev[np.newaxis, :] + offset,
+                                     radius, upper, lower, self.refraction)
+        return vis
+
+    def threshold(self, path, climb=0.0, offset=NumpyViewshed.SURFACE_OFFSET, **params):
+        """
+        Derives the binary visibility store of one flight altitude and surface offset.
+        :param path: Directory of the new VisibilityStore
+        :param climb: Altitude added to every flight point (meters), negative to descend
+        :param offset: Surface offset (meters), within the stored offsets
+        :param params: Vertical angles and radius passed to visibility()
+        :return: VisibilityStore object opened read/write
+        """
+        bits = VisibilityStore.writestore(path, VisibilityStore.surfaceheader(self),
+                                          {'oids': self.oids, 'cells': self.cells}, 'bits.dat', np.uint8,
+                                          (self.npoints, max((self.ncells + 7) // 8, 1)))
+        nrows = max(CELLS // max(self.ncells, 1), 1)
+        for s in range(0, self.npoints, nrows):
+            rows = np.arange(s, min(s + nrows, self.npoints))
+            bits[rows] = np.packbits(self.visibility(rows, climb, offset, **params), axis=1)
+        bits.flush()
+        del bits
+        return VisibilityStore.VisibilityStore(path, 'r+')
+
+
+def roundup(values):
+    """
+    Converts values to float32, rounding up wherever float32 cannot hold them exactly.
+    :param values: Array of float64 values
+    :return: float32 array, each value >= the input
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = values.astype(np.float32)
+    low = out < values
+    out[low] = np.nextafter(out[low], np.float32(np.inf))
+    return out
+
+
+def minaltitude(surface, window, ox, oy, tx, ty, tz, step=NumpyViewshed.STEP, refraction=NumpyViewshed.REFRACTION):
+    """
+    Finds the lowest observer elevation from which each target clears every sample of its sightline. Samples are
+    placed as in NumpyViewshed.horizon() and depend on the horizontal positions only: sample k at fraction f of the
+    sightline blocks unless oz > (h - curvature(f * d) - f * (tz - curvature(d))) / (1 - f).
+    :param surface: NumpyViewshed.Surface object
+    :param window: Window (r0, r1, c0, c1) holding every sightline; cells outside it do not block
+    :param ox, oy: Observer coordinates
+    :param tx, ty: Arrays of target coordinates
+    :param tz: Array of target elevations (including the surface offset) of shape (offsets, targets)
+    :return: Array of minimum observer elevations shaped like tz, -inf where unobstructed
+    """
+    r0, r1, c0, c1 = window
+    elev = surface.read(r0, r1, c0, c1)
+    tx = np.ravel(tx).astype(np.float64)
+    ty = np.ravel(ty).astype(np.float64)
+    tz = np.atleast_2d(np.asarray(tz, dtype=np.float64))
+    trow, tcol = surface.rowcol(tx, ty)
+    out = np.full(tz.shape, -np.inf)
+    for s in range(0, len(tx), NumpyViewshed.CHUNK):
+        e = s + NumpyViewshed.CHUNK
+        dx = tx[s:e] - ox
+        dy = ty[s:e] - oy
+        d = np.hypot(dx, dy)
+        nseg = NumpyViewshed.segments(d, surface.cellsize, step)
+        kmax = int(nseg.max())
+        if kmax < 2:
+            continue
+        f = np.arange(1, kmax)[np.newaxis, :] / nseg[:, np.newaxis]
+        rows, cols = NumpyViewshed.samplecells(surface, ox, oy, dx[:, np.newaxis], dy[:, np.newaxis], f)
+        h, valid = NumpyViewshed.sampleheights(elev, r0, c0, rows, cols, trow[s:e, np.newaxis],
+                                               tcol[s:e, np.newaxis])
+        valid &= f < 1.0
+        rise = h - NumpyViewshed.curvature(f * d[:, np.newaxis], refraction)
+        valid &= ~np.isnan(rise)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for k in range(len(tz)):
+                top = tz[k, s:e] - NumpyViewshed.curvature(d, refraction)
+                z = (rise - f * top[:, np.newaxis]) / (1.0 - f)
+                z[~valid] = -np.inf
+                out[k, s:e] = z.max(axis=1)
+    return out
+
+
+def heightwindow(surface, x, y, offsets=(NumpyViewshed.SURFACE_OFFSET,), radius=NumpyViewshed.OUTER_RADIUS,
+                 refraction=NumpyViewshed.REFRACTION, step=NumpyViewshed.STEP, targets=None):
+    """
+    Computes the minimum visible altitudes of one flight point location within its outer radius.
+    :param surface: NumpyViewshed.Surface object
+    :param x, y: Flight point coordinates
+    :param offsets: Surface offsets added to target cells (meters)
+    :param radius: Horizontal reach of the window (meters)
+    :param targets: Boolean array shaped like the surface (or a store's CellMask) limiting the cells evaluated,
+                    all cells if None
+    :return: Tuple (r0, c0, win) of the window origin and array of shape (offsets, rows, cols), +inf where not
+             evaluated or NoData
+    """
+    window = surface.window(x, y, radius)
+    r0, r1, c0, c1 = window
+    rows, cols = np.mgrid[r0:r1, c0:c1]
+    tx, ty = surface.cellxy(rows.ravel(), cols.ravel())
+    d = np.hypot(tx - x, ty - y)
+    inside = d <= radius
+    if targets is not None:
+        inside &= targets[r0:r1, c0:c1].ravel()
+    inside = np.flatnonzero(inside)
+    inside = inside[np.argsort(d[inside], kind='stable')]
+    elev = surface.read(r0, r1, c0, c1).ravel()[inside].astype(np.float64)
+    tz = elev[np.newaxis, :] + np.asarray(offsets, dtype=np.float64)[:, np.newaxis]
+    win = np.full((len(offsets), (r1 - r0) * (c1 - c0)), np.inf)
+    z = minaltitude(surface, window, x, y, tx[inside], ty[inside], tz, step, refraction)
+    z[:, np.isnan(elev)] = np.inf
+    win[:, inside] = z
+    return r0, c0, win.reshape(len(offsets), r1 - r0, c1 - c0)
+
+
+def createheightstore(path, surface, mask, oids, xs, ys, zs, offsets=(NumpyViewshed.SURFACE_OFFSET,),
+                      radius=NumpyViewshed.OUTER_RADIUS, refraction=NumpyViewshed.REFRACTION,
+                      step=NumpyViewshed.STEP):
+    """
+    Creates an empty height store on disk, with the candidate cells of VisibilityStore.createstore().
+    :param path: Store directory
+    :param surface: NumpyViewshed.Surface object
+    :param mask: Boolean array shaped like the surface, True where a ground observer may stand
+    :param oids: Array of flight point OBJECTIDs, one per row
+    :param xs, ys, zs: Arrays of flight point coordinates and planned altitudes, one per row
+    :param offsets: Surface offsets to store (meters); thresholds take any offset between the lowest and highest
+    :param radius: Largest outer radius thresholds will use (meters)
+    :return: HeightStore object opened read/write
+    """
+    cells, elev = VisibilityStore.validcells(surface, mask)
+    header = dict(VisibilityStore.surfaceheader(surface), offsets=[float(o) for o in offsets], radius=float(radius),
+                  refraction=float(refraction), step=float(step))
+    arrays = {'oids': np.asarray(oids, dtype=np.int64), 'cells': cells,
+              'points': np.column_stack([xs, ys, zs]).astype(np.float64), 'elev': elev}
+    heights = VisibilityStore.writestore(path, header, arrays, 'heights.dat', np.float32,
+                                         (len(offsets), len(oids), max(len(cells), 1)))
+    del heights
+    return HeightStore(path, 'r+')
+
+
+def openheightstore(path, mode='r'):
+    """
+    Opens an existing height store.
+    :param path: Store directory
+    :param mode: 'r' for read only, 'r+' for read/write
+    :return: HeightStore object
+    """
+    return HeightStore(path, mode)
+
+
+def fillheightstore(hstore, surface):
+    """
+    Computes the minimum visible altitudes of all flight points into a height store.
+    :param hstore: HeightStore object opened read/write
+    :param surface: NumpyViewshed.Surface object
+    """
+    print('Filling height store ({} flight points x {} candidate cells, {} offsets)...'.format(
+        hstore.npoints, hstore.ncells, len(hstore.offsets)))
+    for i, (x, y, z) in enumerate(hstore.points):
+        r0, c0, win = heightwindow(surface, x, y, hstore.offsets, hstore.radius, hstore.refraction, hstore.step,
+                                   hstore.targets)
+        hstore.setwindow(i, r0, c0, win)
+    hstore.flush()
+
+
+def sweep(hstore, workdir, climbs, offsets=None, mode='greedy', **params):
+    """
+    Selects observers for every combination of flight altitude change and surface offset.
+    :param hstore: HeightStore object
+    :param workdir: Directory for the temporary visibility stores
+    :param climbs: Altitudes added to every flight point (meters)
+    :param offsets: Surface offsets within the stored ones (interpolated between them), all stored offsets if None
+    :param mode: ObserverSolver mode
+    :param params: Vertical angles and radius passed to HeightStore.visibility()
+    :return: Structured array with SWEEP_DTYPE fields, one row per combination
+    """
+    offsets = hstore.offsets if offsets is None else offsets
+    table = np.zeros(len(climbs) * len(offsets), dtype=SWEEP_DTYPE)
+    row = 0
+    for offset in offsets:
+        for climb in climbs:
+            start = time.time()
+            path = os.path.join(workdir, 'sweep_{:g}_{:g}'.format(climb, offset))
+            store = hstore.threshold(path, climb, offset, **params)
+            selected = ObserverSolver.solve(store, mode)
+            table[row] = (climb, offset, int((store.rowcounts() > 0).sum()), len(selected), time.time() - start)
+            print('Climb {:+g} m, offset {:g} m: {} observers for {} flight points'.format(
+                climb, offset, len(selected), table['COVERED_PTS'][row]))
+            del store
+            shutil.rmtree(path, ignore_errors=True)
+            row += 1
+    return table
+
+
+def bestrow(table):
+    """
+    Picks the sweep result needing the fewest observers among those seeing the most flight points, lowest climb on
+    ties.
+    :param table: Structured array from sweep()
+    :return: Row of table
+    """
+    full = table[table['COVERED_PTS'] == table['COVERED_PTS'].max()]
+    return full[np.lexsort((full['CLIMB'], full['OBSERVERS']))[0]]
+
+
+if __name__ == '__main__':
+    # Check thresholds against direct viewsheds at several altitudes and offsets on a synthetic DSM, then sweep
+    import tempfile
+    import SyntheticUrban
+    workdir = tempfile.mkdtemp()
+    surface = SyntheticUrban.urbansurface(150, 150, 2.0, nbldgs=150, seed=4, ntrees=150)
+    mask = SyntheticUrban.groundmask(surface)
+    xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude=2.0, spacing=40.0, interval=30.0)
+    oids = np.arange(1, len(xs) + 1)
+    offsets = (NumpyViewshed.SURFACE_OFFSET, 1.0)
+    t = time.time()
+    hstore = createheightstore(os.path.join(workdir, 'heights'), surface, mask, oids, xs, ys, zs, offsets)
+    fillheightstore(hstore, surface)
+    theight = time.time() - t
+    print('Height store built in {:.1f}s'.format(theight))
+    climbs = [-10.0, 0.0, 10.0, 30.0]
+    tdirect = 0.0
+    for offset in offsets:
+        for climb in climbs:
+            t = time.time()
+            direct = VisibilityStore.createstore(os.path.join(workdir, 'direct'), surface, mask, oids)
+            VisibilityStore.fillstore(direct, surface, xs, ys, zs + climb, direction='forward', offset=offset)
+            tdirect += time.time() - t
+            derived = hstore.threshold(os.path.join(workdir, 'derived'), climb, offset)
+            differ = int(VisibilityStore.POPCOUNT[np.asarray(direct.bits) ^ np.asarray(derived.bits)].sum())
+            print('Climb {:+g} m, offset {:g} m: {} of {} pairs differ'.format(
+                climb, offset, differ, direct.npoints * direct.ncells))
+            assert differ == 0, 'Thresholded visibility differs from viewsheds'
+    # Offsets between stored ones are interpolated and never report a hidden cell as visible
+    for offset in [1.2, 1.4]:
+        direct = VisibilityStore.createstore(os.path.join(workdir, 'direct'), surface, mask, oids)
+        VisibilityStore.fillstore(direct, surface, xs, ys, zs, direction='forward', offset=offset)
+        derived = hstore.threshold(os.path.join(workdir, 'derived'), 0.0, offset)
+        extra = int(VisibilityStore.POPCOUNT[np.asarray(derived.bits) & ~np.asarray(direct.bits)].sum())
+        missed = int(VisibilityStore.POPCOUNT[np.asarray(direct.bits) & ~np.asarray(derived.bits)].sum())
+        print('Interpolated offset {:g} m: {} of {} visible pairs missed, {} extra'.format(
+            offset, missed, int(direct.rowcounts().sum()), extra))
+        assert extra == 0, 'Interpolated threshold reports hidden cells as visible'
+    try:
+        hstore.visibility([0], offset=5.0)
+    except ValueError as e:
+        print(e)
+    else:
+        raise AssertionError('Offset outside the stored range was accepted')
+    print('Height store {:.1f}s vs {} direct viewshed runs {:.1f}s'.format(theight, len(climbs) * len(offsets),
+                                                                          tdirect))
+    table = sweep(hstore, workdir, [0.0, 5.0, 10.0, 20.0, 40.0])
+    print(table)
+    best = bestrow(table)
+    print('Fewest observers: {} at climb {:+g} m, offset {:g} m'.format(best['OBSERVERS'], best['CLIMB'],
+                                                                       best['OFFSET']))
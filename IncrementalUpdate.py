@@ -0,0 +1,281 @@
+# --------------------------------------------------------
+# Change-aware update of the visibility store after DSM or observer mask edits
+# Only flight points whose viewshed radius reaches a changed cell are recomputed; the store and cumulative count are
+# patched in place and observer selection restarts from the previous station set
+# --------------------------------------------------------
+
+import math
+import time
+import numpy as np
+import NumpyViewshed
+import ObserverSolver
+import VisibilityStore
+from CumulativeCount import CumulativeCount
+
+# Size of the cell blocks changed cells are grouped into when searching for affected flight points
+BLOCKSIZE = 16
+
+
+def changedcells(old, new):
+    """
+    Marks the cells that differ between two surfaces or masks. NoData (NaN) cells on both sides are unchanged.
+    :param old: Array, or NumpyViewshed.Surface / TiledSurface object, before the edit
+    :param new: Array or surface object after the edit, same shape
+    :return: Boolean array shaped like the surface
+    """
+    if hasattr(old, 'read') or hasattr(new, 'read'):
+        # Compare surfaces in bands so that tiled surfaces are never loaded whole
+        changed = np.zeros(old.shape, dtype=bool)
+        for r in range(0, old.shape[0], VisibilityStore.CHUNK):
+            r1 = min(r + VisibilityStore.CHUNK, old.shape[0])
+            changed[r:r1] = changedcells(_band(old, r, r1), _band(new, r, r1))
+        return changed
+    old = np.asarray(old)
+    new = np.asarray(new)
+    if old.shape != new.shape:
+        raise ValueError('Cannot compare arrays of shape {} and {}'.format(old.shape, new.shape))
+    changed = old != new
+    if old.dtype.kind == 'f' and new.dtype.kind == 'f':
+        changed &= ~(np.isnan(old) & np.isnan(new))
+    return changed
+
+
+def _band(surface, r0, r1):
+    if hasattr(surface, 'read'):
+        return surface.read(r0, r1, 0, surface.shape[1])
+    return np.asarray(surface)[r0:r1]
+
+
+def affectedpoints(surface, changed, xs, ys, radius=NumpyViewshed.OUTER_RADIUS):
+    """
+    Finds the flight points whose viewshed radius reaches a changed cell. Every sample of a sightline within the
+    radius lies in a cell whose center is at most half a cell diagonal beyond it. Changed cells are grouped into
+    blocks, so flight points just outside the reach of a block's changed cells may also be listed.
+    :param surface: NumpyViewshed.Surface or TiledSurface object
+    :param changed: Boolean array shaped like the surface, True where a cell changed
+    :param xs, ys: Arrays of flight point coordinates
+    :param radius: Outer radius (meters)
+    :return: Array of flight point (row) indices, ascending
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    rows, cols = np.nonzero(changed)
+    if not len(rows):
+        return np.zeros(0, dtype=np.int64)
+    reach = radius + surface.cellsize * math.sqrt(0.5)
+    # Bounding box of the changed cell centers in each block
+    block = (rows // BLOCKSIZE) * (-(-surface.shape[1] // BLOCKSIZE)) + cols // BLOCKSIZE
+    order = np.argsort(block, kind='stable')
+    block = block[order]
+    cx, cy = surface.cellxy(rows[order], cols[order])
+    starts = np.flatnonzero(np.r_[True, block[1:] != block[:-1]])
+    xmin = np.minimum.reduceat(cx, starts)
+    xmax = np.maximum.reduceat(cx, starts)
+    ymin = np.minimum.reduceat(cy, starts)
+    ymax = np.maximum.reduceat(cy, starts)
+    affected = np.zeros(len(xs), dtype=bool)
+    for s in range(0, len(xs), VisibilityStore.CHUNK):
+        px = xs[s:s + VisibilityStore.CHUNK, np.newaxis]
+        py = ys[s:s + VisibilityStore.CHUNK, np.newaxis]
+        dx = np.maximum(np.maximum(xmin - px, px - xmax), 0.0)
+        dy = np.maximum(np.maximum(ymin - py, py - ymax), 0.0)
+        affected[s:s + VisibilityStore.CHUNK] = (dx * dx + dy * dy <= reach * reach).any(axis=1)
+    return np.flatnonzero(affected)
+
+
+def recompute(store, surface, rows, xs, ys, zs, cumulative=None, **params):
+    """
+    Recomputes the viewsheds of some flight points into the store and patches the cumulative count.
+    :param store: VisibilityStore object opened read/write
+    :param surface: NumpyViewshed.Surface or TiledSurface object after the edit
+    :param rows: Array of flight point (row) indices to recompute
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes, one per store row
+    :param cumulative: CumulativeCount object over the store to patch, None to skip
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    VisibilityStore.checkalgorithm(params)
+    params.setdefault('targets', store.targets)
+    if cumulative is not None:
+        unseen = rows[cumulative.unseen[rows]]
+        cumulative.counts -= store.popcount(unseen)
+    for i in rows:
+        r0, c0, win = NumpyViewshed.viewshedwindow(surface, xs[i], ys[i], zs[i], **params)
+        store.setwindow(i, r0, c0, win)
+    store.flush()
+    if cumulative is not None:
+        cumulative.counts += store.popcount(unseen)
+
+
+def remask(store, surface, mask, xs, ys, zs, path, cumulative=None, **params):
+    """
+    Rebuilds the store for a new set of candidate observer cells (a corrected mask, or cells gaining or losing
+    NoData). Columns of cells kept are copied; columns of added cells are traced from the cells with
+    NumpyViewshed.reverseviewshed(). Rows are not recomputed, see recompute() for surface edits.
+    :param store: VisibilityStore object
+    :param surface: NumpyViewshed.Surface or TiledSurface object after the edit
+    :param mask: Boolean array shaped like the surface (or CellMask), True where a ground observer may stand
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes, one per store row
+    :param path: Directory of the new store, must differ from the store's
+    :param cumulative: CumulativeCount object over the store, carried over to the new store if given
+    :param params: Viewshed parameters passed to NumpyViewshed.reverseviewshed()
+    :return: Tuple of (new VisibilityStore object opened read/write, CumulativeCount object over it or None, array
+             of added column indices)
+    """
+    VisibilityStore.checkalgorithm(params)
+    params.pop('algorithm', None)
+    params.pop('targets', None)
+    new = VisibilityStore.createstore(path, surface, mask, store.oids)
+    oldcol = store.colindex.lookup(new.cells)
+    kept = np.flatnonzero(oldcol >= 0)
+    added = np.flatnonzero(oldcol < 0)
+    print('Remasking visibility store: {} cells kept, {} added, {} removed...'.format(
+        len(kept), len(added), store.ncells - len(kept)))
+    vis = np.zeros((store.npoints, len(added)), dtype=bool)
+    arows, acols = np.divmod(new.cells[added], new.shape[1])
+    for k in range(len(added)):
+        vis[:, k] = NumpyViewshed.reverseviewshed(surface, arows[k], acols[k], xs, ys, zs, **params)
+    for s in range(0, store.npoints, VisibilityStore.CHUNK):
+        old = np.unpackbits(store.bits[s:s + VisibilityStore.CHUNK], axis=1)[:, :store.ncells]
+        bits = np.zeros((len(old), new.ncells), dtype=np.uint8)
+        bits[:, kept] = old[:, oldcol[kept]]
+        bits[:, added] = vis[s:s + VisibilityStore.CHUNK]
+        new.bits[s:s + VisibilityStore.CHUNK] = np.packbits(bits, axis=1)
+    new.flush()
+    if cumulative is None:
+        return new, None, added
+    counts = np.zeros(new.ncells, dtype=np.int64)
+    counts[kept] = cumulative.counts[oldcol[kept]]
+    counts[added] = vis[cumulative.unseen].sum(axis=0)
+    return new, CumulativeCount(new, cumulative.unseen, counts), added
+
+
+def warmstart(store, x, y, mode='greedy', cover=None, **kwargs):
+    """
+    Re-runs observer selection from a previous station set. Stations still on candidate cells are kept, flight
+    points they no longer see are covered greedily, and stations made redundant are dropped. Exact modes use the
+    result as their first incumbent.
+    :param store: VisibilityStore object
+    :param x, y: Arrays of previous station coordinates (POINT_X, POINT_Y of the best observers table)
+    :param mode: ObserverSolver mode
+    :param cover: Coverage bits from ObserverSolver.coverbits(), computed if None
+    :param kwargs: Solver options passed to ObserverSolver.solve()
+    :return: List of selected candidate cell indices in pass order
+    """
+    if cover is None:
+        cover = ObserverSolver.coverbits(store)
+    js = store.cellindex(x, y)
+    js = js[js >= 0]
+    initial = [int(j) for k, j in enumerate(js) if j not in js[:k]]
+    print('{} of {} previous stations still on candidate cells.'.format(len(initial), len(x)))
+    if mode in ('exact', 'budget'):
+        return ObserverSolver.solve(store, mode, cover=cover, initial=initial, **kwargs)
+    selected = ObserverSolver.solve(store, 'greedy', initial=initial, **kwargs)
+    return ObserverSolver.passorder(store, prune(store, selected, cover), cover, kwargs.get('weights'))
+
+
+def prune(store, selected, cover=None):
+    """
+    Drops observers whose flight points are all seen by other observers, latest passes first.
+    :param store: VisibilityStore object
+    :param selected: List of candidate cell indices
+    :param cover: Coverage bits from ObserverSolver.coverbits(), computed if None
+    :return: List of the remaining candidate cell indices, in the same order
+    """
+    if not selected:
+        return []
+    if cover is None:
+        sees = store.columns(selected).T
+    else:
+        sees = np.unpackbits(cover[selected], axis=1)[:, :store.npoints].astype(bool)
+    times = sees.sum(axis=0)
+    keep = np.ones(len(selected), dtype=bool)
+    for k in range(len(selected) - 1, -1, -1):
+        if (times[sees[k]] > 1).all():
+            keep[k] = False
+            times -= sees[k]
+    return [j for j, kept in zip(selected, keep) if kept]
+
+
+def update(store, oldsurface, surface, xs, ys, zs, mask=None, path=None, cumulative=None, stations=None,
+           mode='greedy', weights=None, **params):
+    """
+    Brings a visibility store up to date after DSM and/or observer mask edits, then re-selects observers.
+    :param store: VisibilityStore object opened read/write
+    :param oldsurface: Surface (or elevation array) the store was computed on
+    :param surface: NumpyViewshed.Surface or TiledSurface object after the edit
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes, one per store row
+    :param mask: Boolean observer mask after the edit, the store's candidate cells if None
+    :param path: Directory of the new store, required when the set of candidate cells changes
+    :param cumulative: CumulativeCount object over the store to patch, None to skip
+    :param stations: Tuple of (x, y) arrays of the previous stations, None to skip observer selection
+    :param mode: ObserverSolver mode
+    :param weights: Array of flight point (row) weights for observer selection, 1 each if None
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: Tuple of (VisibilityStore object, CumulativeCount object or None, list of selected candidate cell
+             indices or None)
+    """
+    start = time.time()
+    radius = params.get('radius', NumpyViewshed.OUTER_RADIUS)
+    dirty = changedcells(oldsurface, surface)
+    if mask is None:
+        mask = store.targets
+    recast = np.setxor1d(store.cells, VisibilityStore.validcells(surface, mask)[0])
+    print('{} surface cells and {} candidate cells changed.'.format(int(dirty.sum()), len(recast)))
+    if len(recast):
+        if path is None or path == store.path:
+            raise ValueError('The candidate cells changed, a new store path is required')
+        store, cumulative, added = remask(store, surface, mask, xs, ys, zs, path, cumulative, **params)
+    rows = affectedpoints(surface, dirty, xs, ys, radius)
+    print('Recomputing {} of {} flight point viewsheds...'.format(len(rows), len(xs)))
+    recompute(store, surface, rows, xs, ys, zs, cumulative, **params)
+    print('Visibility store updated in {:.1f}s'.format(time.time() - start))
+    if stations is None:
+        return store, cumulative, None
+    return store, cumulative, warmstart(store, stations[0], stations[1], mode, weights=weights)
+
+
+if __name__ == '__main__':
+    # Raise a crane and a building on a synthetic DSM with a short radius, so that the edits reach only part of the
+    # flight path, then check the update against a full rebuild
+    import os
+    import tempfile
+    import SyntheticUrban
+    workdir = tempfile.mkdtemp()
+    params = {'radius': 100.0}
+    surface = SyntheticUrban.urbansurface(200, 200, 2.0, nbldgs=250, seed=5)
+    xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude=2.0, spacing=40.0, interval=30.0)
+    t = time.time()
+    store = VisibilityStore.createstore(os.path.join(workdir, 'vis'), surface, SyntheticUrban.groundmask(surface),
+                                        np.arange(1, len(xs) + 1))
+    VisibilityStore.fillstore(store, surface, xs, ys, zs, **params)
+    tfull = time.time() - t
+    cumulative = CumulativeCount(store)
+    selected = ObserverSolver.solve(store)
+    sx, sy = store.cellxy(np.asarray(selected, dtype=np.int64))
+
+    # A crane next to the first station and a building on the second
+    elev = surface.elev.copy()
+    for j in selected[:2]:
+        r, c = divmod(int(store.cells[j]), store.shape[1])
+        elev[max(r - 3, 0):r + 4, c + 2:c + 4] += 25.0
+    edited = NumpyViewshed.Surface(elev, surface.xmin, surface.ymax, surface.cellsize)
+    mask = SyntheticUrban.groundmask(edited)
+
+    t = time.time()
+    patched, cumulative, reselected = update(store, surface, edited, xs, ys, zs, mask,
+                                             os.path.join(workdir, 'updated'), cumulative, (sx, sy), **params)
+    print('Full build {:.1f}s, update {:.1f}s'.format(tfull, time.time() - t))
+
+    rebuilt = VisibilityStore.createstore(os.path.join(workdir, 'rebuilt'), edited, mask, store.oids)
+    VisibilityStore.fillstore(rebuilt, edited, xs, ys, zs, **params)
+    assert np.array_equal(patched.cells, rebuilt.cells), 'Candidate cells differ'
+    assert np.array_equal(np.asarray(patched.bits), np.asarray(rebuilt.bits)), 'Updated store differs'
+    assert np.array_equal(cumulative.counts, rebuilt.popcount()), 'Patched cumulative count differs'
+    coverable = rebuilt.rowcounts() > 0
+    seen = rebuilt.columns(reselected).any(axis=1)
+    assert np.array_equal(seen, coverable), 'Warm-started stations miss flight points'
+    kept = set(reselected) & set(patched.cellindex(sx, sy).tolist())
+    print('Warm start: {} observers, {} of {} previous stations kept (fresh greedy: {} observers)'.format(
+        len(reselected), len(kept), len(selected), len(ObserverSolver.solve(rebuilt))))
+    print('Updated store and cumulative count match a full rebuild.')
@@ -0,0 +1,190 @@
+# --------------------------------------------------------
+# Point-to-point line-of-sight queries over a max-elevation pyramid
+# Answers batches of (ground observer, flight point) pairs with the Viewshed2 parameters, skipping stretches of
+# sightline whose maximum surface elevation stays below the line of sight
+# --------------------------------------------------------
+
+import math
+import numpy as np
+import NumpyViewshed
+
+# Default number of pyramid levels above the surface
+LEVELS = 6
+# Safety margin of the coarse clearance test (meters); exact decisions are always made on the surface itself
+MARGIN = 1e-3
+
+
+class LineOfSight(object):
+    """
+    Line-of-sight query index of a surface: a pyramid of maximum elevations, level L holding the maximum of each
+    2^L x 2^L block dilated to its neighbors so that it bounds every sample of a 2^L-sample stretch of sightline.
+    Answers are identical to NumpyViewshed.viewshedwindow() and reverseviewshed().
+    :param surface: NumpyViewshed.Surface object
+    :param levels: Number of pyramid levels above the surface
+    :param step: Sightline sampling interval, as a fraction of the cell size
+    """
+    def __init__(self, surface, levels=LEVELS, step=NumpyViewshed.STEP):
+        self.surface = surface
+        self.step = step
+        elev = surface.read(0, surface.shape[0], 0, surface.shape[1])
+        self.elev = np.where(np.isnan(elev), -np.inf, elev).astype(np.float32)
+        levels = max(min(levels, int(math.log(max(max(surface.shape), 2), 2))), 0)
+        # Stretches of 2^L samples reach less than ceil(step) level L cells from their first sample
+        reach = max(int(math.ceil(step)), 1)
+        self.levels = [self.elev]
+        blocks = self.elev
+        for level in range(1, levels + 1):
+            nrows = -(-blocks.shape[0] // 2)
+            ncols = -(-blocks.shape[1] // 2)
+            padded = np.full((nrows * 2, ncols * 2), -np.inf, dtype=np.float32)
+            padded[:blocks.shape[0], :blocks.shape[1]] = blocks
+            blocks = padded.reshape(nrows, 2, ncols, 2).max(axis=(1, 3))
+            self.levels.append(dilate(blocks, reach))
+
+    def blocked(self, ox, oy, oz, tx, ty, tz, refraction=NumpyViewshed.REFRACTION):
+        """
+        Tests whether the surface blocks sightlines, sampled exactly as NumpyViewshed.horizon() samples them.
+        :param ox, oy, oz: Arrays of sightline origin coordinates and elevations (flight points)
+        :param tx, ty, tz: Arrays of target cell center coordinates and elevations (including the surface offset)
+        :param refraction: Refractivity coefficient
+        :return: Boolean array, True where a sample at or above the line of sight blocks the target
+        """
+        surface = self.surface
+        dx = tx - ox
+        dy = ty - oy
+        d = np.hypot(dx, dy)
+        nseg = NumpyViewshed.segments(d, surface.cellsize, self.step)
+        slope = NumpyViewshed.sampleslope(tz, d, oz, refraction)
+        trow, tcol = surface.rowcol(tx, ty)
+        out = np.zeros(len(d), dtype=bool)
+        # Stretches of samples k0..k0 + 2^L - 1 (sample k sits at k / nseg of the sightline) still to be checked
+        top = len(self.levels) - 1
+        size = 2 ** top
+        nsamples = (nseg - 1).astype(np.int64)
+        nblocks = -(-nsamples // size)
+        ray = np.repeat(np.arange(len(d)), nblocks)
+        k0 = 1 + size * (np.arange(len(ray)) - np.repeat(np.cumsum(nblocks) - nblocks, nblocks))
+        for level in range(top, 0, -1):
+            k1 = np.minimum(k0 + size - 1, nsamples[ray])
+            f0 = k0 / nseg[ray]
+            ds0 = f0 * d[ray]
+            ds1 = k1 / nseg[ray] * d[ray]
+            rows, cols = NumpyViewshed.samplecells(surface, ox[ray], oy[ray], dx[ray], dy[ray], f0)
+            # The first sample of every stretch is tested exactly, so blocked sightlines drop out early
+            hit = self._hits(rows, cols, trow[ray], tcol[ray], ds0, oz[ray], slope[ray], refraction)
+            out[ray[hit]] = True
+            grid = self.levels[level]
+            high = grid[np.clip(rows >> level, 0, grid.shape[0] - 1), np.clip(cols >> level, 0, grid.shape[1] - 1)]
+            # Lowest line of sight (plus curvature drop) over the stretch
+            low = oz[ray] + np.minimum(ds0 * slope[ray], ds1 * slope[ray]) + \
+                NumpyViewshed.curvature(ds0, refraction) - MARGIN
+            keep = ~(high < low) & ~out[ray]
+            ray = ray[keep]
+            k0 = k0[keep]
+            size //= 2
+            half = k0 + size
+            split = half <= nsamples[ray]
+            ray = np.concatenate([ray, ray[split]])
+            k0 = np.concatenate([k0, half[split]])
+        # Exact test of the remaining samples
+        f = k0 / nseg[ray]
+        rows, cols = NumpyViewshed.samplecells(surface, ox[ray], oy[ray], dx[ray], dy[ray], f)
+        hit = self._hits(rows, cols, trow[ray], tcol[ray], f * d[ray], oz[ray], slope[ray], refraction)
+        out[ray[hit]] = True
+        return out
+
+    def _hits(self, rows, cols, trow, tcol, ds, oz, slope, refraction):
+        """
+        Tests sightline samples exactly, as in NumpyViewshed.horizon(): the target cell and cells outside the surface
+        never block.
+        :return: Boolean array, True where the sample is at or above the line of sight
+        """
+        h, valid = NumpyViewshed.sampleheights(self.elev, 0, 0, rows, cols, trow, tcol)
+        return valid & ~(slope > NumpyViewshed.sampleslope(h, ds, oz, refraction))
+
+    def query(self, x, y, fx, fy, fz, offset=NumpyViewshed.SURFACE_OFFSET, radius=NumpyViewshed.OUTER_RADIUS,
+              upper=NumpyViewshed.VERTICAL_UPPER, lower=NumpyViewshed.VERTICAL_LOWER,
+              refraction=NumpyViewshed.REFRACTION):
+        """
+        Tests whether ground observers see flight points, for pairs broadcast against each other. Observers stand
+        at the center of the cell containing their location, with the surface offset added, as in Viewshed2.
+        :param x, y: Ground observer location(s)
+        :param fx, fy, fz: Flight point coordinates and altitudes
+        :param offset: Surface offset added to the observer cell (meters)
+        :param radius: Outer radius, measured as 3D distance (meters)
+        :param upper: Upper vertical angle (degrees)
+        :param lower: Lower vertical angle (degrees)
+        :param refraction: Refractivity coefficient
+        :return: Boolean array of the broadcast shape, True where visible
+        """
+        x, y, fx, fy, fz = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (x, y, fx, fy, fz)])
+        shape = x.shape
+        x, y, fx, fy, fz = [a.ravel() for a in (x, y, fx, fy, fz)]
+        surface = self.surface
+        row, col = surface.rowcol(x, y)
+        inside = (row >= 0) & (row < surface.shape[0]) & (col >= 0) & (col < surface.shape[1])
+        row = np.clip(row, 0, surface.shape[0] - 1)
+        col = np.clip(col, 0, surface.shape[1] - 1)
+        tx, ty = surface.cellxy(row, col)
+        tz = self.elev[row, col].astype(np.float64) + offset
+        tz[np.isinf(tz)] = np.nan
+        d = np.hypot(tx - fx, ty - fy)
+        vis = np.zeros(len(x), dtype=bool)
+        near = np.flatnonzero(inside & (d <= radius) & ~np.isnan(tz))
+        blocked = self.blocked(fx[near], fy[near], fz[near], tx[near], ty[near], tz[near], refraction)
+        maxslope = np.where(blocked, np.inf, -np.inf)
+        vis[near] = NumpyViewshed.visible(maxslope, d[near], fz[near], tz[near], radius, upper, lower, refraction)
+        return vis.reshape(shape)
+
+    def visibleoids(self, x, y, pts, **params):
+        """
+        Lists the flight points visible from a ground observer location.
+        :param x, y: Ground observer location
+        :param pts: Structured array with FlightPoints.FLIGHT_DTYPE fields
+        :param params: Viewshed parameters passed to query()
+        :return: List of visible flight point OBJECTIDs
+        """
+        return pts['OID'][self.query(x, y, pts['X'], pts['Y'], pts['Z'], **params)].tolist()
+
+
+def dilate(grid, reach=1):
+    """
+    Maximum over the neighborhood of each cell, out to reach cells in every direction.
+    :param grid: 2D array
+    :param reach: Neighborhood radius (cells)
+    :return: Array shaped like grid
+    """
+    padded = np.pad(grid, reach, mode='constant', constant_values=-np.inf)
+    out = np.full(grid.shape, -np.inf, dtype=grid.dtype)
+    for dr in range(2 * reach + 1):
+        for dc in range(2 * reach + 1):
+            np.maximum(out, padded[dr:dr + grid.shape[0], dc:dc + grid.shape[1]], out=out)
+    return out
+
+
+if __name__ == '__main__':
+    # Check queries against reverse viewsheds on a synthetic DSM and time them
+    import time
+    import SyntheticUrban
+    surface = SyntheticUrban.urbansurface(300, 300, 2.0, nbldgs=300, seed=3, ntrees=300)
+    xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude=5.0, spacing=40.0, interval=20.0)
+    t = time.time()
+    los = LineOfSight(surface)
+    print('Index built in {:.3f}s ({} levels)'.format(time.time() - t, len(los.levels) - 1))
+    rng = np.random.RandomState(0)
+    rows = rng.randint(0, surface.shape[0], 40)
+    cols = rng.randint(0, surface.shape[1], 40)
+    t = time.time()
+    expected = np.array([NumpyViewshed.reverseviewshed(surface, r, c, xs, ys, zs) for r, c in zip(rows, cols)])
+    tref = time.time() - t
+    gx, gy = surface.cellxy(rows, cols)
+    t = time.time()
+    got = los.query(gx[:, np.newaxis], gy[:, np.newaxis], xs, ys, zs)
+    tlos = time.time() - t
+    npairs = expected.size
+    print('{} pairs, {:.1f}% visible'.format(npairs, expected.mean() * 100))
+    print('Reverse viewsheds: {:.1f} us per pair, line of sight index: {:.1f} us per pair'.format(
+        tref / npairs * 1e6, tlos / npairs * 1e6))
+    assert np.array_equal(got, expected), 'Line of sight differs from viewshed in {} pairs'.format(
+        int((got != expected).sum()))
+    print('Line of sight queries match the viewsheds.')
@@ -0,0 +1,502 @@
+# --------------------------------------------------------
+# Vectorized NumPy viewshed engine for flight points
+# Reproduces the Viewshed2 parameters used in RunViewshed.py without an ArcGIS Spatial Analyst license
+# --------------------------------------------------------
+
+import math
+import numpy as np
+
+# Viewshed2 parameters used in RunViewshed.py
+REFRACTION = 0.13           # Refractivity coefficient
+SURFACE_OFFSET = 1.63       # Height added to each target cell, eye level of a ground observer (meters)
+OUTER_RADIUS = 500.0        # Outer radius, measured as 3D distance (meters)
+VERTICAL_UPPER = 0.0        # Upper vertical angle (degrees)
+VERTICAL_LOWER = -90.0      # Lower vertical angle (degrees)
+EARTH_DIAMETER = 12740000.0 # Earth diameter used by Viewshed2 for the curvature correction (meters)
+
+# Sightline sampling interval, as a fraction of the cell size
+STEP = 0.5
+# Viewshed algorithms: every sightline sampled (exact tier) or XDraw horizon propagation (approximate tier).
+# Visibility stores only take xdraw through VisibilityStore.fillstore(approximate=True), which marks the store.
+ALGORITHMS = ('sightlines', 'xdraw')
+# Horizon slope standing for "nothing blocks", finite so that it can be interpolated
+NOBLOCK = -1e12
+# Number of sightlines evaluated at once, bounds temporary memory
+CHUNK = 1024
+
+
+class Surface(object):
+    """
+    Digital surface model held as a NumPy array with its georeference.
+    :param elev: 2D array of surface elevations, NaN where NoData
+    :param xmin: X coordinate of the left edge of the raster
+    :param ymax: Y coordinate of the top edge of the raster
+    :param cellsize: Cell size (meters)
+    """
+    def __init__(self, elev, xmin, ymax, cellsize):
+        self.elev = np.asarray(elev, dtype=np.float32)
+        self.xmin = float(xmin)
+        self.ymax = float(ymax)
+        self.cellsize = float(cellsize)
+        self.shape = self.elev.shape
+
+    def read(self, r0, r1, c0, c1):
+        """
+        Reads a window of elevations.
+        :param r0, r1: First and last (exclusive) row of the window
+        :param c0, c1: First and last (exclusive) column of the window
+        :return: 2D array of elevations
+        """
+        return self.elev[r0:r1, c0:c1]
+
+    def rowcol(self, x, y):
+        """
+        Converts map coordinates to the row and column of the containing cell.
+        :param x: X coordinate(s)
+        :param y: Y coordinate(s)
+        :return: Tuple of row and column index arrays
+        """
+        row = np.floor((self.ymax - np.asarray(y, dtype=np.float64)) / self.cellsize).astype(np.int64)
+        col = np.floor((np.asarray(x, dtype=np.float64) - self.xmin) / self.cellsize).astype(np.int64)
+        return row, col
+
+    def cellxy(self, row, col):
+        """
+        Converts cell rows and columns to map coordinates of the cell centers.
+        :param row: Row index(es)
+        :param col: Column index(es)
+        :return: Tuple of X and Y coordinate arrays
+        """
+        x = self.xmin + (np.asarray(col) + 0.5) * self.cellsize
+        y = self.ymax - (np.asarray(row) + 0.5) * self.cellsize
+        return x, y
+
+    def window(self, x, y, radius):
+        """
+        Finds the window of cells within a horizontal radius of a location, clipped to the raster.
+        :param x: X coordinate
+        :param y: Y coordinate
+        :param radius: Search radius (meters)
+        :return: Tuple (r0, r1, c0, c1) of window bounds, end exclusive
+        """
+        cs = self.cellsize
+        r0 = max(int(math.floor((self.ymax - y - radius) / cs)), 0)
+        r1 = min(int(math.floor((self.ymax - y + radius) / cs)) + 1, self.shape[0])
+        c0 = max(int(math.floor((x - radius - self.xmin) / cs)), 0)
+        c1 = min(int(math.floor((x + radius - self.xmin) / cs)) + 1, self.shape[1])
+        return r0, max(r1, r0), c0, max(c1, c0)
+
+
+def surfacefromraster(raster):
+    """
+    Loads a surface raster (e.g. Surface_SE_2m) into a Surface object. Requires arcpy.
+    :param raster: Path to surface raster
+    :return: Surface object
+    """
+    import arcpy
+    ras = arcpy.Raster(raster)
+    elev = arcpy.RasterToNumPyArray(ras, nodata_to_value=np.nan).astype(np.float32)
+    return Surface(elev, ras.extent.XMin, ras.extent.YMax, ras.meanCellWidth)
+
+
+def maskfromraster(raster):
+    """
+    Loads a binary observer mask raster (e.g. BldgVegMask_V2_bin) as a Boolean array. Requires arcpy.
+    :param raster: Path to mask raster, aligned with the surface raster
+    :return: Boolean array, True where a ground observer may stand
+    """
+    import arcpy
+    return arcpy.RasterToNumPyArray(arcpy.Raster(raster), nodata_to_value=0) == 1
+
+
+def curvature(d, refraction=REFRACTION):
+    """
+    Apparent drop of the surface due to earth curvature and refraction, as applied by Viewshed2.
+    :param d: Horizontal distance(s) from the observer (meters)
+    :param refraction: Refractivity coefficient
+    :return: Drop (meters)
+    """
+    return (1.0 - refraction) * d * d / EARTH_DIAMETER
+
+
+def segments(d, cellsize, step=STEP):
+    """
+    Number of segments a sightline is sampled in: samples sit every step cells, sample k at k / segments of the way
+    from the observer to the target.
+    :param d: Horizontal sightline length(s) (meters)
+    :param cellsize: Cell size (meters)
+    :param step: Sampling interval, as a fraction of the cell size
+    :return: Array of segment counts (float), at least 1
+    """
+    return np.maximum(np.ceil(d / (cellsize * step)), 1.0)
+
+
+def samplecells(surface, ox, oy, dx, dy, f):
+    """
+    Cells under sightline samples.
+    :param surface: Surface object
+    :param ox, oy: Observer coordinates
+    :param dx, dy: Offsets from the observer to the target
+    :param f: Fractions of the sightline at which samples sit, broadcast against the other arguments
+    :return: Tuple of row and column index arrays
+    """
+    cs = surface.cellsize
+    rows = np.floor((surface.ymax - oy - f * dy) / cs).astype(np.int64)
+    cols = np.floor((ox + f * dx - surface.xmin) / cs).astype(np.int64)
+    return rows, cols
+
+
+def sampleheights(elev, r0, c0, rows, cols, trow, tcol):
+    """
+    Surface elevations under sightline samples. The target cell itself and cells outside the window never block.
+    :param elev: 2D array of elevations of the window
+    :param r0, c0: Row and column of the window origin
+    :param rows, cols: Arrays of sample cells, from samplecells()
+    :param trow, tcol: Target cells, broadcast against rows and cols
+    :return: Tuple of (array of elevations, Boolean array of samples that may block)
+    """
+    valid = ~((rows == trow) & (cols == tcol))
+    rows = rows - r0
+    cols = cols - c0
+    valid &= (rows >= 0) & (rows < elev.shape[0]) & (cols >= 0) & (cols < elev.shape[1])
+    return elev[np.clip(rows, 0, elev.shape[0] - 1), np.clip(cols, 0, elev.shape[1] - 1)], valid
+
+
+def sampleslope(h, ds, oz, refraction=REFRACTION):
+    """
+    Curvature corrected rise over horizontal run from an observer to points along its sightlines.
+    :param h: Elevations of the points
+    :param ds: Horizontal distances of the points from the observer (meters)
+    :param oz: Observer elevation
+    :param refraction: Refractivity coefficient
+    :return: Array of slopes, NaN where h is NaN or ds is 0
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (h - curvature(ds, refraction) - oz) / ds
+
+
+def horizon(surface, window, ox, oy, oz, tx, ty, step=STEP, refraction=REFRACTION):
+    """
+    Finds the steepest rise of the surface along each sightline from an observer to a target.
+    Sightlines are sampled every step cells; the target cell itself never blocks.
+    :param surface: Surface object
+    :param window: Window (r0, r1, c0, c1) holding every sightline; cells outside it do not block
+    :param ox, oy, oz: Observer coordinates and elevation
+    :param tx, ty: Target coordinates, broadcast against the observer
+    :return: Array of maximum slopes (curvature corrected rise over horizontal run), -inf where unobstructed
+    """
+    r0, r1, c0, c1 = window
+    elev = surface.read(r0, r1, c0, c1)
+    ox, oy, oz, tx, ty = [np.ravel(a).astype(np.float64) for a in np.broadcast_arrays(ox, oy, oz, tx, ty)]
+    trow, tcol = surface.rowcol(tx, ty)
+    out = np.full(len(tx), -np.inf)
+    for s in range(0, len(tx), CHUNK):
+        e = s + CHUNK
+        dx = tx[s:e] - ox[s:e]
+        dy = ty[s:e] - oy[s:e]
+        d = np.hypot(dx, dy)
+        nseg = segments(d, surface.cellsize, step)
+        kmax = int(nseg.max())
+        if kmax < 2:
+            continue
+        f = np.arange(1, kmax)[np.newaxis, :] / nseg[:, np.newaxis]
+        rows, cols = samplecells(surface, ox[s:e, np.newaxis], oy[s:e, np.newaxis], dx[:, np.newaxis],
+                                 dy[:, np.newaxis], f)
+        h, valid = sampleheights(elev, r0, c0, rows, cols, trow[s:e, np.newaxis], tcol[s:e, np.newaxis])
+        valid &= f < 1.0
+        slope = sampleslope(h, f * d[:, np.newaxis], oz[s:e, np.newaxis], refraction)
+        slope[~valid | np.isnan(slope)] = -np.inf
+        out[s:e] = slope.max(axis=1)
+    return out
+
+
+def visible(maxslope, d, oz, tz, radius=OUTER_RADIUS, upper=VERTICAL_UPPER, lower=VERTICAL_LOWER,
+            refraction=REFRACTION):
+    """
+    Decides visibility of targets given the horizon along their sightlines.
+    :param maxslope: Maximum slope along each sightline, from horizon()
+    :param d: Horizontal distance from observer to target (meters)
+    :param oz: Observer elevation
+    :param tz: Target elevation, including the surface offset
+    :param radius: Outer radius, measured as 3D distance (meters)
+    :param upper: Upper vertical angle (degrees)
+    :param lower: Lower vertical angle (degrees)
+    :param refraction: Refractivity coefficient
+    :return: Boolean array, True where visible
+    """
+    rise = tz - curvature(d, refraction) - oz
+    angle = np.degrees(np.arctan2(rise, d))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        clear = np.where(d > 0, rise / d > maxslope, True)
+        return clear & (angle <= upper) & (angle >= lower) & (np.hypot(d, rise) <= radius) & ~np.isnan(tz)
+
+
+_rings = {}
+
+
+def xdrawrings(k):
+    """
+    Ring geometry for XDraw on a (2k+1) x (2k+1) square centered on the observer cell. Each cell's horizon is
+    interpolated between the two cells of the previous ring that its sightline crosses.
+    :param k: Number of rings
+    :return: List, per ring, of (cell, first predecessor, second predecessor, weight) flat index arrays
+    """
+    if k not in _rings:
+        n = 2 * k + 1
+        rings = []
+        for ring in range(1, k + 1):
+            dr, dc = np.mgrid[-ring:ring + 1, -ring:ring + 1]
+            edge = np.maximum(np.abs(dr), np.abs(dc)) == ring
+            dr = dr[edge]
+            dc = dc[edge]
+            xmajor = np.abs(dc) >= np.abs(dr)
+            # Position where the sightline crosses the previous ring, along the minor axis
+            t = np.where(xmajor, dr, dc) * (ring - 1) / float(ring)
+            lo = np.floor(t)
+            w = t - lo
+            lo = lo.astype(np.int64)
+            prow1 = np.where(xmajor, lo, dr - np.sign(dr))
+            pcol1 = np.where(xmajor, dc - np.sign(dc), lo)
+            prow2 = np.where(xmajor, lo + 1, prow1)
+            pcol2 = np.where(xmajor, pcol1, lo + 1)
+            prow2 = np.minimum(prow2, k)
+            pcol2 = np.minimum(pcol2, k)
+            rings.append(((dr + k) * n + dc + k, (prow1 + k) * n + pcol1 + k, (prow2 + k) * n + pcol2 + k, w))
+        _rings[k] = rings
+    return _rings[k]
+
+
+def xdrawwindow(surface, x, y, z, offset=SURFACE_OFFSET, radius=OUTER_RADIUS, upper=VERTICAL_UPPER,
+                lower=VERTICAL_LOWER, refraction=REFRACTION):
+    """
+    Approximate viewshed of one flight point with XDraw: horizons are propagated ring by ring outward from the
+    observer cell, so each cell costs constant time instead of one sightline. Interpolating horizons between two
+    cells of the previous ring lowers them behind narrow obstacles, so some shadowed cells come out visible.
+    :param surface: Surface object
+    :param x, y, z: Flight point coordinates and altitude
+    :return: Tuple (r0, c0, vis) of the window origin and Boolean visibility window
+    """
+    r0, r1, c0, c1 = surface.window(x, y, radius)
+    orow, ocol = surface.rowcol(x, y)
+    k = int(math.ceil(radius / surface.cellsize)) + 1
+    n = 2 * k + 1
+    # Square centered on the observer cell, NaN outside the surface
+    elev = np.full((n, n), np.nan)
+    sr0, sc0 = int(orow) - k, int(ocol) - k
+    ir0, ir1 = max(r0, sr0), min(r1, sr0 + n)
+    ic0, ic1 = max(c0, sc0), min(c1, sc0 + n)
+    if ir1 > ir0 and ic1 > ic0:
+        elev[ir0 - sr0:ir1 - sr0, ic0 - sc0:ic1 - sc0] = surface.read(ir0, ir1, ic0, ic1)
+    rows, cols = np.mgrid[sr0:sr0 + n, sc0:sc0 + n]
+    tx, ty = surface.cellxy(rows, cols)
+    d = np.hypot(tx - x, ty - y).ravel()
+    ring = np.maximum(np.abs(rows - int(orow)), np.abs(cols - int(ocol))).ravel()
+    # Cells block as flat tops, as along sampled sightlines: a roof seen from above blocks most at its far edge,
+    # half a cell past its center along the major axis, which the center alone misses
+    dexit = d * (ring + 0.5) / np.maximum(ring, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (elev.ravel() - curvature(d, refraction) - z) / d
+        slope = np.fmax(slope, (elev.ravel() - curvature(dexit, refraction) - z) / dexit)
+    slope[np.isnan(slope) | (d == 0)] = NOBLOCK
+    horizons = np.full(n * n, NOBLOCK)
+    block = slope.copy()
+    for cell, p1, p2, w in xdrawrings(k):
+        horizons[cell] = (1.0 - w) * block[p1] + w * block[p2]
+        block[cell] = np.maximum(horizons[cell], slope[cell])
+    vis = visible(horizons, d, z, elev.ravel() + offset, radius, upper, lower, refraction).reshape(n, n)
+    out = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+    if ir1 > ir0 and ic1 > ic0:
+        out[ir0 - r0:ir1 - r0, ic0 - c0:ic1 - c0] = vis[ir0 - sr0:ir1 - sr0, ic0 - sc0:ic1 - sc0]
+    return r0, c0, out
+
+
+def viewshedwindow(surface, x, y, z, offset=SURFACE_OFFSET, radius=OUTER_RADIUS, upper=VERTICAL_UPPER,
+                   lower=VERTICAL_LOWER, refraction=REFRACTION, step=STEP, targets=None, algorithm='sightlines'):
+    """
+    Computes the viewshed of one flight point within its outer radius.
+    :param surface: Surface object
+    :param x, y, z: Flight point coordinates and altitude
+    :param offset: Surface offset added to target cells (meters)
+    :param targets: Boolean array shaped like the surface (or a store's CellMask) limiting the cells evaluated,
+                    all cells if None
+    :param algorithm: 'sightlines' (exact) or 'xdraw' (approximate: 97.4-97.8% cell agreement with sightlines on
+                      synthetic urban surfaces, and it reports more visible cells than it misses). Only sightlines
+                      may fill visibility stores, which feed observer selection and reports
+    :return: Tuple (r0, c0, vis) of the window origin and Boolean visibility window
+    """
+    if algorithm == 'xdraw':
+        r0, c0, vis = xdrawwindow(surface, x, y, z, offset, radius, upper, lower, refraction)
+        if targets is not None:
+            vis &= targets[r0:r0 + vis.shape[0], c0:c0 + vis.shape[1]]
+        return r0, c0, vis
+    elif algorithm != 'sightlines':
+        raise ValueError('Unknown viewshed algorithm: {}'.format(algorithm))
+    window = surface.window(x, y, radius)
+    r0, r1, c0, c1 = window
+    rows, cols = np.mgrid[r0:r1, c0:c1]
+    tx, ty = surface.cellxy(rows.ravel(), cols.ravel())
+    d = np.hypot(tx - x, ty - y)
+    # Sort sightlines by length so each chunk samples a similar number of points
+    inside = d <= radius
+    if targets is not None:
+        inside &= targets[r0:r1, c0:c1].ravel()
+    inside = np.flatnonzero(inside)
+    inside = inside[np.argsort(d[inside], kind='stable')]
+    tz = surface.read(r0, r1, c0, c1).ravel()[inside].astype(np.float64) + offset
+    maxslope = horizon(surface, window, x, y, z, tx[inside], ty[inside], step, refraction)
+    vis = np.zeros((r1 - r0) * (c1 - c0), dtype=bool)
+    vis[inside] = visible(maxslope, d[inside], z, tz, radius, upper, lower, refraction)
+    return r0, c0, vis.reshape(r1 - r0, c1 - c0)
+
+
+def reverseviewshed(surface, row, col, xs, ys, zs, offset=SURFACE_OFFSET, radius=OUTER_RADIUS, upper=VERTICAL_UPPER,
+                    lower=VERTICAL_LOWER, refraction=REFRACTION, step=STEP):
+    """
+    Computes which flight points are visible from one candidate observer cell. Sightlines are the same as in
+    viewshedwindow(), traced from the cell up to the flight points, so both directions give identical results.
+    :param surface: Surface object
+    :param row, col: Row and column of the observer cell
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes
+    :param offset: Surface offset added to the observer cell (meters)
+    :return: Boolean array over flight points, True where visible
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    zs = np.asarray(zs, dtype=np.float64)
+    tx, ty = surface.cellxy(row, col)
+    tz = float(surface.read(row, row + 1, col, col + 1)[0, 0]) + offset
+    d = np.hypot(xs - tx, ys - ty)
+    near = np.flatnonzero(d <= radius)
+    near = near[np.argsort(d[near], kind='stable')]
+    maxslope = horizon(surface, surface.window(tx, ty, radius), xs[near], ys[near], zs[near], tx, ty, step, refraction)
+    vis = np.zeros(len(xs), dtype=bool)
+    vis[near] = visible(maxslope, d[near], zs[near], tz, radius, upper, lower, refraction)
+    return vis
+
+
+def viewshed(surface, x, y, z, **params):
+    """
+    Computes the viewshed of one flight point over the whole surface, equivalent to one Viewshed2 run.
+    :param surface: Surface object
+    :param x, y, z: Flight point coordinates and altitude
+    :param params: Viewshed parameters passed to viewshedwindow()
+    :return: Boolean array shaped like the surface, True where visible
+    """
+    vis = np.zeros(surface.shape, dtype=bool)
+    r0, c0, win = viewshedwindow(surface, x, y, z, **params)
+    vis[r0:r0 + win.shape[0], c0:c0 + win.shape[1]] = win
+    return vis
+
+
+def batchviewshed(surface, xs, ys, zs, **params):
+    """
+    Computes the viewsheds of a batch of flight points.
+    :param surface: Surface object
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes
+    :param params: Viewshed parameters passed to viewshedwindow()
+    :return: Boolean array of shape (points, rows, cols)
+    """
+    out = np.zeros((len(xs),) + surface.shape, dtype=bool)
+    for i in range(len(xs)):
+        r0, c0, win = viewshedwindow(surface, xs[i], ys[i], zs[i], **params)
+        out[i, r0:r0 + win.shape[0], c0:c0 + win.shape[1]] = win
+    return out
+
+
+def sightlineviewshed(surface, x, y, z, offset=SURFACE_OFFSET, radius=OUTER_RADIUS, upper=VERTICAL_UPPER,
+                      lower=VERTICAL_LOWER, refraction=REFRACTION):
+    """
+    Reference viewshed walking every cell crossed by every sightline (ALL_SIGHTLINES), one target at a time.
+    Slow; used to check the vectorized engine on small surfaces.
+    :param surface: Surface object
+    :param x, y, z: Flight point coordinates and altitude
+    :return: Boolean array shaped like the surface, True where visible
+    """
+    cs = surface.cellsize
+    vis = np.zeros(surface.shape, dtype=bool)
+    r0, r1, c0, c1 = surface.window(x, y, radius)
+    for r in range(r0, r1):
+        for c in range(c0, c1):
+            tx, ty = surface.cellxy(r, c)
+            d = math.hypot(tx - x, ty - y)
+            if d > radius:
+                continue
+            tz = float(surface.elev[r, c]) + offset
+            maxslope = -np.inf
+            # Parametric positions where the sightline crosses cell boundaries
+            ts = [0.0, 1.0]
+            if tx != x:
+                xb = surface.xmin + cs * np.arange(math.ceil((min(x, tx) - surface.xmin) / cs),
+                                                   math.floor((max(x, tx) - surface.xmin) / cs) + 1)
+                ts.extend((xb - x) / (tx - x))
+            if ty != y:
+                yb = surface.ymax - cs * np.arange(math.ceil((surface.ymax - max(y, ty)) / cs),
+                                                   math.floor((surface.ymax - min(y, ty)) / cs) + 1)
+                ts.extend((yb - y) / (ty - y))
+            ts = np.unique(np.clip(ts, 0.0, 1.0))
+            for t0, t1 in zip(ts[:-1], ts[1:]):
+                tm = 0.5 * (t0 + t1)
+                row, col = surface.rowcol(x + tm * (tx - x), y + tm * (ty - y))
+                if (row == r and col == c) or not (0 <= row < surface.shape[0] and 0 <= col < surface.shape[1]):
+                    continue
+                h = float(surface.elev[row, col])
+                for t in (t0, t1):
+                    if t > 0 and not math.isnan(h):
+                        maxslope = max(maxslope, (h - curvature(t * d, refraction) - z) / (t * d))
+            vis[r, c] = visible(maxslope, d, z, tz, radius, upper, lower, refraction)
+    return vis
+
+
+def comparealgorithms(surface, xs, ys, zs, **params):
+    """
+    Compares the speed of each viewshed algorithm and its cell agreement with the exact sightline result.
+    :param surface: Surface object
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes
+    :param params: Viewshed parameters passed to viewshedwindow()
+    :return: Dict of algorithm to dict of seconds per viewshed, cell agreement, missed and extra visible cells
+    """
+    import time
+    results = {}
+    exact = []
+    for algorithm in ALGORITHMS:
+        t = time.time()
+        vis = [viewshed(surface, xs[i], ys[i], zs[i], algorithm=algorithm, **params) for i in range(len(xs))]
+        seconds = (time.time() - t) / max(len(xs), 1)
+        if algorithm == 'sightlines':
+            exact = vis
+        agree = np.mean([np.mean(v == e) for v, e in zip(vis, exact)])
+        missed = sum(int((e & ~v).sum()) for v, e in zip(vis, exact))
+        extra = sum(int((v & ~e).sum()) for v, e in zip(vis, exact))
+        results[algorithm] = {'seconds': seconds, 'agreement': agree, 'missed': missed, 'extra': extra}
+        print('{}: {:.4f}s per viewshed, agreement {:.4f}, {} missed and {} extra visible cells'.format(
+            algorithm, seconds, agree, missed, extra))
+    return results
+
+
+if __name__ == '__main__':
+    # Parity check of the vectorized engine against the sightline reference on a synthetic DSM
+    import time
+    import SyntheticUrban
+    surface = SyntheticUrban.urbansurface(80, 80, 2.0, nbldgs=12, seed=1)
+    xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude=20.0, spacing=60.0, interval=50.0)
+    print('Checking {} flight points on a {} surface...'.format(len(xs), surface.shape))
+    agree = []
+    for i in range(len(xs)):
+        t = time.time()
+        fast = viewshed(surface, xs[i], ys[i], zs[i])
+        tfast = time.time() - t
+        t = time.time()
+        ref = sightlineviewshed(surface, xs[i], ys[i], zs[i])
+        tref = time.time() - t
+        agree.append(np.mean(fast == ref))
+        print('Flight point {}: agreement {:.4f}, {} visible cells, {:.2f}s vs {:.2f}s reference'.format(
+            i + 1, agree[-1], int(ref.sum()), tfast, tref))
+    print('Mean agreement: {:.4f}'.format(np.mean(agree)))
+    assert min(agree) >= 0.99, 'Vectorized viewshed diverges from sightline reference'
+
+    # Speed and agreement of each algorithm on larger synthetic urban surfaces
+    for seed in range(3):
+        surface = SyntheticUrban.urbansurface(300, 300, 2.0, nbldgs=200, seed=seed)
+        xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude=5.0, spacing=150.0, interval=150.0)
+        print('Synthetic urban surface {}, {} flight points:'.format(seed, len(xs)))
+        comparealgorithms(surface, xs, ys, zs)
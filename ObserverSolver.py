@@ -0,0 +1,246 @@
+# --------------------------------------------------------
+# Observer selection solvers over the visibility store
+# Greedy, exact branch-and-bound and time-budgeted minimum observer set cover
+# --------------------------------------------------------
+
+import math
+import time
+import numpy as np
+import BestSelect
+from CumulativeCount import CumulativeCount
+from VisibilityStore import POPCOUNT
+
+# Number of candidate cells transposed at once when building coverage bits
+CHUNK = 4096
+
+
+class _Timeout(Exception):
+    pass
+
+
+def coverbits(store):
+    """
+    Transposes the visibility store into bit-packed coverage sets, one row of flight point bits per candidate cell.
+    :param store: VisibilityStore object
+    :return: uint8 array of shape (candidate cells, ceil(flight points / 8))
+    """
+    cover = np.zeros((store.ncells, (store.npoints + 7) // 8), dtype=np.uint8)
+    for s in range(0, store.ncells, CHUNK):
+        js = np.arange(s, min(s + CHUNK, store.ncells))
+        cover[js] = np.packbits(store.columns(js).T, axis=1)
+    return cover
+
+
+def gains(cover, unseen, weights=None):
+    """
+    Counts the unseen flight points covered by each candidate cell.
+    :param cover: Coverage bits from coverbits(), one row per candidate cell
+    :param unseen: Packed bits of unseen flight points
+    :param weights: Array of flight point weights (e.g. merged flight point groups), 1 each if None
+    :return: Array of (weighted) counts over the rows of cover
+    """
+    out = np.zeros(len(cover), dtype=np.int64)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.int64)
+    for s in range(0, len(cover), CHUNK):
+        bits = cover[s:s + CHUNK] & unseen
+        if weights is None:
+            out[s:s + CHUNK] = POPCOUNT[bits].sum(axis=1, dtype=np.int64)
+        else:
+            out[s:s + CHUNK] = np.unpackbits(bits, axis=1)[:, :len(weights)].astype(np.int64).dot(weights)
+    return out
+
+
+def greedy(store, maxpasses=None, weights=None, initial=None):
+    """
+    Plain greedy selection: each pass picks the cell seeing the most unseen flight points, as in FindBestObservers.py.
+    :param store: VisibilityStore object
+    :param maxpasses: Maximum number of passes, no limit if None
+    :param weights: Array of flight point (row) weights, 1 each if None
+    :param initial: Candidate cell indices selected before the first pass (e.g. a previous station set)
+    :return: List of selected candidate cell indices in pass order
+    """
+    cumulative = CumulativeCount(store, weights=weights)
+    xs, ys = store.cellxy()
+    selected = [int(j) for j in initial] if initial is not None else []
+    for j in selected:
+        cumulative.remove(store.column(j))
+    while cumulative.unseen.any() and (maxpasses is None or len(selected) < maxpasses):
+        j = BestSelect.selectbest(cumulative.counts, xs, ys)
+        if j < 0:
+            break
+        selected.append(j)
+        cumulative.remove(store.column(j))
+    return selected
+
+
+def exact(store, timelimit=None, cover=None, weights=None, initial=None):
+    """
+    Branch-and-bound minimum observer set cover. Proves the minimum number of observers unless the time limit
+    is reached, in which case the best solution found so far is returned.
+    Flight points not visible from any candidate cell are ignored.
+    :param store: VisibilityStore object
+    :param timelimit: Time budget (seconds), no limit if None
+    :param cover: Coverage bits from coverbits(), computed if None
+    :param weights: Array of flight point (row) weights used to order the passes, 1 each if None
+    :param initial: Candidate cell indices completed greedily into the first incumbent (e.g. a previous station
+                    set), used when smaller than the plain greedy solution
+    :return: Tuple of (list of selected candidate cell indices, True if proven minimal)
+    """
+    start = time.time()
+    if cover is None:
+        cover = coverbits(store)
+    best = [greedy(store, weights=weights)]
+    if initial is not None:
+        warm = greedy(store, weights=weights, initial=initial)
+        if len(warm) < len(best[0]):
+            best[0] = warm
+    nbits = cover.shape[1] * 8
+    # Coverage sets as Python integers, one per distinct set; flight point p is bit nbits - 1 - p
+    sets = {}
+    for j in range(store.ncells):
+        s = int.from_bytes(cover[j].tobytes(), 'big')
+        if s and s not in sets:
+            sets[s] = j
+    cands = list(sets.items())
+    universe = 0
+    for s, j in cands:
+        universe |= s
+    # Candidates covering each flight point, branching starts at the least covered points
+    bypoint = {}
+    for k, (s, j) in enumerate(cands):
+        for p in np.flatnonzero(np.unpackbits(cover[j])[:store.npoints]):
+            bypoint.setdefault(int(p), []).append(k)
+    order = sorted(bypoint, key=lambda p: len(bypoint[p]))
+
+    def search(uncovered, chosen):
+        if timelimit is not None and time.time() - start > timelimit:
+            raise _Timeout()
+        if not uncovered:
+            if len(chosen) < len(best[0]):
+                best[0] = list(chosen)
+                print('Solution with {} observers found.'.format(len(chosen)))
+            return
+        left = bin(uncovered).count('1')
+        maxgain = max(bin(s & uncovered).count('1') for s, j in cands)
+        if len(chosen) + int(math.ceil(left / float(maxgain))) >= len(best[0]):
+            return
+        p = next(p for p in order if uncovered >> (nbits - 1 - p) & 1)
+        branches = {}
+        for k in bypoint[p]:
+            s, j = cands[k]
+            branches.setdefault(s & uncovered, j)
+        for s, j in sorted(branches.items(), key=lambda b: (-bin(b[0]).count('1'), b[1])):
+            chosen.append(j)
+            search(uncovered & ~s, chosen)
+            chosen.pop()
+
+    try:
+        search(universe, [])
+        proven = True
+    except _Timeout:
+        proven = False
+    return passorder(store, best[0], cover, weights), proven
+
+
+def timebudget(store, seconds=60.0, cover=None, weights=None, initial=None):
+    """
+    Time-budgeted minimum observer selection: returns the best solution found within the budget.
+    :param store: VisibilityStore object
+    :param seconds: Time budget (seconds)
+    :param cover: Coverage bits from coverbits(), computed if None
+    :param weights: Array of flight point (row) weights used to order the passes, 1 each if None
+    :param initial: Candidate cell indices warm-starting the search, see exact()
+    :return: Tuple of (list of selected candidate cell indices, True if proven minimal)
+    """
+    return exact(store, seconds, cover, weights, initial)
+
+
+def passorder(store, selected, cover=None, weights=None):
+    """
+    Orders a set of observers into passes, each pass taking the observer seeing the most remaining flight points.
+    :param store: VisibilityStore object
+    :param selected: List of candidate cell indices
+    :param cover: Coverage bits from coverbits(), computed if None
+    :param weights: Array of flight point (row) weights, 1 each if None
+    :return: List of candidate cell indices in pass order
+    """
+    if cover is None:
+        cover = np.packbits(store.columns(selected).T, axis=1)
+    else:
+        cover = cover[selected]
+    unseen = np.packbits(np.ones(store.npoints, dtype=bool))
+    left = list(range(len(selected)))
+    ordered = []
+    while left:
+        k = max(left, key=lambda k: (int(gains(cover[k:k + 1], unseen, weights)[0]), -selected[k]))
+        left.remove(k)
+        ordered.append(selected[k])
+        unseen &= ~cover[k]
+    return ordered
+
+
+SOLVERS = {'greedy': greedy, 'exact': exact, 'budget': timebudget}
+
+
+def solve(store, mode='greedy', **kwargs):
+    """
+    Selects observer locations with one of the solvers in SOLVERS.
+    :param store: VisibilityStore object
+    :param mode: 'greedy', 'exact' or 'budget'
+    :param kwargs: Solver options (maxpasses for greedy, timelimit or seconds for exact modes, cover for exact modes,
+                   weights and initial for all)
+    :return: List of selected candidate cell indices in pass order
+    """
+    print('Selecting observers with {} solver...'.format(mode))
+    if store.algorithm != 'sightlines':
+        print('Warning: visibility store filled with approximate {} viewsheds.'.format(store.algorithm))
+    selected = SOLVERS[mode](store, **kwargs)
+    if isinstance(selected, tuple):
+        selected, proven = selected
+        if proven:
+            print('Minimum number of observers proven: {}'.format(len(selected)))
+        else:
+            print('Time budget reached. Best solution: {} observers'.format(len(selected)))
+    return selected
+
+
+def besttable(store, selected):
+    """
+    Builds the best observers table and the flight points visible to each observer.
+    :param store: VisibilityStore object
+    :param selected: List of candidate cell indices in pass order
+    :return: Tuple of (structured array with BestSelect.BEST_DTYPE fields, dict of pass number to list of visible
+             OBJECTIDs)
+    """
+    best = BestSelect.besttable(len(selected))
+    best['POINT_X'], best['POINT_Y'] = store.cellxy(np.asarray(selected, dtype=np.int64))
+    unseen = np.ones(store.npoints, dtype=bool)
+    passleft = np.zeros(len(selected), dtype=np.int64)
+    obsvis = {}
+    for ct, j in enumerate(selected):
+        col = store.column(j)
+        passleft[ct] = unseen.sum()
+        best['PASS_VIS'][ct] = (col & unseen).sum()
+        best['OBSRVR_VIS'][ct] = col.sum()
+        obsvis[ct] = store.oids[col].tolist()
+        unseen &= ~col
+    BestSelect.fillcoverage(best, passleft, store.npoints)
+    return best, obsvis
+
+
+if __name__ == '__main__':
+    # Compare solvers on a synthetic DSM
+    import tempfile
+    import os
+    import SyntheticUrban
+    surface, xs, ys, zs, store = SyntheticUrban.syntheticstore(os.path.join(tempfile.mkdtemp(), 'vis'),
+                                                               nrows=150, ncols=150, nbldgs=150, altitude=2.0)
+    results = {}
+    for mode in ['greedy', 'exact']:
+        t = time.time()
+        results[mode] = solve(store, mode)
+        print('{}: {} observers in {:.2f}s'.format(mode, len(results[mode]), time.time() - t))
+    assert len(results['exact']) <= len(results['greedy'])
+    best, obsvis = besttable(store, results['exact'])
+    print(best)
@@ -0,0 +1,164 @@
+# --------------------------------------------------------
+# Multi-core viewshed generation
+# The surface is loaded once into shared memory (or memory-mapped from tiles); workers write viewsheds straight
+# into the visibility store
+# --------------------------------------------------------
+
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+import numpy as np
+import NumpyViewshed
+import VisibilityStore
+from TiledSurface import TiledSurface
+from ViewshedCache import ViewshedCache
+
+# Worker state, set by _initworker
+_worker = {}
+
+
+def sharesurface(surface):
+    """
+    Shares a surface with worker processes.
+    :param surface: NumpyViewshed.Surface or TiledSurface object
+    :return: Tuple of (source passed to attachsurface(), SharedMemory to close and unlink when done or None)
+    """
+    if isinstance(surface, TiledSurface):
+        return ('tiled', surface.path), None
+    shm = shared_memory.SharedMemory(create=True, size=max(surface.elev.nbytes, 1))
+    np.ndarray(surface.shape, dtype=np.float32, buffer=shm.buf)[:] = surface.elev
+    return ('shared', shm.name, surface.shape, (surface.xmin, surface.ymax, surface.cellsize)), shm
+
+
+def attachsurface(source):
+    """
+    Attaches a worker process to a surface shared by sharesurface(), keeping it in the worker state.
+    :param source: ('tiled', tile directory) or ('shared', shared memory name, shape, georeference)
+    :return: NumpyViewshed.Surface or TiledSurface object
+    """
+    if source[0] == 'tiled':
+        # Tiles are memory-mapped, so the operating system shares their pages between workers
+        _worker['surface'] = TiledSurface(source[1])
+    else:
+        shmname, shape, georef = source[1:]
+        shm = shared_memory.SharedMemory(name=shmname)
+        elev = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        _worker['shm'] = shm
+        _worker['surface'] = NumpyViewshed.Surface(elev, *georef)
+    return _worker['surface']
+
+
+def _initworker(source, storepath, xs, ys, zs, params, cachepath):
+    """
+    Attaches a worker process to the shared surface and opens the visibility store for writing.
+    :param source: ('tiled', tile directory) or ('shared', shared memory name, shape, georeference)
+    """
+    attachsurface(source)
+    _worker['store'] = VisibilityStore.openstore(storepath, 'r+')
+    _worker['points'] = (xs, ys, zs)
+    _worker['params'] = params
+    _worker['cache'] = None if cachepath is None else ViewshedCache(cachepath)
+    if cachepath is None:
+        # Cells excluded by the mask are never stored, so they are not evaluated. Cached viewsheds keep every
+        # cell so that they stay valid when the mask changes.
+        _worker['params'] = dict(params, targets=_worker['store'].targets)
+
+
+def _runchunk(chunk):
+    """
+    Computes the viewsheds of a chunk of flight points and stores them in their rows.
+    :param chunk: Tuple of (chunk number, first row, last row exclusive)
+    :return: Tuple of (chunk number, number of flight points, seconds, worker process id, cache hits, cache misses)
+    """
+    ct, start, end = chunk
+    t = time.time()
+    surface = _worker['surface']
+    store = _worker['store']
+    cache = _worker['cache']
+    xs, ys, zs = _worker['points']
+    hits, misses = (0, 0) if cache is None else (cache.hits, cache.misses)
+    for i in range(start, end):
+        if cache is None:
+            r0, c0, win = NumpyViewshed.viewshedwindow(surface, xs[i], ys[i], zs[i], **_worker['params'])
+        else:
+            r0, c0, win = cache.viewshedwindow(surface, xs[i], ys[i], zs[i], **_worker['params'])
+        store.setwindow(i, r0, c0, win)
+    store.flush()
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return ct, end - start, time.time() - t, os.getpid(), hits, misses
+
+
+def parallelviewshed(surface, xs, ys, zs, store, processes=None, chunksize=32, cachepath=None, **params):
+    """
+    Computes the viewsheds of all flight points in a process pool. Each flight point's viewshed is written to its own
+    row of the store, so the output does not depend on the order in which chunks finish.
+    :param surface: NumpyViewshed.Surface or TiledSurface object
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes, one per store row
+    :param store: VisibilityStore object
+    :param processes: Number of worker processes, all cores if None
+    :param chunksize: Number of flight points handed to a worker at once
+    :param cachepath: ViewshedCache directory shared by the workers, no caching if None
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: Dict of worker process id to (flight points, seconds)
+    """
+    VisibilityStore.checkalgorithm(params)
+    store.setalgorithm('sightlines')
+    n = len(xs)
+    chunks = [(ct, s, min(s + chunksize, n)) for ct, s in enumerate(range(0, n, chunksize))]
+    store.flush()
+    stats = {}
+    source, shm = sharesurface(surface)
+    try:
+        initargs = (source, store.path, np.asarray(xs, dtype=np.float64),
+                    np.asarray(ys, dtype=np.float64), np.asarray(zs, dtype=np.float64), params, cachepath)
+        print('Running viewshed analysis on {} flight points in {} chunks...'.format(n, len(chunks)))
+        start = time.time()
+        done = 0
+        hits = 0
+        misses = 0
+        pool = mp.Pool(processes, _initworker, initargs)
+        try:
+            for ct, count, seconds, pid, h, m in pool.imap_unordered(_runchunk, chunks):
+                done += count
+                hits += h
+                misses += m
+                pts, secs = stats.get(pid, (0, 0.0))
+                stats[pid] = (pts + count, secs + seconds)
+                print('Chunk {} complete. {}/{} flight points ({:.1f} points/s)'.format(
+                    ct, done, n, done / max(time.time() - start, 1e-9)))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+    if cachepath is not None:
+        print('Viewshed cache: {} hits, {} misses'.format(hits, misses))
+    for pid in sorted(stats):
+        pts, secs = stats[pid]
+        print('Worker {}: {} flight points in {:.1f}s ({:.2f} points/s)'.format(pid, pts, secs,
+                                                                            pts / max(secs, 1e-9)))
+    return stats
+
+
+if __name__ == '__main__':
+    # Check parallel fills, with and without the cache, against a serial fill on a synthetic DSM
+    import tempfile
+    import SyntheticUrban
+    from TiledSurface import writetiles
+    workdir = tempfile.mkdtemp()
+    surface, xs, ys, zs, serial = SyntheticUrban.syntheticstore(os.path.join(workdir, 'serial'))
+    tiled = writetiles(surface, os.path.join(workdir, 'tiles'), tilesize=32)
+    cachepath = os.path.join(workdir, 'cache')
+    runs = [('shared', surface, None), ('tiled', tiled, None), ('cold cache', surface, cachepath),
+            ('warm cache', surface, cachepath)]
+    for name, surf, cache in runs:
+        store = VisibilityStore.createstore(os.path.join(workdir, name.replace(' ', '_')), surface,
+                                            serial.targets, serial.oids)
+        parallelviewshed(surf, xs, ys, zs, store, processes=2, chunksize=8, cachepath=cache)
+        assert np.array_equal(np.asarray(store.bits), np.asarray(serial.bits)), \
+            'Parallel fill ({}) differs from serial fill'.format(name)
+    print('Parallel fills ({}) match the serial fill.'.format(', '.join(name for name, surf, cache in runs)))
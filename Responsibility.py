@@ -0,0 +1,170 @@
+# --------------------------------------------------------
+# Observer responsibility zones along the flight path
+# Assigns each flight point to one of the observers that see it, with as few hand-offs between observers as
+# possible along the flight sequence, and splits the path into contiguous responsibility segments
+# --------------------------------------------------------
+
+import numpy as np
+
+# Contiguous run of flight points under one observer; OBSERVER is the pass number, -1 where no observer sees the path
+SEGMENT_DTYPE = np.dtype([('SEGMENT', np.int64), ('OBSERVER', np.int64), ('START_OID', np.int64),
+                          ('END_OID', np.int64), ('START_SEQ', np.int64), ('END_SEQ', np.int64),
+                          ('NUM_PTS', np.int64)])
+
+
+def visibility(fltpts, obsvis, npasses=None):
+    """
+    Builds the flight point x observer visibility matrix from the flight points observed in each pass.
+    :param fltpts: Flight point OBJECTIDs in flight order
+    :param obsvis: Dict of pass number to list of visible flight point OBJECTIDs
+    :param npasses: Number of passes, all passes in obsvis if None
+    :return: Boolean array of shape (flight points, passes)
+    """
+    fltpts = np.asarray(fltpts, dtype=np.int64)
+    if npasses is None:
+        npasses = max(obsvis) + 1 if obsvis else 0
+    vis = np.zeros((len(fltpts), npasses), dtype=bool)
+    for c in range(npasses):
+        vis[:, c] = np.isin(fltpts, np.asarray(obsvis.get(c, []), dtype=np.int64))
+    return vis
+
+
+def storevisibility(store, selected):
+    """
+    Builds the flight point x observer visibility matrix from the visibility store, in store row order.
+    :param store: VisibilityStore object
+    :param selected: List of selected candidate cell indices in pass order
+    :return: Boolean array of shape (flight points, passes)
+    """
+    return store.columns(np.asarray(selected, dtype=np.int64))
+
+
+def runlengths(vis):
+    """
+    Counts, for every flight point and observer, how many consecutive flight points from there on the observer sees.
+    :param vis: Boolean array of shape (flight points, observers)
+    :return: Integer array shaped like vis
+    """
+    n = vis.shape[0]
+    seq = np.arange(n)[:, np.newaxis]
+    # Sequence number of the next flight point each observer does not see
+    blocked = np.where(vis, n, seq)
+    nextblocked = np.minimum.accumulate(blocked[::-1], axis=0)[::-1]
+    return nextblocked - seq
+
+
+def assign(vis):
+    """
+    Picks one responsible observer per flight point. From the start of each segment the observer seeing the longest
+    run of flight points takes over (lowest pass number on ties), which gives the fewest possible segments within each
+    stretch of seen flight points.
+    :param vis: Boolean array of shape (flight points, observers) in flight order
+    :return: Tuple of (responsible observer of each flight point, -1 if unseen; array of segment bounds
+             (start, end exclusive, observer))
+    """
+    n = vis.shape[0]
+    responsible = np.full(n, -1, dtype=np.int64)
+    if not n or not vis.shape[1]:
+        return responsible, np.array([(0, n, -1)] if n else [], dtype=np.int64).reshape(-1, 3)
+    runs = runlengths(vis)
+    best = np.argmax(runs, axis=1)
+    reach = runs[np.arange(n), best]
+    seen = reach > 0
+    # Next flight point seen by any observer, to jump over unseen stretches
+    nextseen = np.minimum.accumulate(np.where(seen, np.arange(n), n)[::-1])[::-1]
+    bounds = []
+    i = 0
+    while i < n:
+        if not seen[i]:
+            end = nextseen[i]
+            bounds.append((i, end, -1))
+        else:
+            end = i + reach[i]
+            bounds.append((i, end, best[i]))
+            responsible[i:end] = best[i]
+        i = end
+    return responsible, np.array(bounds, dtype=np.int64).reshape(-1, 3)
+
+
+def segments(fltpts, bounds):
+    """
+    Builds the responsibility segments table.
+    :param fltpts: Flight point OBJECTIDs in flight order
+    :param bounds: Segment bounds from assign()
+    :return: Structured array with SEGMENT_DTYPE fields
+    """
+    fltpts = np.asarray(fltpts, dtype=np.int64)
+    table = np.zeros(len(bounds), dtype=SEGMENT_DTYPE)
+    table['SEGMENT'] = np.arange(len(bounds))
+    table['OBSERVER'] = bounds[:, 2]
+    table['START_SEQ'] = bounds[:, 0]
+    table['END_SEQ'] = bounds[:, 1] - 1
+    table['START_OID'] = fltpts[bounds[:, 0]]
+    table['END_OID'] = fltpts[bounds[:, 1] - 1]
+    table['NUM_PTS'] = bounds[:, 1] - bounds[:, 0]
+    return table
+
+
+def handoffs(bounds):
+    """
+    Counts the hand-offs between observers along the flight path. Unseen stretches are skipped, so the same observer
+    before and after one is not a hand-off.
+    :param bounds: Segment bounds from assign()
+    :return: Number of hand-offs
+    """
+    observers = bounds[bounds[:, 2] >= 0, 2]
+    return int((np.diff(observers) != 0).sum())
+
+
+def observerlists(vis):
+    """
+    Lists the observers that see each flight point, as the text of the Observers field.
+    :param vis: Boolean array of shape (flight points, observers)
+    :return: List of comma-separated pass numbers, one per flight point
+    """
+    return [','.join(str(c) for c in np.flatnonzero(row)) for row in vis]
+
+
+def writeflightpoints(flightpts, fltpts, vis, responsible):
+    """
+    Writes the Observers and Responsible fields of the flight point feature class in one cursor pass. Requires arcpy.
+    :param flightpts: Path to flight point feature class
+    :param fltpts: Flight point OBJECTIDs in flight order, one per row of vis
+    :param vis: Boolean array of shape (flight points, observers)
+    :param responsible: Responsible observer of each flight point, -1 if unseen
+    """
+    import arcpy
+    fields = [f.name for f in arcpy.ListFields(flightpts)]
+    if 'Observers' not in fields:
+        arcpy.AddField_management(flightpts, 'Observers', 'TEXT')
+    if 'Responsible' not in fields:
+        arcpy.AddField_management(flightpts, 'Responsible', 'SHORT')
+    rows = dict(zip(np.asarray(fltpts).tolist(), zip(observerlists(vis), responsible.tolist())))
+    with arcpy.da.UpdateCursor(flightpts, ['OID@', 'Observers', 'Responsible']) as cursor:
+        for row in cursor:
+            observers, resp = rows.get(row[0], ('', -1))
+            cursor.updateRow([row[0], observers, resp])
+
+
+if __name__ == '__main__':
+    # Assign responsibility for a greedy observer set on a synthetic DSM
+    import os
+    import tempfile
+    import time
+    import ObserverSolver
+    import SyntheticUrban
+    surface, xs, ys, zs, store = SyntheticUrban.syntheticstore(os.path.join(tempfile.mkdtemp(), 'vis'),
+                                                               nrows=150, ncols=150, nbldgs=150, altitude=2.0)
+    selected = ObserverSolver.solve(store)
+    vis = storevisibility(store, selected)
+    t = time.time()
+    responsible, bounds = assign(vis)
+    print('Assigned {} flight points in {:.4f}s'.format(len(responsible), time.time() - t))
+    assert vis[responsible >= 0, responsible[responsible >= 0]].all(), 'Observer does not see assigned point'
+    assert np.array_equal(responsible >= 0, vis.any(axis=1)), 'Seen flight point left unassigned'
+    # Assigning each point to its first observer is the pass order used by the Observers field
+    first = np.where(vis.any(axis=1), np.argmax(vis, axis=1), -1)
+    naive = np.flatnonzero(np.diff(first[first >= 0]) != 0)
+    print('Hand-offs: {} (first observer in pass order: {})'.format(handoffs(bounds), len(naive)))
+    assert handoffs(bounds) <= len(naive)
+    print(segments(store.oids, bounds))
@@ -0,0 +1,26 @@
+# --------------------------------------------------------
+# Run NumPy viewshed analysis on all flight points across all cores
+# Writes the visibility store in place of the individual vs_<N> rasters
+# --------------------------------------------------------
+
+import FlightPoints
+import NumpyViewshed
+
+if __name__ == '__main__':
+    surface = "C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\UTD_Viewshed_SEV1.gdb\\Surface_SE_2m"
+    mask = "C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\UTD_Viewshed_SEV1.gdb\\BldgVegMask_V2_bin"
+    flightpts = 'C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\UTD_Viewshed_SEV1.gdb\\FlightPts_SE'
+    storepath = "C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\VisStore_SE"
+    # Viewsheds are cached independently of the mask, so an interrupted or re-masked run only computes what is missing
+    cachepath = "C:\\Users\\sjl170230\\Documents\\UTD_Viewshed_V3\\ViewshedCache"
+
+    surf = NumpyViewshed.surfacefromraster(surface)
+    # Flight point OBJECTIDs, locations and Altitude field (observer elevation used by Viewshed2), read in one pass;
+    # a CSV, GeoJSON or GeoPackage export can be read with FlightPoints.readflightpoints() instead
+    pts = FlightPoints.fromfeatureclass(flightpts)
+    print('Running viewshed analysis on {} flight points...'.format(len(pts)))
+
+    store = FlightPoints.viewshedstore(pts, surf, NumpyViewshed.maskfromraster(mask), storepath, cachepath=cachepath)
+
+    print('\n')
+    print('All viewshed processes executed.')
@@ -0,0 +1,191 @@
+# --------------------------------------------------------
+# Set cover instance reduction of the visibility store
+# Flight points with identical viewsheds are merged into weighted groups and candidate cells whose coverage is
+# dominated by another cell are dropped before observer selection; selections map back to the original store
+# --------------------------------------------------------
+
+import os
+import numpy as np
+import ObserverSolver
+import VisibilityStore
+from VisibilityStore import POPCOUNT
+
+# Number of candidate cells transposed at once
+CHUNK = 4096
+
+
+def pointgroups(store):
+    """
+    Groups flight points with identical coverage (the same set of candidate cells sees them).
+    :param store: VisibilityStore object
+    :return: Tuple of (group index of every flight point, row index of the first flight point of every group);
+             groups are numbered in flight point order
+    """
+    if not store.npoints:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    rows, first, inverse = np.unique(np.asarray(store.bits), axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[np.ravel(inverse)], first[order]
+
+
+def groupcover(store, reps):
+    """
+    Transposes the visibility store into bit-packed coverage sets over flight point groups.
+    :param store: VisibilityStore object
+    :param reps: Row index of one flight point per group
+    :return: uint8 array of shape (candidate cells, ceil(groups / 8))
+    """
+    cover = np.zeros((store.ncells, (len(reps) + 7) // 8), dtype=np.uint8)
+    for s in range(0, store.ncells, CHUNK):
+        js = np.arange(s, min(s + CHUNK, store.ncells))
+        cover[js] = np.packbits(store.columns(js)[reps].T, axis=1)
+    return cover
+
+
+def undominated(cover, xs, ys):
+    """
+    Finds the candidate cells worth keeping: cells that see at least one flight point group and whose coverage is
+    not a subset of another cell's. Of cells with identical coverage the one closest to the mean center of all cells
+    seeing a flight point is kept. This matches the greedy tie-break of the first pass only: later passes measure
+    from the mean center of the cells still seeing an unseen flight point, so greedy selections on the reduced
+    store may break ties differently than on the original store.
+    A minimum observer set always exists among the kept cells.
+    :param cover: Coverage bits from groupcover()
+    :param xs, ys: Arrays of candidate cell X and Y coordinates
+    :return: Array of kept candidate cell indices, ascending
+    """
+    sizes = POPCOUNT[cover].sum(axis=1, dtype=np.int64)
+    nonempty = np.flatnonzero(sizes > 0)
+    if not len(nonempty):
+        return nonempty
+    dist = np.hypot(xs[nonempty] - xs[nonempty].mean(), ys[nonempty] - ys[nonempty].mean())
+    nonempty = nonempty[np.argsort(dist, kind='stable')]
+    sets, first = np.unique(cover[nonempty], axis=0, return_index=True)
+    distinct = nonempty[first]
+    sizes = sizes[distinct]
+    # Distinct cells covering each group, to check each cell only against cells sharing its rarest group
+    members = np.unpackbits(sets, axis=1)[:, :cover.shape[1] * 8].astype(bool)
+    bygroup = [np.flatnonzero(members[:, g]) for g in range(members.shape[1])]
+    rarity = np.array([len(b) for b in bygroup], dtype=np.int64)
+    keep = np.ones(len(distinct), dtype=bool)
+    for k in range(len(distinct)):
+        groups = np.flatnonzero(members[k])
+        cands = bygroup[groups[np.argmin(rarity[groups])]]
+        cands = cands[sizes[cands] > sizes[k]]
+        if len(cands) and np.all((sets[cands] & sets[k]) == sets[k], axis=1).any():
+            keep[k] = False
+    return np.sort(distinct[keep])
+
+
+def reducestore(store, path):
+    """
+    Writes the reduced set cover instance as a visibility store: one row per flight point group (OBJECTID of its
+    first flight point) and one column per undominated candidate cell. The mapping back to the original store is
+    saved with it (groups.npy, cellmap.npy).
+    :param store: VisibilityStore object
+    :param path: Directory of the reduced store
+    :return: VisibilityStore object
+    """
+    groups, reps = pointgroups(store)
+    xs, ys = store.cellxy()
+    cellmap = undominated(groupcover(store, reps), xs, ys)
+    arrays = {'oids': store.oids[reps], 'cells': store.cells[cellmap], 'groups': groups, 'cellmap': cellmap}
+    header = dict(VisibilityStore.surfaceheader(store), algorithm=store.algorithm)
+    bits = VisibilityStore.writestore(path, header, arrays, 'bits.dat', np.uint8,
+                                      (len(reps), max((len(cellmap) + 7) // 8, 1)))
+    for s in range(0, len(reps), VisibilityStore.CHUNK):
+        rows = np.unpackbits(store.bits[reps[s:s + VisibilityStore.CHUNK]], axis=1)[:, cellmap]
+        bits[s:s + len(rows), :(len(cellmap) + 7) // 8] = np.packbits(rows, axis=1)
+    bits.flush()
+    del bits
+    return VisibilityStore.VisibilityStore(path)
+
+
+def reduction(reduced):
+    """
+    Loads the mapping of a reduced store back to its original store.
+    :param reduced: VisibilityStore object written by reducestore()
+    :return: Tuple of (group index of every original flight point, number of flight points in every group,
+             original column index of every reduced column)
+    """
+    groups = np.load(os.path.join(reduced.path, 'groups.npy'))
+    cellmap = np.load(os.path.join(reduced.path, 'cellmap.npy'))
+    return groups, np.bincount(groups, minlength=reduced.npoints), cellmap
+
+
+def shrinkage(store, reduced):
+    """
+    Reports how much the set cover instance shrank.
+    :param store: Original VisibilityStore object
+    :param reduced: VisibilityStore object written by reducestore()
+    :return: Dict of instance sizes and reductions (percent)
+    """
+    report = {'points': store.npoints, 'point_groups': reduced.npoints,
+              'cells': store.ncells, 'undominated_cells': reduced.ncells,
+              'points_reduction': (1 - reduced.npoints / float(max(store.npoints, 1))) * 100,
+              'cells_reduction': (1 - reduced.ncells / float(max(store.ncells, 1))) * 100,
+              'matrix_reduction': (1 - reduced.npoints * reduced.ncells /
+                                   float(max(store.npoints * store.ncells, 1))) * 100}
+    print('Flight points: {} -> {} groups ({:.1f}% fewer)'.format(store.npoints, reduced.npoints,
+                                                                  report['points_reduction']))
+    print('Candidate cells: {} -> {} undominated ({:.1f}% fewer)'.format(store.ncells, reduced.ncells,
+                                                                          report['cells_reduction']))
+    return report
+
+
+def groupoids(store, reduced):
+    """
+    Lists the original flight point OBJECTIDs merged into each row of the reduced store.
+    :param store: Original VisibilityStore object
+    :param reduced: VisibilityStore object written by reducestore()
+    :return: List of OBJECTID arrays, one per flight point group
+    """
+    groups, weights, cellmap = reduction(reduced)
+    order = np.argsort(groups, kind='stable')
+    return np.split(store.oids[order], np.cumsum(weights)[:-1])
+
+
+def solvereduced(store, path, mode='greedy', **kwargs):
+    """
+    Reduces the set cover instance, selects observers on the reduced store and maps them back to the original store.
+    Groups are weighted by their number of flight points so that greedy passes rank cells as on the original store;
+    ties may be broken differently (see undominated()).
+    :param store: VisibilityStore object
+    :param path: Directory of the reduced store
+    :param mode: ObserverSolver mode
+    :param kwargs: Solver options passed to ObserverSolver.solve()
+    :return: List of selected candidate cell indices of the original store in pass order
+    """
+    reduced = reducestore(store, path)
+    shrinkage(store, reduced)
+    groups, weights, cellmap = reduction(reduced)
+    selected = ObserverSolver.solve(reduced, mode, weights=weights, **kwargs)
+    return [int(j) for j in cellmap[selected]]
+
+
+if __name__ == '__main__':
+    # Compare selections on the original and reduced instances of a synthetic DSM
+    import tempfile
+    import time
+    import SyntheticUrban
+    workdir = tempfile.mkdtemp()
+    surface, xs, ys, zs, store = SyntheticUrban.syntheticstore(os.path.join(workdir, 'vis'), nrows=150, ncols=150,
+                                                               nbldgs=150, altitude=2.0)
+    for mode in ['greedy', 'exact']:
+        t = time.time()
+        full = ObserverSolver.solve(store, mode)
+        tfull = time.time() - t
+        t = time.time()
+        reduced = solvereduced(store, os.path.join(workdir, 'reduced_' + mode), mode)
+        tred = time.time() - t
+        print('{}: {} observers in {:.2f}s, reduced {} observers in {:.2f}s'.format(mode, len(full), tfull,
+                                                                                   len(reduced), tred))
+        # The reduced selection must still see every flight point seen from any candidate cell
+        seen = store.columns(reduced).any(axis=1)
+        assert np.array_equal(seen, store.rowcounts() > 0), 'Reduced selection misses flight points'
+        if mode == 'exact':
+            assert len(reduced) == len(full), 'Reduction changed the minimum number of observers'
+    best, obsvis = ObserverSolver.besttable(store, reduced)
+    print(best)
@@ -0,0 +1,138 @@
+# --------------------------------------------------------
+# Streaming viewshed pipeline
+# Viewsheds are produced by a generator with a bounded number in flight and fed straight into the visibility store
+# and the cumulative count, so no per-point raster is kept and the first pass is ready when the last viewshed is
+# --------------------------------------------------------
+
+import collections
+import multiprocessing as mp
+import time
+import numpy as np
+import NumpyViewshed
+import ParallelViewshed
+import VisibilityStore
+from CumulativeCount import CumulativeCount
+from ViewshedCache import ViewshedCache
+
+# Maximum number of viewsheds computed ahead of the consumer
+MAXQUEUE = 16
+
+# Worker state, set by _initworker
+_worker = {}
+
+
+def _initworker(source, params, cachepath):
+    """
+    Attaches a worker process to the shared surface.
+    :param source: Surface source from ParallelViewshed.sharesurface()
+    """
+    _worker['surface'] = ParallelViewshed.attachsurface(source)
+    _worker['params'] = params
+    _worker['cache'] = None if cachepath is None else ViewshedCache(cachepath)
+
+
+def _viewshed(surface, cache, x, y, z, params):
+    if cache is None:
+        return NumpyViewshed.viewshedwindow(surface, x, y, z, **params)
+    return cache.viewshedwindow(surface, x, y, z, **params)
+
+
+def _runpoint(point):
+    """
+    Computes one flight point viewshed in a worker, bit-packed for the trip back.
+    :param point: Tuple of (row, x, y, z)
+    :return: Tuple of (row, r0, c0, window shape, packed window bits)
+    """
+    i, x, y, z = point
+    r0, c0, win = _viewshed(_worker['surface'], _worker['cache'], x, y, z, _worker['params'])
+    return i, r0, c0, win.shape, np.packbits(win.ravel())
+
+
+def streamviewsheds(surface, xs, ys, zs, processes=1, maxqueue=MAXQUEUE, cachepath=None, **params):
+    """
+    Generates flight point viewsheds in flight point order. With several processes at most maxqueue viewsheds are
+    computed ahead of the consumer: a new flight point is only submitted when the consumer takes a viewshed.
+    :param surface: NumpyViewshed.Surface or TiledSurface object
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes
+    :param processes: Number of worker processes, computed in this process if 1, all cores if None
+    :param maxqueue: Maximum number of viewsheds in flight
+    :param cachepath: ViewshedCache directory, no caching if None
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: Generator of (row, r0, c0, vis) tuples, vis as returned by NumpyViewshed.viewshedwindow()
+    """
+    n = len(xs)
+    if processes == 1:
+        cache = None if cachepath is None else ViewshedCache(cachepath)
+        for i in range(n):
+            r0, c0, win = _viewshed(surface, cache, xs[i], ys[i], zs[i], params)
+            yield i, r0, c0, win
+        return
+    source, shm = ParallelViewshed.sharesurface(surface)
+    pool = mp.Pool(processes, _initworker, (source, params, cachepath))
+    try:
+        pending = collections.deque()
+        submitted = 0
+        while submitted < n or pending:
+            while submitted < n and len(pending) < maxqueue:
+                point = (submitted, float(xs[submitted]), float(ys[submitted]), float(zs[submitted]))
+                pending.append(pool.apply_async(_runpoint, (point,)))
+                submitted += 1
+            i, r0, c0, shape, bits = pending.popleft().get()
+            yield i, r0, c0, np.unpackbits(bits)[:shape[0] * shape[1]].astype(bool).reshape(shape)
+    finally:
+        pool.terminate()
+        pool.join()
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+
+def streamstore(surface, xs, ys, zs, store, processes=1, maxqueue=MAXQUEUE, cachepath=None, **params):
+    """
+    Streams flight point viewsheds into the visibility store and the first pass cumulative count at once.
+    :param surface: NumpyViewshed.Surface or TiledSurface object
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes, one per store row
+    :param store: VisibilityStore object opened read/write
+    :param processes: Number of worker processes, computed in this process if 1, all cores if None
+    :param maxqueue: Maximum number of viewsheds in flight
+    :param cachepath: ViewshedCache directory, no caching if None
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: CumulativeCount object over all flight points, ready for the first pass
+    """
+    VisibilityStore.checkalgorithm(params)
+    store.setalgorithm('sightlines')
+    if cachepath is None:
+        params.setdefault('targets', store.targets)
+    counts = np.zeros(store.ncells, dtype=np.int64)
+    n = len(xs)
+    print('Streaming viewsheds of {} flight points into the visibility store...'.format(n))
+    start = time.time()
+    for i, r0, c0, win in streamviewsheds(surface, xs, ys, zs, processes, maxqueue, cachepath, **params):
+        store.setwindow(i, r0, c0, win)
+        cols = store.colindex[r0:r0 + win.shape[0], c0:c0 + win.shape[1]]
+        # Candidate cells are unique within a window, so a plain fancy-index increment is safe
+        counts[cols[(cols >= 0) & win]] += 1
+        if (i + 1) % 100 == 0 or i + 1 == n:
+            print('{}/{} flight points ({:.1f} points/s)'.format(i + 1, n, (i + 1) / max(time.time() - start, 1e-9)))
+    store.flush()
+    return CumulativeCount(store, counts=counts)
+
+
+if __name__ == '__main__':
+    # Check the streamed store and count against a staged fill on a synthetic DSM
+    import os
+    import tempfile
+    import SyntheticUrban
+    import VisibilityStore
+    workdir = tempfile.mkdtemp()
+    surface, xs, ys, zs, staged = SyntheticUrban.syntheticstore(os.path.join(workdir, 'staged'))
+    mask = staged.targets
+    for processes in [1, 2]:
+        store = VisibilityStore.createstore(os.path.join(workdir, 'stream{}'.format(processes)), surface, mask,
+                                            staged.oids)
+        t = time.time()
+        cumulative = streamstore(surface, xs, ys, zs, store, processes=processes, maxqueue=4)
+        print('{} process(es): {:.2f}s'.format(processes, time.time() - t))
+        assert np.array_equal(np.asarray(store.bits), np.asarray(staged.bits)), 'Streamed store differs'
+        assert np.array_equal(cumulative.counts, cumulative.recompute()), 'Streamed count differs'
+    print('Streamed store and cumulative count match the staged fill.')
@@ -0,0 +1,181 @@
+# --------------------------------------------------------
+# Coarse-to-fine candidate observer search over a surface pyramid
+# Coverage is scored on max-aggregated surfaces first; only the best candidate cells are refined at full resolution
+# --------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import NumpyViewshed
+import ObserverSolver
+import VisibilityLookup
+import VisibilityStore
+
+
+def aggregate(surface, factor=2):
+    """
+    Aggregates a surface with the MAXIMUM statistic, as in ClipQuadSurface.py. Partial blocks at the edges are kept.
+    :param surface: NumpyViewshed.Surface object
+    :param factor: Aggregation factor
+    :return: NumpyViewshed.Surface object
+    """
+    nrows = -(-surface.shape[0] // factor)
+    ncols = -(-surface.shape[1] // factor)
+    padded = np.full((nrows * factor, ncols * factor), -np.inf, dtype=np.float32)
+    padded[:surface.shape[0], :surface.shape[1]] = np.where(np.isnan(surface.elev), -np.inf, surface.elev)
+    elev = padded.reshape(nrows, factor, ncols, factor).max(axis=(1, 3))
+    elev[np.isinf(elev)] = np.nan
+    return NumpyViewshed.Surface(elev, surface.xmin, surface.ymax, surface.cellsize * factor)
+
+
+def aggregatemask(mask, factor=2):
+    """
+    Aggregates an observer mask: a coarse cell is valid if any of its cells is valid.
+    :param mask: Boolean array
+    :param factor: Aggregation factor
+    :return: Boolean array
+    """
+    nrows = -(-mask.shape[0] // factor)
+    ncols = -(-mask.shape[1] // factor)
+    padded = np.zeros((nrows * factor, ncols * factor), dtype=bool)
+    padded[:mask.shape[0], :mask.shape[1]] = mask
+    return padded.reshape(nrows, factor, ncols, factor).any(axis=(1, 3))
+
+
+def buildpyramid(surface, mask, levels=4):
+    """
+    Builds a pyramid of surfaces and masks, each level aggregated by a factor of 2 (e.g. 8 m/4 m/2 m/1 m).
+    :param surface: NumpyViewshed.Surface object at full resolution
+    :param mask: Boolean observer mask at full resolution
+    :param levels: Number of levels, including full resolution
+    :return: List of (surface, mask) tuples from coarsest to full resolution
+    """
+    pyramid = [(surface, np.asarray(mask, dtype=bool))]
+    for level in range(1, levels):
+        pyramid.insert(0, (aggregate(pyramid[0][0]), aggregatemask(pyramid[0][1])))
+    return pyramid
+
+
+def prune(store, keep=0.5, perpoint=3):
+    """
+    Selects the candidate cells worth refining: the top fraction by cumulative count, plus the best cells seeing each
+    flight point so that no flight point loses all of its observers.
+    :param store: VisibilityStore object
+    :param keep: Fraction of candidate cells kept by count
+    :param perpoint: Number of cells kept for each flight point
+    :return: Boolean array shaped like the store's surface, True for surviving cells
+    """
+    counts = store.popcount()
+    survive = np.zeros(store.ncells, dtype=bool)
+    nkeep = int(np.ceil(keep * store.ncells))
+    if nkeep:
+        survive[np.argsort(-counts, kind='stable')[:nkeep]] = True
+    for i in range(store.npoints):
+        js = np.flatnonzero(store.row(i))
+        if len(js):
+            survive[js[np.argsort(-counts[js], kind='stable')[:perpoint]]] = True
+    survive &= counts > 0
+    return store.countraster(survive)
+
+
+def refine(coarse, fine):
+    """
+    Maps surviving coarse cells to the full-resolution cells they contain.
+    :param coarse: Boolean array of surviving coarse cells
+    :param fine: Shape of the finer level
+    :return: Boolean array of the finer level's shape
+    """
+    factor = 2
+    return np.repeat(np.repeat(coarse, factor, axis=0), factor, axis=1)[:fine[0], :fine[1]]
+
+
+def pyramidsearch(surface, mask, xs, ys, zs, path, oids=None, levels=4, keep=0.5, perpoint=3, **params):
+    """
+    Coarse-to-fine search: scores coverage at each pyramid level, keeps the best candidate cells and evaluates only
+    their children at the next level.
+    :param surface: NumpyViewshed.Surface object at full resolution
+    :param mask: Boolean observer mask at full resolution
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes
+    :param path: Directory of the full-resolution visibility store
+    :param oids: Array of flight point OBJECTIDs, 1..N if None
+    :param levels: Number of pyramid levels
+    :param keep: Fraction of candidate cells kept at each coarse level
+    :param perpoint: Number of cells kept for each flight point at each coarse level
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: VisibilityStore object at full resolution, limited to surviving candidate cells
+    """
+    if oids is None:
+        oids = np.arange(1, len(xs) + 1)
+    pyramid = buildpyramid(surface, mask, levels)
+    candidates = pyramid[0][1]
+    workdir = tempfile.mkdtemp()
+    try:
+        for level, (surf, msk) in enumerate(pyramid[:-1]):
+            store = VisibilityStore.createstore(os.path.join(workdir, str(level)), surf, candidates & msk, oids)
+            VisibilityStore.fillstore(store, surf, xs, ys, zs, **params)
+            survive = prune(store, keep, perpoint)
+            print('Level {} ({} m): {} of {} candidate cells kept'.format(level, surf.cellsize,
+                                                                       int(survive.sum()), store.ncells))
+            del store
+            candidates = refine(survive, pyramid[level + 1][0].shape)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    store = VisibilityStore.createstore(path, surface, candidates & pyramid[-1][1], oids)
+    VisibilityStore.fillstore(store, surface, xs, ys, zs, **params)
+    print('Full resolution: {} candidate cells evaluated'.format(store.ncells))
+    return store
+
+
+def benchmark(surface, mask, xs, ys, zs, levels=4, mode='greedy', **params):
+    """
+    Compares the pyramid search against a full-resolution run.
+    :param surface: NumpyViewshed.Surface object at full resolution
+    :param mask: Boolean observer mask at full resolution
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes
+    :param levels: Number of pyramid levels
+    :param mode: ObserverSolver mode
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: Dict of timings, speedup and solution differences
+    """
+    workdir = tempfile.mkdtemp()
+    try:
+        t = time.time()
+        full = VisibilityStore.createstore(os.path.join(workdir, 'full'), surface, mask, np.arange(1, len(xs) + 1))
+        VisibilityStore.fillstore(full, surface, xs, ys, zs, **params)
+        fullsel = ObserverSolver.solve(full, mode)
+        tfull = time.time() - t
+
+        t = time.time()
+        pyr = pyramidsearch(surface, mask, xs, ys, zs, os.path.join(workdir, 'pyramid'), levels=levels, **params)
+        pyrsel = ObserverSolver.solve(pyr, mode)
+        tpyr = time.time() - t
+
+        # Coverage of both solutions, measured on the full-resolution store
+        fullx, fully = full.cellxy(fullsel)
+        pyrx, pyry = pyr.cellxy(pyrsel)
+        fullcvrg = VisibilityLookup.visibilitymatrix(full, fullx, fully).any(axis=0).mean() * 100
+        pyrcvrg = VisibilityLookup.visibilitymatrix(full, pyrx, pyry).any(axis=0).mean() * 100
+        # Distance from each pyramid station to the nearest full-resolution station
+        if len(pyrx) and len(fullx):
+            shift = np.hypot(pyrx[:, np.newaxis] - fullx, pyry[:, np.newaxis] - fully).min(axis=1)
+        else:
+            shift = np.zeros(0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report = {'full_seconds': tfull, 'pyramid_seconds': tpyr, 'speedup': tfull / max(tpyr, 1e-9),
+              'full_observers': len(fullsel), 'pyramid_observers': len(pyrsel),
+              'full_coverage': fullcvrg, 'pyramid_coverage': pyrcvrg,
+              'mean_station_shift': float(shift.mean()) if len(shift) else 0.0}
+    for k in sorted(report):
+        print('{}: {}'.format(k, report[k]))
+    return report
+
+
+if __name__ == '__main__':
+    # Benchmark on a synthetic 1 m surface
+    import SyntheticUrban
+    surface = SyntheticUrban.urbansurface(320, 320, 1.0, nbldgs=150, seed=2)
+    xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude=2.0, spacing=60.0, interval=40.0)
+    benchmark(surface, SyntheticUrban.groundmask(surface), xs, ys, zs, levels=4)
@@ -0,0 +1,120 @@
+# --------------------------------------------------------
+# Synthetic urban surfaces and flight paths for testing the NumPy viewshed engine
+# without the UTD quad geodatabases
+# --------------------------------------------------------
+
+import numpy as np
+import NumpyViewshed
+import VisibilityStore
+
+
+def groundtrend(nrows, ncols, cellsize):
+    """
+    Ground elevation of the synthetic surfaces: around 180 m with a slight tilt, similar to the UTD campus.
+    :param nrows: Number of rows
+    :param ncols: Number of columns
+    :param cellsize: Cell size (meters)
+    :return: 2D array of ground elevations
+    """
+    rows, cols = np.mgrid[0:nrows, 0:ncols]
+    return 180.0 + 0.01 * rows * cellsize + 0.005 * cols * cellsize
+
+
+def urbansurface(nrows=200, ncols=200, cellsize=2.0, nbldgs=25, seed=0, ntrees=0):
+    """
+    Generates a reproducible digital surface model of gently sloping ground with rectangular buildings and,
+    optionally, round tree canopies.
+    :param nrows: Number of rows
+    :param ncols: Number of columns
+    :param cellsize: Cell size (meters)
+    :param nbldgs: Number of buildings
+    :param seed: Random seed
+    :param ntrees: Number of trees
+    :return: NumpyViewshed.Surface object
+    """
+    rng = np.random.RandomState(seed)
+    elev = groundtrend(nrows, ncols, cellsize)
+    for b in range(nbldgs):
+        h = rng.uniform(5.0, 30.0)
+        r = rng.randint(0, nrows)
+        c = rng.randint(0, ncols)
+        dr = rng.randint(3, max(4, nrows // 10))
+        dc = rng.randint(3, max(4, ncols // 10))
+        elev[r:r + dr, c:c + dc] = np.maximum(elev[r:r + dr, c:c + dc], elev[r, c] + h)
+    treecanopy(elev, cellsize, ntrees, rng)
+    return NumpyViewshed.Surface(elev, 0.0, nrows * cellsize, cellsize)
+
+
+def treecanopy(elev, cellsize, ntrees, rng):
+    """
+    Adds dome-shaped tree canopies to a surface in place.
+    :param elev: 2D array of elevations
+    :param cellsize: Cell size (meters)
+    :param ntrees: Number of trees
+    :param rng: numpy RandomState
+    """
+    ground = groundtrend(elev.shape[0], elev.shape[1], cellsize)
+    for t in range(ntrees):
+        h = rng.uniform(6.0, 15.0)
+        radius = rng.uniform(2.0, 6.0) / cellsize
+        r = rng.randint(0, elev.shape[0])
+        c = rng.randint(0, elev.shape[1])
+        k = int(np.ceil(radius))
+        r0, r1 = max(r - k, 0), min(r + k + 1, elev.shape[0])
+        c0, c1 = max(c - k, 0), min(c + k + 1, elev.shape[1])
+        rows, cols = np.mgrid[r0:r1, c0:c1]
+        d = np.hypot(rows - r, cols - c) / radius
+        crown = np.where(d <= 1, ground[r0:r1, c0:c1] + h * np.sqrt(np.clip(1 - d ** 2, 0, 1)), -np.inf)
+        elev[r0:r1, c0:c1] = np.maximum(elev[r0:r1, c0:c1], crown)
+
+
+def lawnmower(surface, altitude=60.0, spacing=40.0, interval=20.0, margin=10.0):
+    """
+    Generates a lawnmower (boustrophedon) flight path over a surface.
+    :param surface: NumpyViewshed.Surface object
+    :param altitude: Flight altitude above the highest surface cell (meters)
+    :param spacing: Distance between flight lines (meters)
+    :param interval: Distance between waypoints along a flight line (meters)
+    :param margin: Distance kept from the surface edge (meters)
+    :return: Tuple of X, Y, Z coordinate arrays in flight order
+    """
+    xmin = surface.xmin + margin
+    xmax = surface.xmin + surface.shape[1] * surface.cellsize - margin
+    ymax = surface.ymax - margin
+    ymin = surface.ymax - surface.shape[0] * surface.cellsize + margin
+    xs = []
+    ys = []
+    for i, y in enumerate(np.arange(ymax, ymin, -spacing)):
+        line = np.arange(xmin, xmax, interval)
+        if i % 2:
+            line = line[::-1]
+        xs.append(line)
+        ys.append(np.full(len(line), y))
+    xs = np.concatenate(xs)
+    ys = np.concatenate(ys)
+    zs = np.full(len(xs), np.nanmax(surface.elev) + altitude)
+    return xs, ys, zs
+
+
+def groundmask(surface, height=2.0):
+    """
+    Marks cells close to the local ground level as valid observer locations, like BldgVegMask.
+    :param surface: NumpyViewshed.Surface object
+    :param height: Maximum height above the ground trend (meters)
+    :return: Boolean array shaped like the surface
+    """
+    return surface.elev - groundtrend(surface.shape[0], surface.shape[1], surface.cellsize) < height
+
+
+def syntheticstore(path, nrows=100, ncols=100, cellsize=2.0, nbldgs=80, seed=1, altitude=5.0, spacing=40.0,
+                   interval=30.0):
+    """
+    Builds a visibility store for a synthetic surface and lawnmower flight path.
+    :param path: Store directory
+    :return: Tuple of (surface, X, Y, Z coordinate arrays, VisibilityStore object)
+    """
+    surface = urbansurface(nrows, ncols, cellsize, nbldgs, seed)
+    xs, ys, zs = lawnmower(surface, altitude, spacing, interval)
+    store = VisibilityStore.createstore(path, surface, groundmask(surface), np.arange(1, len(xs) + 1))
+    VisibilityStore.fillstore(store, surface, xs, ys, zs)
+    return surface, xs, ys, zs, store
@@ -0,0 +1,156 @@
+# --------------------------------------------------------
+# Tiled, memory-mapped surface store
+# Serves the window around each flight point from .npy tiles through an LRU tile cache, so memory use depends on
+# the search radius rather than on the study area and quads no longer need clipped copies of the campus surface
+# --------------------------------------------------------
+
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+import NumpyViewshed
+
+# Default tile size (cells)
+TILESIZE = 256
+# Default number of tiles kept open
+MAXTILES = 64
+
+
+class TiledSurface(NumpyViewshed.Surface):
+    """
+    Surface read from a directory of tiles written by writetiles() or tilesfromraster().
+    Can be used wherever a NumpyViewshed.Surface is expected; elevations are read through read().
+    :param path: Tile directory
+    :param maxtiles: Number of tiles kept in the LRU cache
+    """
+    def __init__(self, path, maxtiles=MAXTILES):
+        with open(os.path.join(path, 'header.json')) as f:
+            header = json.load(f)
+        self.path = path
+        self.xmin = header['xmin']
+        self.ymax = header['ymax']
+        self.cellsize = header['cellsize']
+        self.shape = tuple(header['shape'])
+        self.tilesize = header['tilesize']
+        self.maxtiles = maxtiles
+        self.tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def elev(self):
+        """
+        Whole surface, read from every tile. Only for small surfaces; use read() for windows.
+        """
+        return self.read(0, self.shape[0], 0, self.shape[1])
+
+    def tile(self, tr, tc):
+        """
+        Fetches a tile through the LRU cache.
+        :param tr, tc: Tile row and column
+        :return: 2D array of elevations
+        """
+        key = (tr, tc)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return self.tiles[key]
+        self.misses += 1
+        tile = np.load(os.path.join(self.path, 'tile_{}_{}.npy'.format(tr, tc)), mmap_mode='r')
+        self.tiles[key] = tile
+        while len(self.tiles) > self.maxtiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def read(self, r0, r1, c0, c1):
+        """
+        Reads a window of elevations from the tiles it overlaps.
+        :param r0, r1: First and last (exclusive) row of the window
+        :param c0, c1: First and last (exclusive) column of the window
+        :return: 2D array of elevations
+        """
+        ts = self.tilesize
+        r0, r1 = max(r0, 0), min(r1, self.shape[0])
+        c0, c1 = max(c0, 0), min(c1, self.shape[1])
+        out = np.full((max(r1 - r0, 0), max(c1 - c0, 0)), np.nan, dtype=np.float32)
+        if not out.size:
+            return out
+        for tr in range(r0 // ts, (r1 - 1) // ts + 1):
+            for tc in range(c0 // ts, (c1 - 1) // ts + 1):
+                tile = self.tile(tr, tc)
+                a0, a1 = max(r0, tr * ts), min(r1, (tr + 1) * ts)
+                b0, b1 = max(c0, tc * ts), min(c1, (tc + 1) * ts)
+                out[a0 - r0:a1 - r0, b0 - c0:b1 - c0] = tile[a0 - tr * ts:a1 - tr * ts, b0 - tc * ts:b1 - tc * ts]
+        return out
+
+
+def _writeheader(path, shape, xmin, ymax, cellsize, tilesize):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    header = {'shape': list(shape), 'xmin': xmin, 'ymax': ymax, 'cellsize': cellsize, 'tilesize': tilesize}
+    with open(os.path.join(path, 'header.json'), 'w') as f:
+        json.dump(header, f)
+
+
+def writetiles(surface, path, tilesize=TILESIZE):
+    """
+    Writes an in-memory surface as a tile directory.
+    :param surface: NumpyViewshed.Surface object
+    :param path: Tile directory
+    :param tilesize: Tile size (cells)
+    :return: TiledSurface object
+    """
+    _writeheader(path, surface.shape, surface.xmin, surface.ymax, surface.cellsize, tilesize)
+    for tr in range(0, surface.shape[0], tilesize):
+        for tc in range(0, surface.shape[1], tilesize):
+            np.save(os.path.join(path, 'tile_{}_{}.npy'.format(tr // tilesize, tc // tilesize)),
+                    np.ascontiguousarray(surface.read(tr, tr + tilesize, tc, tc + tilesize), dtype=np.float32))
+    return TiledSurface(path)
+
+
+def tilesfromraster(raster, path, tilesize=TILESIZE):
+    """
+    Writes a surface raster (e.g. the full campus surface_1m_V2) as a tile directory, reading one tile at a time.
+    Requires arcpy.
+    :param raster: Path to surface raster
+    :param path: Tile directory
+    :param tilesize: Tile size (cells)
+    :return: TiledSurface object
+    """
+    import arcpy
+    ras = arcpy.Raster(raster)
+    cs = ras.meanCellWidth
+    xmin = ras.extent.XMin
+    ymax = ras.extent.YMax
+    _writeheader(path, (ras.height, ras.width), xmin, ymax, cs, tilesize)
+    for tr in range(0, ras.height, tilesize):
+        for tc in range(0, ras.width, tilesize):
+            nrows = min(tilesize, ras.height - tr)
+            ncols = min(tilesize, ras.width - tc)
+            # RasterToNumPyArray windows are anchored at their lower left corner
+            corner = arcpy.Point(xmin + tc * cs, ymax - (tr + nrows) * cs)
+            tile = arcpy.RasterToNumPyArray(ras, corner, ncols, nrows, nodata_to_value=np.nan)
+            np.save(os.path.join(path, 'tile_{}_{}.npy'.format(tr // tilesize, tc // tilesize)),
+                    tile.astype(np.float32))
+    print('Surface written to {} as {}-cell tiles.'.format(path, tilesize))
+    return TiledSurface(path)
+
+
+if __name__ == '__main__':
+    # Check windows crossing tile boundaries and running past the surface edges against the in-memory surface
+    import tempfile
+    import SyntheticUrban
+    surface = SyntheticUrban.urbansurface(100, 90, 2.0, nbldgs=20, seed=3)
+    tiled = writetiles(surface, os.path.join(tempfile.mkdtemp(), 'tiles'), tilesize=32)
+    windows = [(0, 100, 0, 90), (30, 34, 30, 34), (31, 65, 0, 33), (95, 100, 60, 90), (0, 10, 0, 10),
+               (90, 110, 80, 95), (0, 103, 40, 41), (50, 50, 10, 20), (110, 120, 0, 10)]
+    rng = np.random.default_rng(0)
+    for k in range(200):
+        r0, c0 = rng.integers(0, 110, size=2)
+        windows.append((int(r0), int(r0 + rng.integers(0, 80)), int(c0), int(c0 + rng.integers(0, 80))))
+    for r0, r1, c0, c1 in windows:
+        assert np.array_equal(tiled.read(r0, r1, c0, c1), surface.read(r0, r1, c0, c1), equal_nan=True), \
+            'Tiled window ({}, {}, {}, {}) differs'.format(r0, r1, c0, c1)
+    assert np.array_equal(tiled.elev, surface.elev)
+    print('{} tiled windows match the in-memory surface ({} tile reads, {} cached).'.format(
+        len(windows), tiled.misses, tiled.hits))
@@ -0,0 +1,198 @@
+# --------------------------------------------------------
+# Content-addressed cache of flight point viewsheds on local disk
+# Keys hash the surface window, observer coordinates and viewshed parameters, so reruns only compute
+# flight points that are missing or whose inputs changed
+# --------------------------------------------------------
+
+import hashlib
+import os
+import numpy as np
+import NumpyViewshed
+import VisibilityStore
+
+# Default size bound of the cache directory (bytes)
+MAXBYTES = 2 * 1024 ** 3
+
+
+def viewshedparams(**params):
+    """
+    Completes a set of viewshed parameters with the NumpyViewshed defaults.
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: Dict of all viewshed parameters
+    """
+    full = {'offset': NumpyViewshed.SURFACE_OFFSET, 'radius': NumpyViewshed.OUTER_RADIUS,
+            'upper': NumpyViewshed.VERTICAL_UPPER, 'lower': NumpyViewshed.VERTICAL_LOWER,
+            'refraction': NumpyViewshed.REFRACTION, 'step': NumpyViewshed.STEP, 'algorithm': 'sightlines'}
+    full.update(params)
+    return full
+
+
+class ViewshedCache(object):
+    """
+    Directory of cached viewshed windows with least-recently-used eviction beyond a size bound.
+    Safe to share between processes: files are written atomically and missing files count as misses.
+    :param path: Cache directory
+    :param maxbytes: Maximum total size of cached files (bytes)
+    """
+    def __init__(self, path, maxbytes=MAXBYTES):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.size = sum(e.stat().st_size for e in os.scandir(path) if e.name.endswith('.npz'))
+
+    def key(self, surface, x, y, z, **params):
+        """
+        Builds the cache key of a flight point viewshed.
+        :param surface: NumpyViewshed.Surface object
+        :param x, y, z: Flight point coordinates and altitude
+        :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+        :return: Hex digest
+        """
+        params = viewshedparams(**params)
+        targets = params.pop('targets', None)
+        window = surface.window(x, y, params['radius'])
+        r0, r1, c0, c1 = window
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(surface.read(*window), dtype=np.float32).tobytes())
+        if targets is not None:
+            h.update(np.packbits(targets[r0:r1, c0:c1]).tobytes())
+        h.update(repr((window, surface.xmin, surface.ymax, surface.cellsize)).encode())
+        h.update(repr((float(x), float(y), float(z))).encode())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Fetches a cached viewshed window and marks it as recently used.
+        :param key: Cache key
+        :return: Tuple (r0, c0, vis) as returned by NumpyViewshed.viewshedwindow(), None if not cached
+        """
+        fname = os.path.join(self.path, key + '.npz')
+        try:
+            with np.load(fname) as f:
+                r0, c0, rows, cols = [int(v) for v in f['header']]
+                win = np.unpackbits(f['bits'])[:rows * cols].astype(bool).reshape(rows, cols)
+            os.utime(fname, None)
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return r0, c0, win
+
+    def put(self, key, r0, c0, win):
+        """
+        Stores a viewshed window, evicting least recently used entries beyond the size bound.
+        :param key: Cache key
+        :param r0, c0: Row and column of the window origin
+        :param win: Boolean visibility window
+        """
+        fname = os.path.join(self.path, key + '.npz')
+        tmp = fname + '.{}.tmp'.format(os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, header=np.array([r0, c0, win.shape[0], win.shape[1]], dtype=np.int64),
+                     bits=np.packbits(win.ravel()))
+        os.replace(tmp, fname)
+        self.size += os.path.getsize(fname)
+        if self.size > self.maxbytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes least recently used entries until the cache fits its size bound.
+        """
+        entries = []
+        for e in os.scandir(self.path):
+            if e.name.endswith('.npz'):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+        entries.sort()
+        self.size = sum(size for mtime, size, fname in entries)
+        for mtime, size, fname in entries:
+            if self.size <= self.maxbytes:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+            self.size -= size
+
+    def viewshedwindow(self, surface, x, y, z, **params):
+        """
+        Fetches a flight point viewshed from the cache, computing and storing it on a miss.
+        :param surface: NumpyViewshed.Surface object
+        :param x, y, z: Flight point coordinates and altitude
+        :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+        :return: Tuple (r0, c0, vis) as returned by NumpyViewshed.viewshedwindow()
+        """
+        key = self.key(surface, x, y, z, **params)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        r0, c0, win = NumpyViewshed.viewshedwindow(surface, x, y, z, **params)
+        self.put(key, r0, c0, win)
+        return r0, c0, win
+
+
+def cachedviewshed(surface, xs, ys, zs, store, cache, **params):
+    """
+    Fills the visibility store from the cache, computing only flight points that are missing or invalidated.
+    :param surface: NumpyViewshed.Surface object
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes, one per store row
+    :param store: VisibilityStore object
+    :param cache: ViewshedCache object
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :return: Tuple of (cache hits, cache misses)
+    """
+    VisibilityStore.checkalgorithm(params)
+    store.setalgorithm('sightlines')
+    hits, misses = cache.hits, cache.misses
+    for i in range(len(xs)):
+        r0, c0, win = cache.viewshedwindow(surface, xs[i], ys[i], zs[i], **params)
+        store.setwindow(i, r0, c0, win)
+    store.flush()
+    hits, misses = cache.hits - hits, cache.misses - misses
+    print('Viewshed cache: {} hits, {} misses'.format(hits, misses))
+    return hits, misses
+
+
+if __name__ == '__main__':
+    # Check resumed reruns, invalidation after a DSM edit and LRU eviction on a synthetic DSM
+    import tempfile
+    import SyntheticUrban
+    workdir = tempfile.mkdtemp()
+    surface = SyntheticUrban.urbansurface(100, 100, 2.0, nbldgs=40, seed=1)
+    xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude=5.0, spacing=40.0, interval=30.0)
+    store = VisibilityStore.createstore(os.path.join(workdir, 'vis'), surface, SyntheticUrban.groundmask(surface),
+                                        np.arange(1, len(xs) + 1))
+    params = {'radius': 60.0}
+    cache = ViewshedCache(os.path.join(workdir, 'cache'))
+    assert cachedviewshed(surface, xs, ys, zs, store, cache, **params) == (0, len(xs))
+    # A rerun (e.g. after an interruption) computes nothing
+    rerun = ViewshedCache(cache.path)
+    assert cachedviewshed(surface, xs, ys, zs, store, rerun, **params) == (len(xs), 0), 'Rerun missed the cache'
+    # Raising a building invalidates only the flight points whose window covers it
+    r, c = surface.rowcol(xs[0], ys[0])
+    surface.elev[r:r + 3, c:c + 3] += 10.0
+    touched = 0
+    for x, y in zip(xs, ys):
+        r0, r1, c0, c1 = surface.window(x, y, params['radius'])
+        touched += r0 < r + 3 and r < r1 and c0 < c + 3 and c < c1
+    hits, misses = cachedviewshed(surface, xs, ys, zs, store, rerun, **params)
+    assert misses == touched and hits == len(xs) - touched, 'DSM edit invalidated {} of {} windows'.format(
+        misses, touched)
+    fresh = VisibilityStore.createstore(os.path.join(workdir, 'fresh'), surface, store.targets, store.oids)
+    VisibilityStore.fillstore(fresh, surface, xs, ys, zs, direction='forward', **params)
+    assert np.array_equal(np.asarray(store.bits), np.asarray(fresh.bits)), 'Cached fill differs from a fresh fill'
+    print('DSM edit: {} of {} flight points recomputed.'.format(misses, len(xs)))
+    # A size bound of a few entries keeps only the most recently used ones
+    entry = max(e.stat().st_size for e in os.scandir(cache.path) if e.name.endswith('.npz'))
+    small = ViewshedCache(os.path.join(workdir, 'small'), maxbytes=4 * entry)
+    cachedviewshed(surface, xs, ys, zs, store, small, **params)
+    ondisk = sum(e.stat().st_size for e in os.scandir(small.path) if e.name.endswith('.npz'))
+    assert small.size == ondisk <= small.maxbytes, 'Cache exceeds its size bound'
+    last = small.key(surface, xs[-1], ys[-1], zs[-1], **params)
+    assert small.get(last) is not None, 'Most recently used entry was evicted'
+    print('LRU cache holds {} bytes of {} allowed.'.format(ondisk, small.maxbytes))
@@ -0,0 +1,39 @@
+# --------------------------------------------------------
+# Batch visibility lookup of flight points from observer locations
+# Replaces the per-point GetCellValue calls of findvisible with one read of the visibility store
+# --------------------------------------------------------
+
+import numpy as np
+
+
+def visibilitymatrix(store, xs, ys, fltpts=None):
+    """
+    Finds which flight points are visible from each of many candidate observer locations.
+    Locations outside the surface or excluded by the mask see no flight points.
+    :param store: VisibilityStore object
+    :param xs: X coordinates of candidate observer locations
+    :param ys: Y coordinates of candidate observer locations
+    :param fltpts: Flight point OBJECTIDs to test, all flight points if None
+    :return: Boolean array of shape (locations, flight points)
+    """
+    js = np.atleast_1d(store.cellindex(xs, ys))
+    vis = store.columns(np.maximum(js, 0)).T
+    vis[js < 0] = False
+    if fltpts is not None:
+        vis = vis[:, store.rowindex(fltpts)]
+    return vis
+
+
+def findvisible(store, fltpts, x, y):
+    """
+    Finds the flight points visible from an observer location.
+    :param store: VisibilityStore object
+    :param fltpts: List of flight point OBJECTIDs to test
+    :param x: X coordinate location
+    :param y: Y coordinate location
+    :return: List of observed flight point OBJECTIDs
+    """
+    fltpts = np.asarray(fltpts, dtype=np.int64)
+    observed = fltpts[visibilitymatrix(store, [x], [y], fltpts)[0]].tolist()
+    print('Number of visible flight points: {}'.format(len(observed)))
+    return observed
@@ -0,0 +1,461 @@
+# --------------------------------------------------------
+# Memory-mapped, bit-packed visibility matrix of flight points x candidate observer cells
+# Replaces the individual vs_<N> viewshed rasters
+# --------------------------------------------------------
+
+import json
+import os
+import numpy as np
+import NumpyViewshed
+
+# Number of rows unpacked at once when summing, bounds temporary memory
+CHUNK = 256
+
+# Number of candidate cells evaluated at once when filling the store from observer cells
+BLOCK = 512
+# Relative cost of one viewshed call compared to setting up one sightline, used to pick the fill direction
+CALLCOST = 2000
+# viewshedwindow() parameters that reverseviewshed() does not take
+FORWARDONLY = ('targets', 'algorithm')
+
+# Number of set bits in each byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class CellIndex(object):
+    """
+    Column index of surface cells, -1 where the mask excludes the cell. Looked up in the sorted candidate cells
+    rather than held as a surface-shaped array, so tiled surfaces never need one. Indexed like a 2D array, with two
+    slices (a window) or two arrays of rows and columns.
+    :param cells: Sorted array of flat surface indices of the candidate cells
+    :param shape: Surface shape
+    """
+    def __init__(self, cells, shape):
+        self.cells = cells
+        self.shape = shape
+
+    def lookup(self, flat):
+        """
+        Converts flat surface indices to column indices.
+        :param flat: Array of flat surface indices
+        :return: Array of column indices, -1 where the mask excludes the cell
+        """
+        flat = np.asarray(flat, dtype=np.int64)
+        if not len(self.cells):
+            return np.full(flat.shape, -1, dtype=np.int64)
+        js = np.minimum(np.searchsorted(self.cells, flat), len(self.cells) - 1)
+        return np.where(self.cells[js] == flat, js, -1)
+
+    def __getitem__(self, key):
+        rows, cols = key
+        if not (isinstance(rows, slice) and isinstance(cols, slice)):
+            return self.lookup(np.asarray(rows, dtype=np.int64) * self.shape[1] + np.asarray(cols, dtype=np.int64))
+        r0, r1 = rows.indices(self.shape[0])[:2]
+        c0, c1 = cols.indices(self.shape[1])[:2]
+        out = np.full((max(r1 - r0, 0), max(c1 - c0, 0)), -1, dtype=np.int64)
+        if not out.size:
+            return out
+        # Candidate cells of each window row are a run of the sorted cells
+        starts = np.arange(r0, r1, dtype=np.int64) * self.shape[1]
+        lo = np.searchsorted(self.cells, starts + c0)
+        n = np.searchsorted(self.cells, starts + c1) - lo
+        js = np.repeat(lo - np.cumsum(n) + n, n) + np.arange(n.sum())
+        row, col = np.divmod(self.cells[js], self.shape[1])
+        out[row - r0, col - c0] = js
+        return out
+
+
+class CellMask(object):
+    """
+    Candidate cells as a Boolean mask, sliced like a surface-shaped array (the targets of
+    NumpyViewshed.viewshedwindow()) without building one.
+    :param colindex: CellIndex object
+    """
+    def __init__(self, colindex):
+        self.colindex = colindex
+        self.shape = colindex.shape
+
+    def __getitem__(self, key):
+        return self.colindex[key] >= 0
+
+
+class CellStore(object):
+    """
+    Georeference, flight point OBJECTIDs and candidate cells of a store directory written by writestore(), shared
+    by visibility and height stores.
+    :param path: Store directory
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'header.json')) as f:
+            self.header = json.load(f)
+        self.shape = tuple(self.header['shape'])
+        self.xmin = self.header['xmin']
+        self.ymax = self.header['ymax']
+        self.cellsize = self.header['cellsize']
+        self.oids = np.load(os.path.join(path, 'oids.npy'))
+        self.cells = np.load(os.path.join(path, 'cells.npy'))
+        self.npoints = len(self.oids)
+        self.ncells = len(self.cells)
+        self.colindex = CellIndex(self.cells, self.shape)
+        # Cells excluded by the mask are never stored, so viewsheds need not evaluate them
+        self.targets = CellMask(self.colindex)
+
+    def rowindex(self, oids):
+        """
+        Converts flight point OBJECTIDs to row indices.
+        :param oids: Array of flight point OBJECTIDs
+        :return: Array of row indices
+        """
+        order = np.argsort(self.oids, kind='stable')
+        oids = np.asarray(oids, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.oids, oids, sorter=order), 0, max(self.npoints - 1, 0))
+        rows = order[pos]
+        if not np.array_equal(self.oids[rows], oids):
+            raise KeyError('Flight point OBJECTID not in store')
+        return rows
+
+    def cellindex(self, x, y):
+        """
+        Converts map coordinates to candidate cell (column) indices.
+        :param x: X coordinate(s)
+        :param y: Y coordinate(s)
+        :return: Array of column indices, -1 outside the surface or where the mask excludes the cell
+        """
+        row = np.floor((self.ymax - np.asarray(y, dtype=np.float64)) / self.cellsize).astype(np.int64)
+        col = np.floor((np.asarray(x, dtype=np.float64) - self.xmin) / self.cellsize).astype(np.int64)
+        inside = (row >= 0) & (row < self.shape[0]) & (col >= 0) & (col < self.shape[1])
+        return np.where(inside, self.colindex[np.clip(row, 0, self.shape[0] - 1),
+                                              np.clip(col, 0, self.shape[1] - 1)], -1)
+
+    def cellxy(self, js=None):
+        """
+        Map coordinates of candidate cell centers.
+        :param js: Array of column indices, all candidate cells if None
+        :return: Tuple of X and Y coordinate arrays
+        """
+        cells = self.cells if js is None else self.cells[np.asarray(js)]
+        row, col = np.divmod(cells, self.shape[1])
+        return self.xmin + (col + 0.5) * self.cellsize, self.ymax - (row + 0.5) * self.cellsize
+
+    def countraster(self, counts):
+        """
+        Expands per-cell counts to a surface-shaped array, 0 where the mask excludes the cell.
+        :param counts: Array over candidate cells
+        :return: Array shaped like the surface
+        """
+        out = np.zeros(self.shape[0] * self.shape[1], dtype=np.asarray(counts).dtype)
+        out[self.cells] = counts
+        return out.reshape(self.shape)
+
+
+class VisibilityStore(CellStore):
+    """
+    Visibility matrix stored in a directory: one bit per flight point (row) and candidate observer cell (column).
+    Only cells allowed by the building/vegetation mask are stored. Open with createstore() or openstore().
+    :param path: Store directory
+    :param mode: 'r' for read only, 'r+' for read/write
+    """
+    def __init__(self, path, mode='r'):
+        super(VisibilityStore, self).__init__(path)
+        # Viewshed algorithm of the fill, stores without one were filled with sightlines
+        self.algorithm = self.header.get('algorithm', 'sightlines')
+        self.nbytes = (self.ncells + 7) // 8
+        self.bits = np.memmap(os.path.join(path, 'bits.dat'), dtype=np.uint8, mode=mode,
+                              shape=(self.npoints, max(self.nbytes, 1)))
+
+    def flush(self):
+        """
+        Writes pending changes to disk.
+        """
+        self.bits.flush()
+
+    def setalgorithm(self, algorithm):
+        """
+        Records the viewshed algorithm the store was filled with in its header.
+        :param algorithm: NumpyViewshed.ALGORITHMS entry
+        """
+        self.header['algorithm'] = algorithm
+        with open(os.path.join(self.path, 'header.json'), 'w') as f:
+            json.dump(self.header, f)
+        self.algorithm = algorithm
+
+    def setrow(self, i, vis):
+        """
+        Stores the viewshed of a flight point.
+        :param i: Row (flight point) index
+        :param vis: Boolean array shaped like the surface
+        """
+        self.bits[i] = np.packbits(np.asarray(vis, dtype=bool).ravel()[self.cells])
+
+    def setwindow(self, i, r0, c0, win):
+        """
+        Stores the viewshed of a flight point given as a window, as returned by NumpyViewshed.viewshedwindow().
+        :param i: Row (flight point) index
+        :param r0, c0: Row and column of the window origin
+        :param win: Boolean visibility window
+        """
+        cols = self.colindex[r0:r0 + win.shape[0], c0:c0 + win.shape[1]]
+        keep = cols >= 0
+        row = np.zeros(self.ncells, dtype=bool)
+        row[cols[keep]] = win[keep]
+        self.bits[i] = np.packbits(row)
+
+    def setcolumns(self, j0, vis):
+        """
+        Stores the flight points seen from a run of consecutive candidate cells.
+        :param j0: First column (candidate cell) index
+        :param vis: Boolean array of shape (points, cells)
+        """
+        b0 = j0 >> 3
+        b1 = (j0 + vis.shape[1] + 7) >> 3
+        bits = np.unpackbits(self.bits[:, b0:b1], axis=1)
+        bits[:, j0 - 8 * b0:j0 - 8 * b0 + vis.shape[1]] = vis
+        self.bits[:, b0:b1] = np.packbits(bits, axis=1)
+
+    def row(self, i):
+        """
+        Fetches the viewshed of a flight point.
+        :param i: Row (flight point) index
+        :return: Boolean array over candidate cells
+        """
+        return np.unpackbits(self.bits[i])[:self.ncells].astype(bool)
+
+    def rowraster(self, i):
+        """
+        Fetches the viewshed of a flight point as a surface-shaped array, like a vs_<N> raster.
+        :param i: Row (flight point) index
+        :return: Boolean array shaped like the surface
+        """
+        vis = np.zeros(self.shape[0] * self.shape[1], dtype=bool)
+        vis[self.cells] = self.row(i)
+        return vis.reshape(self.shape)
+
+    def columns(self, js):
+        """
+        Fetches the flight points seen from candidate cells.
+        :param js: Array of column (candidate cell) indices
+        :return: Boolean array of shape (points, len(js))
+        """
+        js = np.asarray(js, dtype=np.int64)
+        return ((self.bits[:, js >> 3] >> (7 - (js & 7)).astype(np.uint8)) & 1).astype(bool)
+
+    def column(self, j):
+        """
+        Fetches the flight points seen from one candidate cell.
+        :param j: Column (candidate cell) index
+        :return: Boolean array over flight points
+        """
+        return self.columns([j])[:, 0]
+
+    def popcount(self, points=None, weights=None):
+        """
+        Counts, for every candidate cell, the flight points in a subset that it sees (the cumulative viewshed).
+        :param points: Array of row indices or Boolean row mask, all flight points if None
+        :param weights: Array of flight point (row) weights over all rows, 1 each if None
+        :return: Array of (weighted) counts over candidate cells
+        """
+        rows = np.arange(self.npoints) if points is None else np.asarray(points)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.int64)
+        counts = np.zeros(self.ncells, dtype=np.int64)
+        for s in range(0, len(rows), CHUNK):
+            chunk = np.sort(rows[s:s + CHUNK])
+            bits = np.unpackbits(self.bits[chunk], axis=1)[:, :self.ncells]
+            if weights is None:
+                counts += bits.sum(axis=0, dtype=np.int64)
+            else:
+                counts += weights[chunk].dot(bits.astype(np.int64))
+        return counts
+
+    def rowcounts(self, points=None):
+        """
+        Counts the candidate cells that see each flight point.
+        :param points: Array of row indices, all flight points if None
+        :return: Array of counts over the requested flight points
+        """
+        rows = self.bits if points is None else self.bits[np.asarray(points)]
+        return POPCOUNT[rows].sum(axis=1, dtype=np.int64)
+
+def validcells(surface, mask):
+    """
+    Finds the candidate observer cells: cells allowed by the mask that hold surface data. The surface and mask are
+    read in bands so that tiled surfaces are never loaded whole.
+    :param surface: NumpyViewshed.Surface or TiledSurface object
+    :param mask: Boolean array shaped like the surface (or an object sliced like one, e.g. CellMask), True where a
+                 ground observer may stand
+    :return: Tuple of (sorted array of flat surface indices, array of their elevations)
+    """
+    cells = []
+    elev = []
+    for r in range(0, surface.shape[0], CHUNK):
+        valid = np.asarray(mask[r:r + CHUNK, 0:surface.shape[1]], dtype=bool)
+        # Bands the mask excludes entirely (e.g. outside a quad) are not read from the surface
+        if not valid.any():
+            continue
+        band = surface.read(r, r + CHUNK, 0, surface.shape[1])
+        valid = valid & ~np.isnan(band)
+        cells.append(np.flatnonzero(valid.ravel()) + r * surface.shape[1])
+        elev.append(band[valid].astype(np.float64))
+    if not cells:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(cells).astype(np.int64), np.concatenate(elev)
+
+
+def writestore(path, header, arrays, data, dtype, shape):
+    """
+    Lays out a store directory: header.json, one .npy file per array and a zeroed memory-mapped data file.
+    :param path: Store directory, created if missing
+    :param header: Dict written to header.json
+    :param arrays: Dict of file name (without .npy) to array, e.g. oids and cells
+    :param data: File name of the data matrix, e.g. bits.dat
+    :param dtype: Data type of the data matrix
+    :param shape: Shape of the data matrix
+    :return: Data matrix memory-mapped read/write, for the caller to fill or delete
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(os.path.join(path, 'header.json'), 'w') as f:
+        json.dump(header, f)
+    for name, values in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), values)
+    return np.memmap(os.path.join(path, data), dtype=dtype, mode='w+', shape=shape)
+
+
+def surfaceheader(surface):
+    """
+    Georeference of a surface (or store) as written to store headers.
+    :param surface: NumpyViewshed.Surface, TiledSurface or store object
+    :return: Dict of shape, xmin, ymax and cellsize
+    """
+    return {'shape': list(surface.shape), 'xmin': surface.xmin, 'ymax': surface.ymax, 'cellsize': surface.cellsize}
+
+
+def createstore(path, surface, mask, oids):
+    """
+    Creates an empty visibility store on disk.
+    :param path: Store directory
+    :param surface: NumpyViewshed.Surface object
+    :param mask: Boolean array shaped like the surface (or CellMask), True where a ground observer may stand
+    :param oids: Array of flight point OBJECTIDs, one per row
+    :return: VisibilityStore object opened read/write
+    """
+    cells = validcells(surface, mask)[0]
+    bits = writestore(path, surfaceheader(surface), {'oids': np.asarray(oids, dtype=np.int64), 'cells': cells},
+                      'bits.dat', np.uint8, (len(oids), max((len(cells) + 7) // 8, 1)))
+    del bits
+    return VisibilityStore(path, 'r+')
+
+
+def openstore(path, mode='r'):
+    """
+    Opens an existing visibility store.
+    :param path: Store directory
+    :param mode: 'r' for read only, 'r+' for read/write
+    :return: VisibilityStore object
+    """
+    return VisibilityStore(path, mode)
+
+
+def choosedirection(store, surface, npoints, radius=NumpyViewshed.OUTER_RADIUS):
+    """
+    Picks the cheaper direction to fill the store. Both directions trace the same sightlines; they differ in the
+    number of viewshed calls and in the cells (forward) or flight points (reverse) scanned by each call.
+    :param store: VisibilityStore object
+    :param surface: NumpyViewshed.Surface object
+    :param npoints: Number of flight points
+    :param radius: Outer radius (meters)
+    :return: 'forward' (from flight points) or 'reverse' (from candidate observer cells)
+    """
+    windowcells = min((2 * radius / surface.cellsize + 1) ** 2, surface.shape[0] * surface.shape[1])
+    forward = npoints * (CALLCOST + windowcells)
+    reverse = store.ncells * (CALLCOST + npoints)
+    return 'forward' if forward <= reverse else 'reverse'
+
+
+def checkalgorithm(params, approximate=False):
+    """
+    Rejects approximate viewshed algorithms: visibility stores feed observer selection and reports, so they are only
+    filled with the sightline algorithm unless the caller opts in.
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    :param approximate: True to accept approximate algorithms (screening stores, see fillstore())
+    """
+    algorithm = params.get('algorithm', 'sightlines')
+    if algorithm not in NumpyViewshed.ALGORITHMS:
+        raise ValueError('Unknown viewshed algorithm: {}'.format(algorithm))
+    if algorithm != 'sightlines' and not approximate:
+        raise ValueError('Visibility stores are filled with the sightline algorithm only, not {} (approximate) '
+                         'unless approximate=True is passed to fillstore()'.format(algorithm))
+
+
+def fillstore(store, surface, xs, ys, zs, direction='auto', approximate=False, **params):
+    """
+    Computes the viewsheds of all flight points into a visibility store.
+    :param store: VisibilityStore object opened read/write
+    :param surface: NumpyViewshed.Surface object
+    :param xs, ys, zs: Arrays of flight point coordinates and altitudes, one per store row
+    :param direction: 'forward' from flight points, 'reverse' from candidate observer cells, or 'auto'
+    :param approximate: True to allow an approximate algorithm (e.g. xdraw) for a quick screening store. The
+                        algorithm is recorded in the store header; approximate fills always run forward.
+    :param params: Viewshed parameters passed to NumpyViewshed.viewshedwindow()
+    """
+    checkalgorithm(params, approximate)
+    store.setalgorithm(params.get('algorithm', 'sightlines'))
+    if store.algorithm != 'sightlines':
+        direction = 'forward'
+    if direction == 'auto':
+        direction = choosedirection(store, surface, len(xs), params.get('radius', NumpyViewshed.OUTER_RADIUS))
+    print('Filling visibility store ({} flight points x {} candidate cells) {}...'.format(
+        len(xs), store.ncells, 'from flight points' if direction == 'forward' else 'from observer cells'))
+    if direction == 'reverse':
+        for key in FORWARDONLY:
+            params.pop(key, None)
+        rows, cols = np.divmod(store.cells, store.shape[1])
+        for j0 in range(0, store.ncells, BLOCK):
+            j1 = min(j0 + BLOCK, store.ncells)
+            vis = np.zeros((store.npoints, j1 - j0), dtype=bool)
+            for j in range(j0, j1):
+                vis[:, j - j0] = NumpyViewshed.reverseviewshed(surface, rows[j], cols[j], xs, ys, zs, **params)
+            store.setcolumns(j0, vis)
+    else:
+        params.setdefault('targets', store.targets)
+        for i in range(len(xs)):
+            r0, c0, win = NumpyViewshed.viewshedwindow(surface, xs[i], ys[i], zs[i], **params)
+            store.setwindow(i, r0, c0, win)
+    store.flush()
+
+
+if __name__ == '__main__':
+    # Forward and reverse fills of a synthetic DSM, with the viewshed parameters spelled out, give the same store
+    import tempfile
+    import SyntheticUrban
+    workdir = tempfile.mkdtemp()
+    surface = SyntheticUrban.urbansurface(60, 60, 2.0, nbldgs=20, seed=2)
+    mask = SyntheticUrban.groundmask(surface)
+    xs, ys, zs = SyntheticUrban.lawnmower(surface, altitude=5.0, spacing=40.0, interval=30.0)
+    oids = np.arange(1, len(xs) + 1)
+    params = {'offset': NumpyViewshed.SURFACE_OFFSET, 'radius': 100.0, 'algorithm': 'sightlines'}
+    stores = {}
+    for direction in ['forward', 'reverse', 'auto']:
+        stores[direction] = createstore(os.path.join(workdir, direction), surface, mask, oids)
+        fillstore(stores[direction], surface, xs, ys, zs, direction=direction, **params)
+    for direction in ['reverse', 'auto']:
+        assert np.array_equal(np.asarray(stores[direction].bits), np.asarray(stores['forward'].bits)), \
+            '{} fill differs from forward fill'.format(direction)
+    print('Forward, reverse and auto fills match ({} flight points x {} candidate cells).'.format(
+        stores['forward'].npoints, stores['forward'].ncells))
+    try:
+        fillstore(stores['forward'], surface, xs, ys, zs, **dict(params, algorithm='xdraw'))
+    except ValueError as e:
+        print('Approximate fill rejected: {}'.format(e))
+    else:
+        raise AssertionError('XDraw fill was not rejected')
+    # Opting in gives a screening store marked as approximate in its header
+    screen = createstore(os.path.join(workdir, 'xdraw'), surface, mask, oids)
+    fillstore(screen, surface, xs, ys, zs, direction='reverse', approximate=True, **dict(params, algorithm='xdraw'))
+    assert openstore(screen.path).algorithm == 'xdraw'
+    exact = np.unpackbits(np.asarray(stores['forward'].bits), axis=1)
+    agree = (np.unpackbits(np.asarray(screen.bits), axis=1) == exact)[:, :screen.ncells].mean()
+    print('XDraw screening store: {:.2%} bit agreement with sightlines.'.format(agree))